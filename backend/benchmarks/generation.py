@@ -0,0 +1,213 @@
+"""Banc d'essai du générateur d'équipes.
+
+Rosters synthétiques reproductibles (graine fixe) : 10 à 60 joueurs, 2 à 6 équipes,
+avec ou sans gardiens, sans contraintes / contraintes légères / lourdes.
+
+    python backend/benchmarks/generation.py --output bench.json
+    python backend/benchmarks/generation.py --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+# server.py lit la configuration Mongo à l'import ; aucune connexion n'est ouverte ici
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from server import (  # noqa: E402
+    ContrainteAffinite, JoueurPresent, PlayerRecord, GENERATION_METHODS,
+    calculate_general, calculate_team_stats, check_constraints, run_team_generation,
+)
+
+ATTRIBUTS = ['vitesse', 'technique', 'tir', 'passe', 'defense', 'physique']
+ATTRIBUTS_GK = ['reflexes_gk', 'plongeon_gk', 'jeu_au_pied_gk']
+TAILLES = [10, 14, 20, 30, 40, 60]
+EQUIPES = [2, 3, 4, 6]
+NIVEAUX_CONTRAINTES = ['aucune', 'legeres', 'lourdes']
+
+
+def build_roster(n_joueurs: int, gardiens: bool, rng: random.Random) -> tuple:
+    joueurs_map, presents = {}, []
+    for i in range(n_joueurs):
+        gardien = gardiens and i % 7 == 0
+        data = {
+            'nom': f'Joueur {i}',
+            'postes': ['Gardien'] if gardien else [rng.choice(['Attaquant', 'Milieu', 'Défenseur'])],
+            **{a: round(rng.uniform(2, 9.5), 1) for a in ATTRIBUTS},
+            **{a: round(rng.uniform(5, 9.5) if gardien else 1.0, 1) for a in ATTRIBUTS_GK},
+        }
+        player = PlayerRecord.from_doc({**data, 'id': f'j{i:03d}', 'note_generale': calculate_general(data)})
+        joueurs_map[player.id] = player
+        note = min(10.0, max(1.0, round(player.note_generale + rng.uniform(-0.5, 0.5), 1)))
+        presents.append(JoueurPresent(joueur_id=player.id, note_temporaire=note))
+    return presents, joueurs_map
+
+
+def build_constraints(ids: list, nombre_equipes: int, niveau: str, rng: random.Random) -> list:
+    # Contraintes tirées d'une répartition de référence : elles restent toujours satisfiables
+    if niveau == 'aucune': return []
+    shuffled = ids[:]
+    rng.shuffle(shuffled)
+    reference = [shuffled[t::nombre_equipes] for t in range(nombre_equipes)]
+    n_lier, n_separer = (len(ids) // 10, len(ids) // 10) if niveau == 'legeres' else (len(ids) // 4, len(ids) // 5)
+    contraintes = []
+    for _ in range(max(n_lier, 1)):
+        team = rng.choice(reference)
+        contraintes.append(ContrainteAffinite(type='lier', joueurs=rng.sample(team, 2)))
+    for _ in range(max(n_separer, 1)):
+        teams = rng.sample(reference, min(nombre_equipes, 3))
+        contraintes.append(ContrainteAffinite(type='separer', joueurs=[rng.choice(t) for t in teams]))
+    return contraintes
+
+
+def scenarios(quick: bool):
+    tailles = [10, 20, 40] if quick else TAILLES
+    for n in tailles:
+        for t in EQUIPES:
+            if n < 2 * t: continue
+            for gardiens in (False, True):
+                for niveau in NIVEAUX_CONTRAINTES:
+                    yield n, t, gardiens, niveau
+
+
+def random_partition_acceptance(ids: list, nombre_equipes: int, contraintes: list, rng: random.Random, samples: int = 500) -> float:
+    # Taux d'acceptation d'un tirage uniforme (ancienne approche par rejet)
+    if not contraintes: return 1.0
+    accepted = 0
+    for _ in range(samples):
+        shuffled = ids[:]
+        rng.shuffle(shuffled)
+        teams = [shuffled[t::nombre_equipes] for t in range(nombre_equipes)]
+        accepted += check_constraints(teams, contraintes)
+    return accepted / samples
+
+
+def run_scenario(n, t, gardiens, niveau, methode, repeats, seed, time_budget) -> dict:
+    rng = random.Random(f'{seed}-{n}-{t}-{gardiens}-{niveau}')
+    presents, joueurs_map = build_roster(n, gardiens, rng)
+    ids = [jp.joueur_id for jp in presents]
+    contraintes = build_constraints(ids, t, niveau, rng)
+    durations, scores, attempts, rejects = [], [], [], []
+    erreur = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        try:
+            result = run_team_generation(presents, t, contraintes, joueurs_map, methode=methode, time_budget=time_budget)
+        except ValueError as e:
+            erreur = str(e)
+            break
+        durations.append(time.perf_counter() - started)
+        scores.append(result['score'])
+        attempts.append(result['tentatives'])
+        rejects.append(result['rejets'])
+    row = {
+        'scenario': f'{n}j-{t}e-{"gk" if gardiens else "sans_gk"}-{niveau}-{methode}',
+        'joueurs': n, 'equipes': t, 'gardiens': gardiens, 'contraintes': niveau, 'methode': methode,
+        'taux_acceptation_aleatoire': round(random_partition_acceptance(ids, t, contraintes, rng), 4),
+    }
+    if erreur:
+        return {**row, 'erreur': erreur}
+    total_time = sum(durations)
+    return {
+        **row,
+        'temps_median_s': round(statistics.median(durations), 4),
+        'tentatives_par_s': round(sum(attempts) / total_time) if total_time else None,
+        'taux_acceptation': round(sum(attempts) / max(sum(attempts) + sum(rejects), 1), 4),
+        'score_median': round(statistics.median(scores), 6),
+        'score_min': round(min(scores), 6),
+    }
+
+
+def micro_benchmarks(seed: int) -> dict:
+    # Coût unitaire des fonctions utilisées par les routes (stats d'équipe, contraintes)
+    rng = random.Random(seed)
+    presents, joueurs_map = build_roster(30, True, rng)
+    ids = [jp.joueur_id for jp in presents]
+    notes_map = {jp.joueur_id: jp.note_temporaire for jp in presents}
+    teams = [ids[t::4] for t in range(4)]
+    contraintes = build_constraints(ids, 4, 'lourdes', rng)
+    iterations = 2000
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for team in teams: calculate_team_stats(team, joueurs_map, notes_map)
+    stats_us = (time.perf_counter() - started) / iterations * 1e6
+    started = time.perf_counter()
+    for _ in range(iterations): check_constraints(teams, contraintes)
+    constraints_us = (time.perf_counter() - started) / iterations * 1e6
+    return {'calculate_team_stats_4_equipes_us': round(stats_us, 2), 'check_constraints_lourdes_us': round(constraints_us, 2)}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'inconnu'
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> int:
+    base = {r['scenario']: r for r in baseline['scenarios']}
+    regressions = 0
+    print(f"\nComparaison avec {baseline.get('revision', '?')} (tolérance {tolerance:.0%})")
+    for row in current['scenarios']:
+        old = base.get(row['scenario'])
+        if not old or 'erreur' in row or 'erreur' in old: continue
+        time_ratio = row['temps_median_s'] / max(old['temps_median_s'], 1e-9)
+        score_ratio = (row['score_median'] + 1e-9) / (old['score_median'] + 1e-9)
+        flag = ''
+        if time_ratio > 1 + tolerance or score_ratio > 1 + tolerance:
+            regressions += 1
+            flag = '  <-- régression'
+        print(f"{row['scenario']:<40} temps x{time_ratio:5.2f}  score x{score_ratio:5.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai du générateur d'équipes")
+    parser.add_argument('--methodes', default=','.join(GENERATION_METHODS), help='méthodes à mesurer, séparées par des virgules')
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--budget', type=float, default=None, help='budget temps par génération (s)')
+    parser.add_argument('--rapide', action='store_true', help='sous-ensemble réduit de scénarios')
+    parser.add_argument('--output', help='fichier JSON de résultats')
+    parser.add_argument('--compare', help='fichier JSON de référence à comparer')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    rows = []
+    for n, t, gardiens, niveau in scenarios(args.rapide):
+        for methode in args.methodes.split(','):
+            row = run_scenario(n, t, gardiens, niveau, methode, args.repetitions, args.seed, args.budget)
+            rows.append(row)
+            if 'erreur' in row:
+                print(f"{row['scenario']:<40} ERREUR {row['erreur']}")
+            else:
+                print(f"{row['scenario']:<40} {row['temps_median_s']:8.3f}s {row['tentatives_par_s'] or 0:>10} tent/s "
+                      f"acc {row['taux_acceptation']:.3f} (aléa {row['taux_acceptation_aleatoire']:.3f}) score {row['score_median']:.5f}")
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'repetitions': args.repetitions,
+        'micro': micro_benchmarks(args.seed),
+        'scenarios': rows,
+    }
+    print(json.dumps(results['micro']))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        sys.exit(1 if compare(results, baseline, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
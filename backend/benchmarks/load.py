@@ -0,0 +1,327 @@
+"""Banc de charge de bout en bout de l'API.
+
+L'application tourne dans ce processus (transport ASGI de httpx, sans réseau : on mesure
+un worker uvicorn, hors coût HTTP) contre une base de substitution :
+  - Mongo en mémoire (mongomock-motor), par défaut ;
+  - un mongod lancé pour l'occasion dans un répertoire temporaire (--mongod) ;
+  - une base existante (--mongo-url), dans une base jetable supprimée à la fin.
+
+Trafic scripté par phases, chacune jouée par N utilisateurs virtuels pendant D secondes :
+connexions (admin et invités), modifications du roster, rafales de génération, tempêtes
+de liens de partage, puis un mélange des quatre. Rapporte le débit et les latences
+p50 / p95 / p99 par route. mongomock est bien plus lent qu'un vrai Mongo : la base en
+mémoire sert à comparer deux révisions entre elles, --mongod à mesurer des latences réalistes.
+
+    pip install httpx mongomock-motor
+    python backend/benchmarks/load.py --duree 10 --utilisateurs 50 --output load.json
+    python backend/benchmarks/load.py --mongod $(which mongod) --compare load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+# server.py lit la configuration Mongo à l'import ; la base réelle est injectée ensuite.
+# L'import de server est différé pour que --executeur soit pris en compte.
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from benchmarks.mongomock_patch import patch_mongomock  # noqa: E402
+
+ADMIN_EMAIL = 'charge@example.com'
+ADMIN_PASSWORD = 'charge-admin-1234'
+ATTRIBUTS = ['vitesse', 'technique', 'tir', 'passe', 'defense', 'physique']
+POSTES = ['Attaquant', 'Milieu', 'Défenseur', 'Gardien']
+
+# Poids relatifs des actions de chaque phase
+PHASES = {
+    'connexions': {'login': 1, 'guest_login': 4, 'me': 2},
+    'roster': {'player_update': 3, 'presence_update': 3, 'players_page': 2, 'event_get': 2},
+    'generation': {'generate': 1},
+    'partage': {'share': 1},
+    'mixte': {'guest_login': 1, 'player_update': 2, 'presence_update': 2, 'players_page': 2,
+              'event_get': 2, 'generate': 1, 'share': 6},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mongod(binary: str) -> tuple:
+    dbpath = tempfile.mkdtemp(prefix='orga-charge-')
+    port = free_port()
+    process = subprocess.Popen([binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process, dbpath, f'mongodb://127.0.0.1:{port}'
+
+
+async def wait_for_mongo(client, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await client.admin.command('ping')
+            return
+        except Exception:
+            if time.monotonic() > deadline: raise
+            await asyncio.sleep(0.2)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, route: str, status: int, seconds: float):
+        self.latencies[route].append(seconds)
+        self.statuses[route][status] += 1
+
+    def report(self, duration: float) -> list:
+        rows = []
+        for route in sorted(self.latencies):
+            values = sorted(self.latencies[route])
+            cuts = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+            statuses = self.statuses[route]
+            rows.append({
+                'route': route,
+                'requetes': len(values),
+                'erreurs': sum(n for code, n in statuses.items() if code >= 400),
+                'statuts': {str(code): n for code, n in sorted(statuses.items())},
+                'debit_par_s': round(len(values) / duration, 2),
+                'p50_ms': round(cuts[49] * 1000, 2),
+                'p95_ms': round(cuts[94] * 1000, 2),
+                'p99_ms': round(cuts[98] * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+            })
+        return rows
+
+
+class Scenario:
+    # Données de départ et actions des utilisateurs virtuels
+    def __init__(self, http, recorder: Recorder, rng: random.Random):
+        self.http = http
+        self.recorder = recorder
+        self.rng = rng
+        self.headers = {}
+        self.player_ids, self.events, self.guest_code = [], [], None
+
+    async def call(self, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await self.http.request(method, url, **kwargs)
+        self.recorder.record(route, response.status_code, time.perf_counter() - started)
+        return response
+
+    async def seed(self, n_joueurs: int, n_evenements: int, presents: int, equipes: int):
+        response = await self.http.post('/api/auth/register', json={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+        if response.status_code != 200:
+            raise SystemExit(f"Base non vide ou inscription refusée ({response.status_code}) : utilisez une base dédiée")
+        self.headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+        lines = '\n'.join(json.dumps({
+            'nom': f'Joueur {i}',
+            'postes': [self.rng.choice(POSTES)],
+            **{a: round(self.rng.uniform(2, 9.5), 1) for a in ATTRIBUTS},
+        }) for i in range(n_joueurs))
+        response = await self.http.post('/api/players/import', params={'format': 'ndjson'}, content=lines, headers=self.headers)
+        response.raise_for_status()
+        self.player_ids = [p['id'] for p in (await self.http.get('/api/players', headers=self.headers)).json()]
+        for e in range(n_evenements):
+            joueurs = self.rng.sample(self.player_ids, min(presents, len(self.player_ids)))
+            response = await self.http.post('/api/events', headers=self.headers, json={
+                'nom_evenement': f'Soirée {e}',
+                'joueurs_presents': [{'joueur_id': j, 'note_temporaire': round(self.rng.uniform(4, 9), 1)} for j in joueurs],
+                'nombre_equipes': equipes,
+                'methode_generation': 'recherche_locale',
+            })
+            response.raise_for_status()
+            event = response.json()
+            # Une première génération pour que les liens de partage aient un instantané
+            (await self.http.post(f"/api/events/{event['id']}/generate", headers=self.headers)).raise_for_status()
+            self.events.append(event)
+        self.guest_code = (await self.http.get('/api/admin/guest-code', headers=self.headers)).json()['code']
+
+    async def login(self):
+        await self.call('POST /auth/login', 'POST', '/api/auth/login', json={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+
+    async def guest_login(self):
+        await self.call('POST /auth/guest-login', 'POST', '/api/auth/guest-login',
+                        json={'name': f'invite{self.rng.randrange(10000)}', 'code': self.guest_code})
+
+    async def me(self):
+        await self.call('GET /auth/me', 'GET', '/api/auth/me', headers=self.headers)
+
+    async def player_update(self):
+        await self.call('PUT /players/{id}', 'PUT', f'/api/players/{self.rng.choice(self.player_ids)}', headers=self.headers,
+                        json={self.rng.choice(ATTRIBUTS): round(self.rng.uniform(2, 9.5), 1)})
+
+    async def presence_update(self):
+        event = self.rng.choice(self.events)
+        joueur = self.rng.choice(event['joueurs_presents'])['joueur_id']
+        await self.call('PUT /events/{id}/joueurs-presents/{joueur_id}', 'PUT',
+                        f"/api/events/{event['id']}/joueurs-presents/{joueur}", headers=self.headers,
+                        json={'note_temporaire': round(self.rng.uniform(4, 9), 1)})
+
+    async def players_page(self):
+        await self.call('GET /players?limit', 'GET', '/api/players', headers=self.headers,
+                        params={'limit': 50, 'fields': 'nom,postes,note_generale'})
+
+    async def event_get(self):
+        await self.call('GET /events/{id}', 'GET', f"/api/events/{self.rng.choice(self.events)['id']}", headers=self.headers)
+
+    async def generate(self):
+        # reshuffle : chaque requête relance vraiment une recherche (pas de cache)
+        await self.call('POST /events/{id}/generate', 'POST', f"/api/events/{self.rng.choice(self.events)['id']}/generate",
+                        headers=self.headers, params={'reshuffle': 'true'})
+
+    async def share(self):
+        await self.call('GET /share/{token}', 'GET', f"/api/share/{self.rng.choice(self.events)['share_token']}")
+
+
+async def run_phase(scenario: Scenario, mix: dict, users: int, duration: float):
+    actions, weights = zip(*mix.items())
+    deadline = time.monotonic() + duration
+
+    async def user():
+        while time.monotonic() < deadline:
+            await getattr(scenario, scenario.rng.choices(actions, weights)[0])()
+
+    await asyncio.gather(*(user() for _ in range(users)))
+
+
+async def run(args) -> dict:
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("httpx est requis : pip install httpx")
+    import server
+
+    mongod = dbpath = None
+    if args.mongo_url or args.mongod:
+        url = args.mongo_url
+        if args.mongod:
+            mongod, dbpath, url = start_mongod(args.mongod)
+        name = f'orga_charge_{uuid.uuid4().hex[:8]}'
+        mongo_client, database = server.connect_database(url, name)
+        await wait_for_mongo(mongo_client)
+        base = 'mongod' if args.mongod else 'mongo-url'
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("mongomock-motor est requis pour la base en mémoire : pip install mongomock-motor")
+        patch_mongomock()
+        mongo_client = AsyncMongoMockClient(tz_aware=True)
+        database = mongo_client['orga_charge']
+        base = 'memoire'
+    server.use_database(database, mongo_client)
+
+    phases = {}
+    try:
+        # Le transport ASGI ne déclenche pas les événements startup : index et migrations ici
+        await server.bootstrap_database()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://charge', timeout=60) as http:
+            scenario = Scenario(http, Recorder(), random.Random(args.seed))
+            await scenario.seed(args.joueurs, args.evenements, args.presents, args.equipes)
+            for name in args.phases.split(','):
+                scenario.recorder = Recorder()
+                started = time.monotonic()
+                await run_phase(scenario, PHASES[name], args.utilisateurs, args.duree)
+                elapsed = time.monotonic() - started
+                rows = scenario.recorder.report(elapsed)
+                phases[name] = {'duree_s': round(elapsed, 2), 'routes': rows}
+                print(f"\n== {name} ({args.utilisateurs} utilisateurs, {elapsed:.1f}s)")
+                for row in rows:
+                    print(f"{row['route']:<48} {row['requetes']:>6} req {row['debit_par_s']:>8.1f}/s "
+                          f"p50 {row['p50_ms']:>8.1f}  p95 {row['p95_ms']:>8.1f}  p99 {row['p99_ms']:>8.1f} ms"
+                          f"{'  erreurs ' + str(row['statuts']) if row['erreurs'] else ''}")
+    finally:
+        if base != 'memoire':
+            try:
+                await mongo_client.drop_database(database.name)
+            except Exception:
+                pass
+        await server.shutdown_db_client()
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait(timeout=10)
+            shutil.rmtree(dbpath, ignore_errors=True)
+    return {'base': base, 'phases': phases}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'inconnu'
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> int:
+    # Régression : p95 plus lent ou débit plus faible que la référence, au-delà de la tolérance
+    regressions = 0
+    print(f"\nComparaison avec {baseline.get('revision', '?')} (tolérance {tolerance:.0%})")
+    for phase, data in current['phases'].items():
+        old_rows = {r['route']: r for r in baseline.get('phases', {}).get(phase, {}).get('routes', [])}
+        for row in data['routes']:
+            old = old_rows.get(row['route'])
+            if not old: continue
+            p95_ratio = row['p95_ms'] / max(old['p95_ms'], 1e-9)
+            rate_ratio = row['debit_par_s'] / max(old['debit_par_s'], 1e-9)
+            flag = ''
+            if p95_ratio > 1 + tolerance or rate_ratio < 1 - tolerance:
+                regressions += 1
+                flag = '  <-- régression'
+            print(f"{phase:<11} {row['route']:<48} p95 x{p95_ratio:5.2f}  débit x{rate_ratio:5.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de charge de l'API")
+    parser.add_argument('--phases', default=','.join(PHASES), help='phases à jouer, séparées par des virgules')
+    parser.add_argument('--duree', type=float, default=10, help='durée de chaque phase (s)')
+    parser.add_argument('--utilisateurs', type=int, default=20, help='utilisateurs virtuels simultanés')
+    parser.add_argument('--joueurs', type=int, default=200)
+    parser.add_argument('--evenements', type=int, default=10)
+    parser.add_argument('--presents', type=int, default=20, help='joueurs présents par événement')
+    parser.add_argument('--equipes', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--executeur', choices=['process', 'thread'], help='pool de génération (GENERATION_EXECUTOR)')
+    parser.add_argument('--mongod', help='binaire mongod à lancer dans un répertoire temporaire')
+    parser.add_argument('--mongo-url', help='Mongo existant (une base jetable y est créée puis supprimée)')
+    parser.add_argument('--output', help='fichier JSON de résultats')
+    parser.add_argument('--compare', help='fichier JSON de référence à comparer')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    unknown = set(args.phases.split(',')) - set(PHASES)
+    if unknown: parser.error(f"phases inconnues : {', '.join(sorted(unknown))}")
+    if args.executeur: os.environ['GENERATION_EXECUTOR'] = args.executeur
+
+    results = {
+        'revision': git_revision(),
+        'utilisateurs': args.utilisateurs,
+        'duree_phase_s': args.duree,
+        **asyncio.run(run(args)),
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        sys.exit(1 if compare(results, baseline, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
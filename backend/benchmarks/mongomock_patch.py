@@ -0,0 +1,26 @@
+"""Correctif de mongomock partagé par le banc de charge (load.py) et les tests (tests/).
+
+mongomock relit le document après find_one_and_update avec le filtre d'origine (faux dès
+que la modification touche un champ filtré, comme la version) et remplace le filtre par
+_id avant l'update (ce qui casse l'opérateur positionnel $, joueurs_presents.$.note_temporaire).
+"""
+
+
+def patch_mongomock():
+    # Import différé : mongomock n'est requis que pour la base en mémoire
+    from mongomock.collection import Collection, ReturnDocument
+
+    def find_and_modify(self, query, projection=None, update=None, upsert=False, sort=None,
+                        return_document=ReturnDocument.BEFORE, session=None, **kwargs):
+        old = self.find_one(query, sort=sort)
+        if not old and not upsert: return None
+        if kwargs.get('remove'):
+            self.delete_one({'_id': old['_id']})
+            return old
+        # Filtre d'origine conservé (position du $), restreint au document trouvé
+        updated = self._update(dict(query, _id=old['_id']) if old else query, update, upsert)
+        if return_document is ReturnDocument.AFTER or kwargs.get('new'):
+            return self.find_one({'_id': updated['upserted'] or old['_id']}, projection)
+        return old
+
+    Collection._find_and_modify = find_and_modify
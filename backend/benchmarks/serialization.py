@@ -0,0 +1,128 @@
+"""Banc d'essai de la sérialisation des réponses de liste.
+
+Compare, pour N documents (1000 par défaut), l'ancien chemin (dates en chaînes ISO,
+conversion fromisoformat, validation pydantic puis json de FastAPI) et le chemin
+allégé (dates BSON natives sérialisées directement par orjson) : temps et allocations.
+
+    python backend/benchmarks/serialization.py --documents 1000 --output serial.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+# server.py lit la configuration Mongo à l'import ; aucune connexion n'est ouverte ici
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+import orjson  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from server import Event, PlayerInDB, calculate_general  # noqa: E402
+
+ATTRIBUTS = ['vitesse', 'technique', 'tir', 'passe', 'defense', 'physique', 'reflexes_gk', 'plongeon_gk', 'jeu_au_pied_gk']
+
+
+def player_docs(n: int, rng: random.Random) -> List[dict]:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(n):
+        doc = {
+            'nom': f'Joueur {i}', 'postes': [rng.choice(['Attaquant', 'Milieu', 'Défenseur', 'Gardien'])],
+            **{a: round(rng.uniform(1, 10), 1) for a in ATTRIBUTS},
+            'id': str(uuid.UUID(int=rng.getrandbits(128))), 'created_at': start + timedelta(minutes=i),
+        }
+        doc['note_generale'] = calculate_general(doc)
+        docs.append(doc)
+    return docs
+
+
+def event_docs(n: int, players: List[dict], rng: random.Random) -> List[dict]:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(n):
+        presents = rng.sample(players, min(14, len(players)))
+        docs.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))), 'nom_evenement': f'Match {i}', 'organisateur_id': 'admin',
+            'joueurs_presents': [{'joueur_id': p['id'], 'note_temporaire': p['note_generale']} for p in presents],
+            'nombre_equipes': 2, 'contraintes_affinite': [],
+            'equipes_generees': [[p['id'] for p in presents[::2]], [p['id'] for p in presents[1::2]]],
+            'share_token': str(uuid.UUID(int=rng.getrandbits(128))), 'created_at': start + timedelta(hours=i),
+            'warning_message': None, 'methode_generation': 'aleatoire', 'version': 1,
+        })
+    return docs
+
+
+def as_legacy(docs: List[dict]) -> List[dict]:
+    # Documents tels que stockés avant la migration : created_at en chaîne ISO
+    return [{**d, 'created_at': d['created_at'].isoformat()} for d in docs]
+
+
+def legacy_path(docs: List[dict], adapter: TypeAdapter) -> bytes:
+    # Ancien chemin : boucle fromisoformat, validation du response_model, rendu JSONResponse
+    for doc in docs:
+        if isinstance(doc.get('created_at'), str):
+            doc['created_at'] = datetime.fromisoformat(doc['created_at'])
+    content = adapter.dump_python(adapter.validate_python(docs), mode='json')
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+
+def lean_path(docs: List[dict], adapter: TypeAdapter) -> bytes:
+    return orjson.dumps(docs)
+
+
+def measure(path, make_docs, adapter, repeats: int) -> dict:
+    durations = []
+    for _ in range(repeats):
+        docs = make_docs()
+        started = time.perf_counter()
+        body = path(docs, adapter)
+        durations.append(time.perf_counter() - started)
+    docs = make_docs()
+    tracemalloc.start()
+    path(docs, adapter)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'temps_median_ms': round(statistics.median(durations) * 1000, 3),
+        'temps_min_ms': round(min(durations) * 1000, 3),
+        'pic_allocations_ko': round(peak / 1024, 1),
+        'taille_reponse_ko': round(len(body) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Banc d\'essai de la sérialisation des listes')
+    parser.add_argument('--documents', type=int, default=1000)
+    parser.add_argument('--repetitions', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='fichier JSON de résultats')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    players = player_docs(args.documents, rng)
+    events = event_docs(args.documents, players, rng)
+    results = {'documents': args.documents, 'repetitions': args.repetitions, 'routes': {}}
+    for route, docs, model in (('GET /players', players, PlayerInDB), ('GET /events', events, Event)):
+        adapter = TypeAdapter(List[model])
+        avant = measure(legacy_path, lambda: as_legacy(docs), adapter, args.repetitions)
+        apres = measure(lean_path, lambda: [dict(d) for d in docs], adapter, args.repetitions)
+        gain = avant['temps_median_ms'] / max(apres['temps_median_ms'], 1e-9)
+        results['routes'][route] = {'avant': avant, 'apres': apres, 'acceleration': round(gain, 1)}
+        print(f"{route:<14} avant {avant['temps_median_ms']:8.2f} ms {avant['pic_allocations_ko']:8.1f} Ko | "
+              f"après {apres['temps_median_ms']:8.2f} ms {apres['pic_allocations_ko']:8.1f} Ko | x{gain:.1f}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
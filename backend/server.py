@@ -1,29 +1,167 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Body, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Body, Response, Header, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne, ReturnDocument
+from pymongo.errors import PyMongoError, OperationFailure, BulkWriteError
+from pymongo import monitoring
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, field_validator
+from typing import List, Optional, Dict, Any, Iterator, Literal, get_args
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import random
-from itertools import combinations
+import heapq
+import math
+import time
+import numpy as np
+from itertools import combinations, islice, permutations
 import secrets
 import string
+import json
+import orjson
+import csv
+import io
+import codecs
+import base64
+import hashlib
+from collections import OrderedDict, Counter, defaultdict, deque
+import asyncio
+import functools
+import contextlib
+import contextvars
+import sys
+import bisect
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ============= MÉTRIQUES (format texte Prometheus) =============
+# Registre minimal en mémoire, propre à chaque processus (un worker uvicorn = une série).
+# Les écouteurs pymongo s'exécutent dans les threads de Motor : chaque métrique a son verrou.
+METRICS: List["Metric"] = []
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(labels: tuple) -> str:
+    if not labels: return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+class Metric:
+    def __init__(self, name: str, kind: str, help_text: str, buckets: Optional[tuple] = None):
+        self.name, self.kind, self.help_text = name, kind, help_text
+        self.buckets = buckets or DEFAULT_BUCKETS
+        self.values: Dict[tuple, Any] = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock: self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        with self.lock: self.values[tuple(sorted(labels.items()))] = value
+
+    def observe(self, value: float, **labels):
+        # Comptes par intervalle (cumulés au rendu), puis somme et nombre d'observations
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None: entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets): entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(k, list(v) if isinstance(v, list) else v) for k, v in self.values.items()]
+        for key, value in items:
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets, value):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', repr(float(bound))),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {value[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {value[-2]}")
+            lines.append(f"{self.name}_count{format_labels(key)} {value[-1]}")
+        return lines
+
+http_request_seconds = Metric("orga_http_request_duration_seconds", "histogram", "Durée des requêtes HTTP par route (jusqu'aux en-têtes de réponse)")
+http_in_flight = Metric("orga_http_requests_in_flight", "gauge", "Requêtes HTTP en cours de traitement par route")
+mongo_command_seconds = Metric("orga_mongo_command_duration_seconds", "histogram", "Durée des commandes MongoDB par collection et opération",
+                               buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+generation_attempts = Metric("orga_generation_attempts_total", "counter", "Partitions évaluées par le générateur d'équipes")
+generation_rejections = Metric("orga_generation_rejections_total", "counter", "Partitions ou mouvements rejetés par les contraintes")
+generation_best_score = Metric("orga_generation_best_score", "histogram", "Meilleur score atteint par génération (variance pondérée, plus bas = plus équilibré)",
+                               buckets=(1e-5, 1e-4, 1e-3, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+generation_time_to_best = Metric("orga_generation_time_to_best_seconds", "histogram", "Délai avant la dernière amélioration du meilleur score",
+                                 buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+generation_cache_lookups = Metric("orga_generation_cache_total", "counter", "Recherches dans le cache des générations (hit / miss)")
+generation_queue = Metric("orga_generation_queue", "gauge", "Générations en cours d'exécution ou en attente du pool")
+generation_outcomes = Metric("orga_generation_requests_total", "counter", "Générations terminées, expirées ou refusées (file pleine)")
+
+# Profil de la requête en cours (voir PROFILAGE) ; Motor copie le contexte dans ses threads
+active_profile: contextvars.ContextVar = contextvars.ContextVar("active_profile", default=None)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        target = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        profile = active_profile.get()
+        if profile is not None: profile.begin_wait("mongo", f"{collection}.{event.command_name}")
+        self.pending[(event.connection_id, event.request_id)] = (collection, profile)
+
+    def succeeded(self, event):
+        self.record(event, "ok")
+
+    def failed(self, event):
+        self.record(event, "erreur")
+
+    def record(self, event, statut: str):
+        collection, profile = self.pending.pop((event.connection_id, event.request_id), ("-", None))
+        mongo_command_seconds.observe(event.duration_micros / 1e6, collection=collection, operation=event.command_name, statut=statut)
+        if profile is not None: profile.end_wait("mongo", event.duration_micros / 1e6, f"{collection}.{event.command_name}")
+
+def record_generation_metrics(result: Dict, methode: str):
+    generation_attempts.inc(result["tentatives"], methode=methode)
+    generation_rejections.inc(result["rejets"], methode=methode)
+    generation_best_score.observe(result["score"], methode=methode)
+    generation_time_to_best.observe(result["temps_meilleur"], methode=methode)
+
 # MongoDB connection
+def connect_database(url: str, name: str) -> tuple:
+    # tz_aware : les dates BSON sont relues en datetime UTC avec fuseau
+    mongo_client = AsyncIOMotorClient(url, tz_aware=True, event_listeners=[MongoCommandMetrics()])
+    return mongo_client, mongo_client[name]
+
+def use_database(database, mongo_client=None):
+    # Base injectée (banc de charge, tests) : toutes les routes passent par le global db,
+    # et les caches remplis depuis l'ancienne base sont vidés
+    global db, client, guest_code_cache
+    db, client = database, mongo_client
+    guest_code_cache = None
+    for cache in (principal_cache, generation_cache, share_cache): cache.clear()
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client, db = connect_database(mongo_url, os.environ['DB_NAME'])
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production-' + str(uuid.uuid4()))
@@ -36,7 +174,7 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
 
-# ============= FONCTION DE CALCUL DU GÉNÉRAL (Inchangée) =============
+# ============= FONCTION DE CALCUL DU GÉNÉRAL =============
 def calculate_general(player_data: dict) -> float:
     postes = player_data.get('postes', [])
     is_gardien = any(p.lower() == 'gardien' for p in postes)
@@ -74,7 +212,35 @@ def calculate_general(player_data: dict) -> float:
         ) / 6
     return round(note, 2)
 
-# ============= MODELS (Inchangé) =============
+def as_datetime(value) -> datetime:
+    # Date BSON native, ou chaîne ISO des documents antérieurs à la migration
+    if isinstance(value, str): value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def calculate_sub_scores(player_data: dict) -> Dict[str, float]:
+    # Sous-scores utilisés par le générateur et les stats d'équipe, stockés avec le joueur
+    get = lambda k: player_data.get(k, 5.0)
+    return {
+        "score_attaque": (get('tir') + get('technique')) / 2,
+        "score_milieu": (get('passe') + get('vitesse')) / 2,
+        "score_defense": (get('defense') + get('physique')) / 2,
+    }
+
+GENERAL_ATTRS = ['vitesse', 'technique', 'tir', 'passe', 'defense', 'physique', 'reflexes_gk', 'plongeon_gk', 'jeu_au_pied_gk']
+GENERAL_DEFAULTS = [5.0, 5.0, 5.0, 5.0, 5.0, 5.0, 1.0, 1.0, 1.0]
+
+def calculate_general_batch(players: List[dict]) -> List[float]:
+    # Même calcul que calculate_general, colonne par colonne et dans le même ordre d'addition
+    # (résultats identiques au flottant près), pour tout un lot de joueurs
+    if not players: return []
+    a = np.array([[p.get(k, d) for k, d in zip(GENERAL_ATTRS, GENERAL_DEFAULTS)] for p in players], dtype=float)
+    vit, tech, tir, passe, dfn, phy, ref, plo, pied = a.T
+    gardien = np.array([any(x.lower() == 'gardien' for x in p.get('postes', [])) for p in players])
+    note_gk = ref * 0.20 + plo * 0.20 + pied * 0.20 + tech * 0.10 + passe * 0.10 + vit * 0.05 + dfn * 0.05 + phy * 0.05 + tir * 0.05
+    note_champ = (vit + tech + tir + passe + dfn + phy) / 6
+    return [round(float(n), 2) for n in np.where(gardien, note_gk, note_champ)]
+
+# ============= MODELS =============
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -140,12 +306,48 @@ class PlayerInDB(PlayerBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     note_generale: float
+    score_attaque: Optional[float] = None
+    score_milieu: Optional[float] = None
+    score_defense: Optional[float] = None
+
+class PlayerRecord:
+    # Fiche compacte chargée pour la génération et l'affichage des équipes : seulement
+    # les valeurs utiles, sans validation pydantic (et légère à transmettre au pool)
+    __slots__ = ("id", "nom", "postes", "note_generale", "score_attaque", "score_milieu", "score_defense")
+
+    def __init__(self, id: str, nom: str, postes: List[str], note_generale: float,
+                 score_attaque: float, score_milieu: float, score_defense: float):
+        self.id, self.nom, self.postes, self.note_generale = id, nom, postes, note_generale
+        self.score_attaque, self.score_milieu, self.score_defense = score_attaque, score_milieu, score_defense
+
+    @classmethod
+    def from_doc(cls, doc: Dict) -> "PlayerRecord":
+        # Joueur pas encore rattrapé par la migration : sous-scores recalculés à la volée
+        scores = doc if doc.get("score_attaque") is not None else calculate_sub_scores(doc)
+        return cls(doc["id"], doc["nom"], doc.get("postes", []), doc["note_generale"],
+                   scores["score_attaque"], scores["score_milieu"], scores["score_defense"])
+
+PLAYER_RECORD_PROJECTION = {
+    "_id": 0, **{f: 1 for f in PlayerRecord.__slots__},
+    # Attributs de base, seulement pour les joueurs sans sous-scores stockés
+    **{f: 1 for f in ("tir", "technique", "passe", "vitesse", "defense", "physique")},
+}
 class JoueurPresent(BaseModel):
     joueur_id: str
     note_temporaire: float = Field(ge=1, le=10)
 class ContrainteAffinite(BaseModel):
     type: str
     joueurs: List[str]
+    # Forme canonique (triée, sans doublon) : une contrainte ne dépend pas de l'ordre de ses joueurs
+    @field_validator("joueurs")
+    @classmethod
+    def sort_joueurs(cls, joueurs: List[str]) -> List[str]:
+        return sorted(set(joueurs))
+# Méthodes de génération sélectionnables par événement (validées dès l'écriture)
+MethodeGeneration = Literal["aleatoire", "recherche_locale", "exacte"]
+class TourGenere(BaseModel):
+    equipes: List[List[str]]
+    warning_message: Optional[str] = None
 class Event(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -158,17 +360,25 @@ class Event(BaseModel):
     share_token: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     warning_message: Optional[str] = None
+    methode_generation: MethodeGeneration = "aleatoire"
+    version: int = 0
+    tours_generes: List[TourGenere] = []
 class EventCreate(BaseModel):
     nom_evenement: str
     joueurs_presents: List[JoueurPresent] = []
     nombre_equipes: int = 2
     contraintes_affinite: List[ContrainteAffinite] = []
+    methode_generation: MethodeGeneration = "aleatoire"
 class EventUpdate(BaseModel):
     nom_evenement: Optional[str] = None
     joueurs_presents: Optional[List[JoueurPresent]] = None
     nombre_equipes: Optional[int] = None
     contraintes_affinite: Optional[List[ContrainteAffinite]] = None
     equipes_generees: Optional[List[List[str]]] = None
+    methode_generation: Optional[MethodeGeneration] = None
+    version: Optional[int] = None
+class NoteTemporaireUpdate(BaseModel):
+    note_temporaire: float = Field(ge=1, le=10)
 class TeamStats(BaseModel):
     note_moyenne: float
     postes: Dict[str, int]
@@ -176,12 +386,82 @@ class TeamStats(BaseModel):
 class GenerateTeamsResponse(BaseModel):
     equipes: List[TeamStats]
     warning_message: Optional[str] = None
+    optimal: bool = False
+    joueurs_deplaces: Optional[int] = None
+    depuis_cache: bool = False
+    version: int = 0
+class PropositionEquipes(BaseModel):
+    equipes: List[TeamStats]
+    score: float
+    warning_message: Optional[str] = None
+class GenerateAlternativesResponse(BaseModel):
+    propositions: List[PropositionEquipes]
+    optimal: bool = False
+    version: int = 0
+class GenerationToursRequest(BaseModel):
+    event_ids: List[str] = Field(min_length=1)
+    tours: int = Field(default=1, ge=1)
+    poids_rotation: Optional[float] = Field(default=None, ge=0)
+    seed: Optional[int] = None
+class TourEquipes(BaseModel):
+    equipes: List[TeamStats]
+    score: float
+    paires_repetees: int
+    warning_message: Optional[str] = None
+class EvenementTours(BaseModel):
+    event_id: str
+    tours: List[TourEquipes]
+class GenerationToursResponse(BaseModel):
+    evenements: List[EvenementTours]
+    paires_repetees: int
+
+# ============= AUTH HELPERS =============
+# bcrypt est coûteux et bloquant : hachage et vérification passent par un pool
+# de threads borné (bcrypt libère le GIL), jamais sur la boucle asyncio.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', '64'))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+auth_stats = {"tentatives": 0, "reussies": 0, "echecs": 0, "emails_inconnus": 0, "en_attente": 0, "bcrypt_appels": 0, "bcrypt_secondes": 0.0}
+auth_stats_started = time.monotonic()
 
-# ============= AUTH HELPERS (Inchangé) =============
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+def password_needs_rehash(hashed: str) -> bool:
+    # Format "$2b$<coût>$..." : un changement de BCRYPT_ROUNDS s'applique à la connexion suivante
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+async def run_password_task(func, *args):
+    if auth_stats["en_attente"] >= PASSWORD_MAX_PENDING:
+        raise HTTPException(status_code=503, detail="Trop de connexions simultanées, réessayez dans un instant")
+    auth_stats["en_attente"] += 1
+    started = time.perf_counter()
+    try:
+        with profile_wait("bcrypt"):
+            return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        auth_stats["en_attente"] -= 1
+        auth_stats["bcrypt_appels"] += 1
+        auth_stats["bcrypt_secondes"] += time.perf_counter() - started
+async def hash_password_async(password: str) -> str:
+    return await run_password_task(hash_password, password)
+async def verify_password_async(password: str, hashed: str) -> bool:
+    return await run_password_task(verify_password, password, hashed)
+# Tâches de re-hachage en cours : sans référence, une tâche peut être collectée avant sa fin
+rehash_tasks = set()
+def spawn_rehash(user_id: str, password: str):
+    task = asyncio.create_task(rehash_password(user_id, password))
+    rehash_tasks.add(task)
+    task.add_done_callback(rehash_tasks.discard)
+async def rehash_password(user_id: str, password: str):
+    try:
+        await db.users.update_one({"id": user_id}, {"$set": {"password_hash": await hash_password_async(password)}})
+    except (HTTPException, PyMongoError) as e:
+        logger.warning("Mise à jour du coût bcrypt reportée pour %s : %s", user_id, e)
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -192,6 +472,31 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     if "role" not in to_encode: to_encode["role"] = "co-organisateur"
     if "name" not in to_encode and "email" in to_encode: to_encode["name"] = to_encode["email"]
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+# Cache des comptes résolus par sujet de token : évite un find_one par requête.
+# Les sujets invités (sans compte) sont mémorisés comme absents.
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '1024'))
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', '60'))
+principal_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+def invalidate_principal(user_id: Optional[str] = None):
+    if user_id is None:
+        principal_cache.clear()
+    else:
+        principal_cache.pop(user_id, None)
+
+async def find_principal(user_id: str, role: Optional[str]) -> Optional[Dict]:
+    cached = principal_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        principal_cache.move_to_end(user_id)
+        return cached[1]
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1, "email": 1, "role": 1})
+    if user_doc or role == "co-organisateur":
+        principal_cache[user_id] = (time.monotonic() + PRINCIPAL_CACHE_TTL, user_doc)
+        principal_cache.move_to_end(user_id)
+        while len(principal_cache) > PRINCIPAL_CACHE_SIZE:
+            principal_cache.popitem(last=False)
+    return user_doc
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserResponse:
     try:
         token = credentials.credentials
@@ -202,7 +507,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         raise HTTPException(status_code=401, detail="Token expiré")
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Token invalide")
-    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user_doc = await find_principal(user_id, payload.get("role"))
     if user_doc:
         return UserResponse(id=user_doc["id"], email=user_doc["email"], role=user_doc["role"])
     role = payload.get("role")
@@ -215,43 +520,51 @@ async def get_admin_user(current_user: UserResponse = Depends(get_current_user))
         raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
     return current_user
 
-# ============= AUTH ROUTES (Inchangé) =============
+# ============= AUTH ROUTES =============
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserCreate):
     user_count = await db.users.count_documents({})
     if user_count > 0:
         raise HTTPException(status_code=403, detail="L'inscription est désactivée.")
     role = "admin"
-    user = User(email=user_data.email, password_hash=hash_password(user_data.password), role=role)
-    user_dict = user.model_dump()
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
-    await db.users.insert_one(user_dict)
+    user = User(email=user_data.email, password_hash=await hash_password_async(user_data.password), role=role)
+    await db.users.insert_one(user.model_dump())
+    invalidate_principal(user.id)
     access_token = create_access_token(data={"sub": user.id, "role": user.role, "name": user.email})
     return TokenResponse(access_token=access_token, user=UserResponse(id=user.id, email=user.email, role=user.role))
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
+    auth_stats["tentatives"] += 1
     user_doc = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user_doc: raise HTTPException(status_code=401, detail="Email ou mot de passe incorrect")
+    if not user_doc:
+        # Email inconnu : rejet immédiat, sans occuper le pool bcrypt
+        auth_stats["emails_inconnus"] += 1
+        raise HTTPException(status_code=401, detail="Email ou mot de passe incorrect")
     user = User(**user_doc)
-    if not verify_password(credentials.password, user.password_hash):
+    if not await verify_password_async(credentials.password, user.password_hash):
+        auth_stats["echecs"] += 1
         raise HTTPException(status_code=401, detail="Email ou mot de passe incorrect")
+    auth_stats["reussies"] += 1
+    if password_needs_rehash(user.password_hash):
+        spawn_rehash(user.id, credentials.password)
     access_token = create_access_token(data={"sub": user.id, "role": user.role, "name": user.email})
     return TokenResponse(access_token=access_token, user=UserResponse(id=user.id, email=user.email, role=user.role))
 @api_router.post("/auth/guest-login", response_model=TokenResponse)
 async def guest_login(credentials: GuestLogin):
-    code_doc = await db.guest_codes.find_one({"id": "singleton"}, {"_id": 0})
-    if not code_doc or credentials.code != code_doc["code"]:
+    guest_code = await load_guest_code()
+    if guest_code is not None and credentials.code != guest_code.code:
+        # Le code a pu être régénéré par un autre worker : une relecture avant de refuser
+        guest_code = await load_guest_code(refresh=True)
+    if not guest_code or credentials.code != guest_code.code:
         raise HTTPException(status_code=401, detail="Code d'invitation incorrect")
-    expires_at = datetime.fromisoformat(code_doc["expires_at"])
-    if datetime.now(timezone.utc) > expires_at:
+    if datetime.now(timezone.utc) > guest_code.expires_at:
         raise HTTPException(status_code=401, detail="Le code d'invitation a expiré")
-    log_entry = {
+    guest_log_writer.add({
         "id": str(uuid.uuid4()),
         "name": credentials.name,
         "code_used": credentials.code,
-        "logged_in_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.guest_logs.insert_one(log_entry)
+        "logged_in_at": datetime.now(timezone.utc)
+    })
     guest_id = f"guest_{credentials.name.lower()}_{str(uuid.uuid4())[:4]}"
     guest_role = "co-organisateur"
     access_token = create_access_token(data={"sub": guest_id, "role": guest_role, "name": credentials.name})
@@ -259,8 +572,85 @@ async def guest_login(credentials: GuestLogin):
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_me(current_user: UserResponse = Depends(get_current_user)):
     return current_user
+@api_router.get("/admin/auth-stats")
+async def get_auth_stats(current_user: UserResponse = Depends(get_admin_user)):
+    # Débit de connexion du worker courant (un processus uvicorn = un pid)
+    elapsed = max(time.monotonic() - auth_stats_started, 1e-9)
+    return {
+        **auth_stats,
+        "pid": os.getpid(),
+        "cout_bcrypt": BCRYPT_ROUNDS,
+        "workers_bcrypt": PASSWORD_HASH_WORKERS,
+        "connexions_par_seconde": round(auth_stats["reussies"] / elapsed, 3),
+        "bcrypt_ms_moyen": round(auth_stats["bcrypt_secondes"] * 1000 / max(auth_stats["bcrypt_appels"], 1), 2),
+    }
+
+# ============= GUEST CODE (Admin only) =============
+# Le code hebdomadaire reste en mémoire jusqu'à son expiration, relu au plus tard après
+# GUEST_CODE_CACHE_TTL secondes pour suivre une régénération faite par un autre worker.
+GUEST_CODE_CACHE_TTL = float(os.environ.get('GUEST_CODE_CACHE_TTL', '60'))
+# Journal des connexions invités : insert_many par lots de GUEST_LOG_BATCH_SIZE ou toutes
+# les GUEST_LOG_FLUSH_INTERVAL secondes ; Mongo purge les entrées après GUEST_LOG_RETENTION_DAYS
+# jours (index TTL, 0 : conservation illimitée).
+GUEST_LOG_BATCH_SIZE = int(os.environ.get('GUEST_LOG_BATCH_SIZE', '50'))
+GUEST_LOG_FLUSH_INTERVAL = float(os.environ.get('GUEST_LOG_FLUSH_INTERVAL', '1.0'))
+GUEST_LOG_RETENTION_DAYS = int(os.environ.get('GUEST_LOG_RETENTION_DAYS', '90'))
+
+guest_code_cache: Optional[tuple] = None
+
+def remember_guest_code(guest_code: GuestCode):
+    global guest_code_cache
+    guest_code_cache = (guest_code, time.monotonic() + GUEST_CODE_CACHE_TTL)
+
+async def load_guest_code(refresh: bool = False) -> Optional[GuestCode]:
+    if not refresh and guest_code_cache and guest_code_cache[1] > time.monotonic() \
+            and datetime.now(timezone.utc) <= guest_code_cache[0].expires_at:
+        return guest_code_cache[0]
+    code_doc = await db.guest_codes.find_one({"id": "singleton"}, {"_id": 0})
+    if not code_doc: return None
+    guest_code = GuestCode(code=code_doc["code"], expires_at=as_datetime(code_doc["expires_at"]))
+    remember_guest_code(guest_code)
+    return guest_code
+
+class GuestLogWriter:
+    def __init__(self):
+        self.pending: List[Dict] = []
+        self.timer: Optional[asyncio.Task] = None
+        self.tasks = set()
+
+    def add(self, entry: Dict):
+        self.pending.append(entry)
+        # Un seul vidage par lot : il emporte aussi les entrées arrivées avant son exécution
+        if len(self.pending) == GUEST_LOG_BATCH_SIZE:
+            self.spawn(self.flush())
+        elif self.timer is None or self.timer.done():
+            self.timer = self.spawn(self.flush_later())
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def flush_later(self):
+        await asyncio.sleep(GUEST_LOG_FLUSH_INTERVAL)
+        await self.flush()
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch: return
+        try:
+            await db.guest_logs.insert_many(batch, ordered=False)
+        except PyMongoError as e:
+            logger.error("Journal des invités : %d entrées non écrites (%s)", len(batch), e)
+
+    async def close(self):
+        if self.timer is not None: self.timer.cancel()
+        await self.flush()
+        if self.tasks: await asyncio.gather(*self.tasks, return_exceptions=True)
+
+guest_log_writer = GuestLogWriter()
 
-# ============= GUEST CODE (Admin only) (Inchangé) =============
 async def generate_new_guest_code() -> GuestCode:
     alphabet = string.ascii_uppercase + string.digits
     code = ''.join(secrets.choice(alphabet) for i in range(6))
@@ -277,15 +667,16 @@ async def generate_new_guest_code() -> GuestCode:
     code_data = GuestCode(code=code, expires_at=expires_at)
     await db.guest_codes.update_one(
         {"id": "singleton"},
-        {"$set": {"code": code_data.code, "expires_at": code_data.expires_at.isoformat()}},
+        {"$set": {"code": code_data.code, "expires_at": code_data.expires_at}},
         upsert=True
     )
+    remember_guest_code(code_data)
     return code_data
 async def get_or_create_guest_code() -> GuestCode:
-    code_doc = await db.guest_codes.find_one({"id": "singleton"}, {"_id": 0})
-    if not code_doc or datetime.now(timezone.utc) > datetime.fromisoformat(code_doc["expires_at"]):
+    guest_code = await load_guest_code()
+    if not guest_code or datetime.now(timezone.utc) > guest_code.expires_at:
         return await generate_new_guest_code()
-    return GuestCode(code=code_doc["code"], expires_at=datetime.fromisoformat(code_doc["expires_at"]))
+    return guest_code
 @api_router.get("/admin/guest-code", response_model=GuestCode)
 async def get_guest_code(current_user: UserResponse = Depends(get_admin_user)):
     code = await get_or_create_guest_code()
@@ -298,10 +689,8 @@ async def create_new_guest_code(current_user: UserResponse = Depends(get_admin_u
 async def get_guest_logs(current_user: UserResponse = Depends(get_admin_user)):
     logs_cursor = db.guest_logs.find({}, {"_id": 0}).sort("logged_in_at", -1).limit(100)
     logs = await logs_cursor.to_list(100)
-    for log in logs:
-        if isinstance(log.get('logged_in_at'), str):
-            log['logged_in_at'] = datetime.fromisoformat(log['logged_in_at'])
-    return [GuestLogResponse(**log) for log in logs]
+    # Connexions encore en attente d'écriture (au plus GUEST_LOG_FLUSH_INTERVAL secondes)
+    return (list(reversed(guest_log_writer.pending)) + logs)[:100]
 
 # ============= CRON JOB ROUTE (Secret) (Inchangé) =============
 @api_router.post("/cron/regenerate-code")
@@ -311,22 +700,97 @@ async def cron_regenerate_code(secret: str = Body(..., embed=True)):
     await generate_new_guest_code()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-# ============= PLAYERS ROUTES (Inchangé) =============
+# ============= LISTES : CURSEUR, PROJECTION, NDJSON =============
+LIST_MAX_LIMIT = int(os.environ.get('LIST_MAX_LIMIT', '500'))
+LIST_BATCH_SIZE = int(os.environ.get('LIST_BATCH_SIZE', '200'))
+
+def encode_cursor(doc: Dict) -> str:
+    # Curseur opaque : position (created_at, id) du dernier document renvoyé
+    created = doc.get("created_at")
+    value = {"d": created.isoformat()} if isinstance(created, datetime) else {"s": created}
+    return base64.urlsafe_b64encode(json.dumps([value, doc["id"]]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created = datetime.fromisoformat(value["d"]) if "d" in value else value["s"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    return created, last_id
+
+def parse_fields(fields: Optional[str], allowed) -> Optional[List[str]]:
+    if not fields: return None
+    requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Champs inconnus : {', '.join(unknown)}")
+    return requested
+
+def model_defaults(model) -> Dict:
+    # Valeurs par défaut simples du modèle : les documents servis sans repasser par pydantic
+    # (anciens documents sans ces champs) en sont complétés
+    return {name: f.default for name, f in model.model_fields.items() if not f.is_required() and f.default_factory is None}
+
+async def list_documents(collection, direction: int, limit: Optional[int], cursor: Optional[str],
+                         fields: Optional[List[str]], output: str, exclude: tuple = (),
+                         defaults: Optional[Dict] = None) -> Response:
+    # Pagination par clé (created_at, id) : coût constant quelle que soit la page
+    query = {}
+    if cursor:
+        created, last_id = decode_cursor(cursor)
+        op = "$gt" if direction == ASCENDING else "$lt"
+        query = {"$or": [{"created_at": {op: created}}, {"created_at": created, "id": {op: last_id}}]}
+    if fields:
+        # created_at et id sont nécessaires au curseur, retirés ensuite s'ils n'ont pas été demandés
+        projection = {"_id": 0, "id": 1, "created_at": 1, **{f: 1 for f in fields}}
+        hidden = [f for f in ("id", "created_at") if f not in fields]
+        defaults = {f: v for f, v in (defaults or {}).items() if f in fields}
+    else:
+        projection = {"_id": 0, **{f: 0 for f in exclude}}
+        hidden = []
+        defaults = {f: v for f, v in (defaults or {}).items() if f not in exclude}
+    mongo_cursor = collection.find(query, projection).sort([("created_at", direction), ("id", direction)])
+
+    if output == "ndjson":
+        # Flux : un document par ligne, au rythme du curseur Motor, sans rien accumuler
+        if limit: mongo_cursor = mongo_cursor.limit(limit)
+        async def lines():
+            async for doc in mongo_cursor.batch_size(LIST_BATCH_SIZE):
+                for f in hidden: doc.pop(f, None)
+                yield orjson.dumps({**defaults, **doc}) + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    limit = limit or LIST_MAX_LIMIT
+    docs = await mongo_cursor.limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    for doc in docs:
+        for f in hidden: doc.pop(f, None)
+    return ORJSONResponse([{**defaults, **doc} for doc in docs], headers=headers)
+
+# ============= PLAYERS ROUTES =============
+PLAYER_DEFAULTS = model_defaults(PlayerInDB)
+
 @api_router.get("/players", response_model=List[PlayerInDB])
-async def get_players(current_user: UserResponse = Depends(get_current_user)):
-    players = await db.players.find({}, {"_id": 0}).to_list(1000)
-    for player in players:
-        if isinstance(player.get('created_at'), str):
-            player['created_at'] = datetime.fromisoformat(player['created_at'])
-    return players
+async def get_players(
+    limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    # Sans paramètre : première page de LIST_MAX_LIMIT joueurs, la suite via l'en-tête X-Next-Cursor.
+    # Documents sérialisés par orjson sans repasser par le modèle, complétés de ses valeurs par défaut
+    return await list_documents(db.players, ASCENDING, limit, cursor, parse_fields(fields, PlayerInDB.model_fields), output,
+                                defaults=PLAYER_DEFAULTS)
 @api_router.post("/players", response_model=PlayerInDB)
 async def create_player(player_data: PlayerCreate, current_user: UserResponse = Depends(get_current_user)):
     player_dict = player_data.model_dump()
     note_generale = calculate_general(player_dict)
-    player = PlayerInDB(**player_dict, note_generale=note_generale)
-    db_player_dict = player.model_dump()
-    db_player_dict['created_at'] = db_player_dict['created_at'].isoformat()
-    await db.players.insert_one(db_player_dict)
+    player = PlayerInDB(**player_dict, note_generale=note_generale, **calculate_sub_scores(player_dict))
+    await db.players.insert_one(player.model_dump())
     return player
 @api_router.put("/players/{player_id}", response_model=PlayerInDB)
 async def update_player(player_id: str, player_update: PlayerUpdate, current_user: UserResponse = Depends(get_current_user)):
@@ -337,71 +801,322 @@ async def update_player(player_id: str, player_update: PlayerUpdate, current_use
     updated_doc_data = {**player_doc, **update_data}
     note_generale = calculate_general(updated_doc_data)
     update_data['note_generale'] = note_generale
+    update_data.update(calculate_sub_scores(updated_doc_data))
     if update_data:
         await db.players.update_one({"id": player_id}, {"$set": update_data})
+        await invalidate_player_share_snapshots(player_id)
     updated_doc = await db.players.find_one({"id": player_id}, {"_id": 0})
-    if isinstance(updated_doc.get('created_at'), str):
-        updated_doc['created_at'] = datetime.fromisoformat(updated_doc['created_at'])
     return PlayerInDB(**updated_doc)
 @api_router.delete("/players/{player_id}")
 async def delete_player(player_id: str, current_user: UserResponse = Depends(get_admin_user)):
     result = await db.players.delete_one({"id": player_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Joueur non trouvé")
+    await invalidate_player_share_snapshots(player_id)
     return {"message": "Joueur supprimé avec succès"}
 
-# ============= EVENTS ROUTES (Inchangé) =============
+# ============= IMPORT / EXPORT DE JOUEURS =============
+PLAYER_IMPORT_CHUNK = int(os.environ.get('PLAYER_IMPORT_CHUNK', '500'))
+PLAYER_IMPORT_MAX_ERRORS = int(os.environ.get('PLAYER_IMPORT_MAX_ERRORS', '1000'))
+PLAYER_EXPORT_COLUMNS = ['id', 'nom', 'postes', *GENERAL_ATTRS, 'note_generale', 'created_at']
+POSTES_SEPARATOR = '|'
+
+async def read_lines(request: Request):
+    # Découpe le corps de la requête en lignes au fil de la réception, sans le charger en entier
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines: yield line.rstrip('\r')
+    pending += decoder.decode(b'', final=True)
+    if pending.strip(): yield pending.rstrip('\r')
+
+async def read_import_records(request: Request, input_format: str):
+    # (numéro de la première ligne, enregistrement) : ligne brute en NDJSON, cellules en CSV.
+    # Un seul csv.reader lit tout le flux ; il n'est appelé que lorsqu'un enregistrement complet
+    # est en attente (guillemets appariés), une cellule entre guillemets pouvant couvrir plusieurs lignes.
+    feed = deque()
+    reader = csv.reader(iter(feed.popleft, None))
+    quotes, start, line_number = 0, 0, 0
+    async for line in read_lines(request):
+        line_number += 1
+        if input_format == "ndjson":
+            if line.strip(): yield line_number, line
+            continue
+        if not feed:
+            if not line.strip(): continue
+            start = line_number
+        feed.append(line + '\n')
+        quotes += line.count('"')
+        if quotes % 2: continue
+        quotes = 0
+        yield start, next(reader)
+    if feed:
+        feed.clear()
+        yield start, None
+
+def parse_import_line(record, header: Optional[List[str]]) -> Dict:
+    if header is None:
+        row = json.loads(record)
+        if not isinstance(row, dict): raise ValueError("objet JSON attendu")
+        return row
+    if record is None: raise ValueError("guillemet non fermé en fin de fichier")
+    values = record
+    if len(values) > len(header): raise ValueError("trop de colonnes")
+    # Cellules vides : valeur par défaut du modèle ; postes séparés par '|'
+    row = {k: v.strip() for k, v in zip(header, values) if v.strip() != ''}
+    if 'postes' in row: row['postes'] = [p.strip() for p in row['postes'].split(POSTES_SEPARATOR) if p.strip()]
+    return row
+
+PLAYER_IMPORT_DEFAULTS = {f: PlayerCreate.model_fields[f].default for f in GENERAL_ATTRS}
+
+async def write_player_chunk(rows: List[tuple]) -> tuple:
+    # rows : (ligne, id ou None, colonnes fournies). La colonne id désigne le joueur (créé avec cet id
+    # s'il n'existe pas) ; sans id, le nom sert de clé s'il ne désigne qu'un seul joueur, les homonymes
+    # sont rapportés ligne par ligne. Un joueur existant garde ses autres attributs ; note et sous-scores
+    # sont recalculés sur le document fusionné, les valeurs par défaut ne servent qu'à la création.
+    ids = [player_id for _, player_id, _ in rows if player_id]
+    noms = [row['nom'] for _, player_id, row in rows if not player_id]
+    existing, by_nom = {}, defaultdict(list)
+    async for doc in db.players.find({"$or": [{"id": {"$in": ids}}, {"nom": {"$in": noms}}]},
+                                     {"_id": 0, "id": 1, "nom": 1, "postes": 1, **{f: 1 for f in GENERAL_ATTRS}}):
+        existing[doc['id']] = doc
+        by_nom[doc['nom']].append(doc)
+    # Dernière occurrence d'un joueur dans le lot gagnante : les opérations ne se chevauchent pas
+    targets, new_ids, errors = {}, {}, []
+    for line_number, player_id, row in rows:
+        if not player_id:
+            matches = by_nom.get(row['nom'], [])
+            if len(matches) > 1:
+                errors.append({"ligne": line_number, "erreurs": [
+                    f"nom ambigu : {len(matches)} joueurs s'appellent « {row['nom']} », précisez la colonne id"]})
+                continue
+            player_id = matches[0]['id'] if matches else new_ids.setdefault(row['nom'], str(uuid.uuid4()))
+        targets[player_id] = row
+    merged = [{**PLAYER_IMPORT_DEFAULTS, **existing.get(player_id, {}), **row} for player_id, row in targets.items()]
+    notes = calculate_general_batch(merged)
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne({"id": player_id}, {
+            "$set": {**row, "note_generale": note, **calculate_sub_scores(full)},
+            "$setOnInsert": {"created_at": now, **{f: v for f, v in PLAYER_IMPORT_DEFAULTS.items() if f not in row}},
+        }, upsert=True)
+        for (player_id, row), full, note in zip(targets.items(), merged, notes)
+    ]
+    created = updated = 0
+    if operations:
+        try:
+            result = await db.players.bulk_write(operations, ordered=False)
+            created, updated = result.upserted_count, result.matched_count
+        except BulkWriteError as e:
+            # Import concurrent du même id : l'index unique refuse le second upsert
+            logger.warning("Import de joueurs : %d écritures refusées", len(e.details.get("writeErrors", [])))
+            created, updated = e.details.get("nUpserted", 0), e.details.get("nMatched", 0)
+    updated_ids = [player_id for player_id in targets if player_id in existing]
+    if updated_ids: await invalidate_player_share_snapshots(*updated_ids)
+    return created, updated, errors
+
+@api_router.post("/players/import")
+async def import_players(
+    request: Request,
+    input_format: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$"),
+    current_user: UserResponse = Depends(get_admin_user)
+):
+    # CSV (ligne d'en-tête obligatoire) ou NDJSON ; upsert par id (ou par nom sans ambiguïté),
+    # une erreur rapportée par ligne invalide
+    if input_format is None:
+        input_format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    header = None
+    rows, errors = [], []
+    stats = {"lignes": 0, "crees": 0, "mis_a_jour": 0, "erreurs": 0}
+
+    def report(line_errors: List[Dict]):
+        stats["erreurs"] += len(line_errors)
+        errors.extend(line_errors[:max(PLAYER_IMPORT_MAX_ERRORS - len(errors), 0)])
+
+    async def flush():
+        created, updated, chunk_errors = await write_player_chunk(rows)
+        stats["crees"] += created; stats["mis_a_jour"] += updated
+        report(chunk_errors)
+        rows.clear()
+
+    async for line_number, record in read_import_records(request, input_format):
+        if input_format == "csv" and header is None:
+            header = [h.strip() for h in record or []]
+            continue
+        stats["lignes"] += 1
+        try:
+            row = parse_import_line(record, header)
+            player_id = str(row.pop('id', None) or '').strip() or None
+            player = PlayerCreate(**row)
+        except (ValueError, TypeError, csv.Error) as e:
+            detail = [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()] if isinstance(e, ValidationError) else [str(e)]
+            report([{"ligne": line_number, "erreurs": detail}])
+            continue
+        rows.append((line_number, player_id, player.model_dump(exclude_unset=True)))
+        if len(rows) >= PLAYER_IMPORT_CHUNK: await flush()
+    if rows: await flush()
+    if input_format == "csv" and header is None:
+        raise HTTPException(status_code=400, detail="Fichier CSV vide : ligne d'en-tête attendue")
+    return {**stats, "details_erreurs": errors}
+
+@api_router.get("/players/export")
+async def export_players(
+    output: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    headers = {"Content-Disposition": f'attachment; filename="joueurs.{output}"'}
+    if output == "ndjson":
+        response = await list_documents(db.players, ASCENDING, None, None, None, "ndjson")
+        response.headers.update(headers)
+        return response
+
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(PLAYER_EXPORT_COLUMNS)
+        projection = {"_id": 0, **{c: 1 for c in PLAYER_EXPORT_COLUMNS}}
+        async for doc in db.players.find({}, projection).sort([("created_at", 1), ("id", 1)]).batch_size(LIST_BATCH_SIZE):
+            doc['postes'] = POSTES_SEPARATOR.join(doc.get('postes', []))
+            if isinstance(doc.get('created_at'), datetime): doc['created_at'] = doc['created_at'].isoformat()
+            writer.writerow([doc.get(c, '') for c in PLAYER_EXPORT_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0); buffer.truncate()
+        if buffer.getvalue(): yield buffer.getvalue()
+    return StreamingResponse(rows(), media_type="text/csv; charset=utf-8", headers=headers)
+
+# ============= EVENTS ROUTES =============
+EVENT_DEFAULTS = model_defaults(Event)
+
 @api_router.get("/events", response_model=List[Event])
-async def get_events(current_user: UserResponse = Depends(get_current_user)):
-    query = {} 
-    events = await db.events.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for event in events:
-        if isinstance(event.get('created_at'), str):
-            event['created_at'] = datetime.fromisoformat(event['created_at'])
-    return events
+async def get_events(
+    limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    # Du plus récent au plus ancien, par pages comme /players
+    return await list_documents(db.events, DESCENDING, limit, cursor, parse_fields(fields, Event.model_fields), output,
+                                exclude=("share_snapshot",), defaults=EVENT_DEFAULTS)
 @api_router.get("/events/{event_id}", response_model=Event)
 async def get_event(event_id: str, current_user: UserResponse = Depends(get_current_user)):
-    event_doc = await db.events.find_one({"id": event_id}, {"_id": 0})
+    event_doc = await db.events.find_one({"id": event_id}, EVENT_PROJECTION)
     if not event_doc:
         raise HTTPException(status_code=404, detail="Événement non trouvé")
-    if isinstance(event_doc.get('created_at'), str):
-        event_doc['created_at'] = datetime.fromisoformat(event_doc['created_at'])
     return event_doc
 @api_router.post("/events", response_model=Event)
 async def create_event(event_data: EventCreate, current_user: UserResponse = Depends(get_current_user)):
     event = Event(**event_data.model_dump(), organisateur_id=current_user.id)
-    event_dict = event.model_dump()
-    event_dict['created_at'] = event_dict['created_at'].isoformat()
-    await db.events.insert_one(event_dict)
+    await db.events.insert_one(event.model_dump())
     return event
 @api_router.put("/events/{event_id}", response_model=Event)
 async def update_event(event_id: str, event_update: EventUpdate, current_user: UserResponse = Depends(get_current_user)):
-    event_doc = await db.events.find_one({"id": event_id}, {"_id": 0})
-    if not event_doc:
-        raise HTTPException(status_code=404, detail="Événement non trouvé")
     update_data = {k: v for k, v in event_update.model_dump().items() if v is not None}
-    if update_data:
-        await db.events.update_one({"id": event_id}, {"$set": update_data})
-    updated_doc = await db.events.find_one({"id": event_id}, {"_id": 0})
-    if isinstance(updated_doc.get('created_at'), str):
-        updated_doc['created_at'] = datetime.fromisoformat(updated_doc['created_at'])
-    return Event(**updated_doc)
+    version = update_data.pop("version", None)
+    if not update_data:
+        event_doc = await db.events.find_one({"id": event_id}, EVENT_PROJECTION)
+        if not event_doc:
+            raise HTTPException(status_code=404, detail="Événement non trouvé")
+        return Event(**event_doc)
+    # L'instantané partagé est périmé : il sera reconstruit à la prochaine consultation
+    return await apply_event_update(event_id, {"$set": update_data, "$unset": {"share_snapshot": ""}}, version)
 @api_router.delete("/events/{event_id}")
 async def delete_event(event_id: str, current_user: UserResponse = Depends(get_current_user)):
     event_doc = await db.events.find_one({"id": event_id}, {"_id": 0})
     if not event_doc:
         raise HTTPException(status_code=404, detail="Événement non trouvé")
     await db.events.delete_one({"id": event_id})
+    invalidate_share_cache(event_doc.get("share_token"))
     return {"message": "Événement supprimé avec succès"}
 
+# ============= MODIFICATIONS ATOMIQUES D'UN ÉVÉNEMENT =============
+EVENT_PROJECTION = {"_id": 0, "share_snapshot": 0}
+CONSTRAINT_TYPES = ("lier", "separer")
+
+def version_filter(version: int):
+    # Les événements antérieurs au versionnage n'ont pas de champ version : équivalent à 0
+    return {"$in": [0, None]} if version == 0 else version
+
+async def apply_event_update(event_id: str, update: Dict, version: Optional[int] = None,
+                             condition: Optional[Dict] = None, missing_detail: Optional[str] = None) -> Optional[Event]:
+    # Un seul aller-retour : condition, modification et relecture dans find_one_and_update.
+    # La version est incrémentée à chaque écriture ; si le client en fournit une, elle doit correspondre.
+    filtre = {"id": event_id, **(condition or {})}
+    if version is not None: filtre["version"] = version_filter(version)
+    event_doc = await db.events.find_one_and_update(
+        filtre, {**update, "$inc": {"version": 1}}, projection=EVENT_PROJECTION, return_document=ReturnDocument.AFTER
+    )
+    if event_doc is not None:
+        if "share_snapshot" in update.get("$unset", {}): invalidate_share_cache(event_doc.get("share_token"))
+        return Event(**event_doc)
+    # Échec : diagnostic (lecture supplémentaire uniquement dans ce cas)
+    current = await db.events.find_one({"id": event_id}, {"_id": 0, "version": 1})
+    if current is None:
+        raise HTTPException(status_code=404, detail="Événement non trouvé")
+    if version is not None and current.get("version", 0) != version:
+        raise HTTPException(status_code=409, detail=f"Événement modifié entre-temps (version actuelle : {current.get('version', 0)})")
+    if missing_detail:
+        raise HTTPException(status_code=404, detail=missing_detail)
+    return None
+
+@api_router.put("/events/{event_id}/joueurs-presents/{joueur_id}", response_model=Event)
+async def set_present_player(event_id: str, joueur_id: str, data: NoteTemporaireUpdate, version: Optional[int] = None,
+                             current_user: UserResponse = Depends(get_current_user)):
+    # Ajoute le joueur aux présents, ou modifie sa note s'il y est déjà
+    unset = {"$unset": {"share_snapshot": ""}}
+    for _ in range(3):
+        event = await apply_event_update(
+            event_id, {"$set": {"joueurs_presents.$.note_temporaire": data.note_temporaire}, **unset}, version,
+            condition={"joueurs_presents.joueur_id": joueur_id}
+        )
+        if event: return event
+        event = await apply_event_update(
+            event_id, {"$push": {"joueurs_presents": {"joueur_id": joueur_id, "note_temporaire": data.note_temporaire}}, **unset},
+            version, condition={"joueurs_presents.joueur_id": {"$ne": joueur_id}}
+        )
+        if event: return event
+    raise HTTPException(status_code=409, detail="Modifications concurrentes, veuillez réessayer")
+
+@api_router.delete("/events/{event_id}/joueurs-presents/{joueur_id}", response_model=Event)
+async def remove_present_player(event_id: str, joueur_id: str, version: Optional[int] = None,
+                                current_user: UserResponse = Depends(get_current_user)):
+    # Les contraintes qui mentionnent le joueur sont retirées dans la même écriture
+    return await apply_event_update(
+        event_id,
+        {"$pull": {"joueurs_presents": {"joueur_id": joueur_id}, "contraintes_affinite": {"joueurs": joueur_id}},
+         "$unset": {"share_snapshot": ""}},
+        version, condition={"joueurs_presents.joueur_id": joueur_id}, missing_detail="Joueur absent de l'événement"
+    )
+
+@api_router.post("/events/{event_id}/contraintes", response_model=Event)
+async def add_constraint(event_id: str, contrainte: ContrainteAffinite, version: Optional[int] = None,
+                         current_user: UserResponse = Depends(get_current_user)):
+    if contrainte.type not in CONSTRAINT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Type de contrainte inconnu : {contrainte.type}")
+    if len(set(contrainte.joueurs)) < 2:
+        raise HTTPException(status_code=400, detail="Une contrainte porte sur au moins deux joueurs différents")
+    return await apply_event_update(event_id, {"$addToSet": {"contraintes_affinite": contrainte.model_dump()}}, version)
+
+@api_router.delete("/events/{event_id}/contraintes", response_model=Event)
+async def remove_constraint(event_id: str, contrainte: ContrainteAffinite, version: Optional[int] = None,
+                            current_user: UserResponse = Depends(get_current_user)):
+    # Mêmes joueurs dans n'importe quel ordre : couvre aussi les contraintes stockées avant la forme triée
+    match = {"type": contrainte.type, "joueurs": {"$all": contrainte.joueurs, "$size": len(contrainte.joueurs)}}
+    return await apply_event_update(
+        event_id, {"$pull": {"contraintes_affinite": match}}, version,
+        condition={"contraintes_affinite": {"$elemMatch": match}}, missing_detail="Contrainte non trouvée"
+    )
+
 # ============= ### TEAM GENERATION (MODIFIÉ) ### =============
 
-async def get_player_details(joueur_ids: List[str]) -> Dict[str, PlayerInDB]:
-    players = await db.players.find({"id": {"$in": joueur_ids}}, {"_id": 0}).to_list(1000)
-    return {p["id"]: PlayerInDB(**p) for p in players}
+async def get_player_details(joueur_ids: List[str]) -> Dict[str, PlayerRecord]:
+    players = await db.players.find({"id": {"$in": joueur_ids}}, PLAYER_RECORD_PROJECTION).to_list(None)
+    return {p["id"]: PlayerRecord.from_doc(p) for p in players}
 
 ### MODIFIÉ: Calcule tous les scores moyens ###
-def calculate_team_stats(team: List[str], joueurs_map: Dict[str, PlayerInDB], notes_map: Dict[str, float]) -> Dict:
+def calculate_team_stats(team: List[str], joueurs_map: Dict[str, PlayerRecord], notes_map: Dict[str, float]) -> Dict:
     num_joueurs = len(team)
     if num_joueurs == 0:
         return {
@@ -421,10 +1136,10 @@ def calculate_team_stats(team: List[str], joueurs_map: Dict[str, PlayerInDB], no
             # La note utilisée est celle du match (note_temporaire)
             total_note += notes_map.get(jid, player.note_generale)
             
-            # Calcul des sous-scores basés sur les attributs de base
-            total_attaque += (player.tir + player.technique) / 2
-            total_milieu += (player.passe + player.vitesse) / 2
-            total_defense += (player.defense + player.physique) / 2
+            # Sous-scores précalculés à l'écriture du joueur
+            total_attaque += player.score_attaque
+            total_milieu += player.score_milieu
+            total_defense += player.score_defense
             
             for poste in player.postes:
                 postes_count[poste] = postes_count.get(poste, 0) + 1
@@ -438,88 +1153,939 @@ def calculate_team_stats(team: List[str], joueurs_map: Dict[str, PlayerInDB], no
         "total_note": total_note
     }
 
-# (check_constraints est inchangé)
+def build_teams_payload(teams: List[List[str]], joueurs_map: Dict[str, PlayerRecord], notes_map: Dict[str, float]) -> List[Dict]:
+    response_teams = []
+    for team in teams:
+        stats = calculate_team_stats(team, joueurs_map, notes_map)
+        joueurs_data = []
+        for jid in team:
+            player = joueurs_map.get(jid)
+            if player:
+                joueurs_data.append({
+                    "id": jid,
+                    "nom": player.nom,
+                    "note": notes_map.get(jid, player.note_generale),
+                    "postes": player.postes
+                })
+        response_teams.append({
+            "note_moyenne": stats["note_moyenne"],
+            "postes": stats["postes"],
+            "joueurs": joueurs_data
+        })
+    return response_teams
+
+def build_share_snapshot(event: Event, teams: List[List[str]], warning: Optional[str], joueurs_map: Dict[str, PlayerRecord]) -> Dict:
+    # Réponse publique de /share, calculée une fois puis stockée sur l'événement
+    notes_map = {jp.joueur_id: jp.note_temporaire for jp in event.joueurs_presents}
+    return {
+        "nom_evenement": event.nom_evenement,
+        "equipes": build_teams_payload(teams, joueurs_map, notes_map),
+        "warning_message": warning
+    }
+
+async def save_generated_teams(event: Event, teams: List[List[str]], warning: Optional[str], joueurs_map: Dict[str, PlayerRecord],
+                              version: Optional[int] = None) -> tuple:
+    # Renvoie l'instantané et la version écrite. Avec une version, l'enregistrement n'a lieu
+    # que si l'événement n'a pas changé depuis sa lecture
+    snapshot = build_share_snapshot(event, teams, warning, joueurs_map)
+    filtre = {"id": event.id}
+    if version is not None: filtre["version"] = version_filter(version)
+    event_doc = await db.events.find_one_and_update(
+        filtre,
+        {"$set": {"equipes_generees": teams, "warning_message": warning, "share_snapshot": snapshot}, "$inc": {"version": 1}},
+        projection={"_id": 0, "version": 1}, return_document=ReturnDocument.AFTER
+    )
+    if event_doc is None:
+        if version is not None and await db.events.count_documents({"id": event.id}, limit=1):
+            raise HTTPException(status_code=409, detail="L'événement a été modifié pendant la génération")
+        raise HTTPException(status_code=404, detail="Événement non trouvé")
+    invalidate_share_cache(event.share_token)
+    return snapshot, event_doc["version"]
+
+### MODIFIÉ: Vérification via un index joueur -> équipe (plus de parcours de listes) ###
 def check_constraints(teams: List[List[str]], contraintes: List[ContrainteAffinite]) -> bool:
+    team_of = {jid: team_idx for team_idx, team in enumerate(teams) for jid in team}
     for contrainte in contraintes:
+        team_ids = [team_of[j] for j in dict.fromkeys(contrainte.joueurs) if j in team_of]
         if contrainte.type == "lier":
-            joueur_teams = {}
-            for team_idx, team in enumerate(teams):
-                for joueur_id in contrainte.joueurs:
-                    if joueur_id in team:
-                        joueur_teams[joueur_id] = team_idx
-            if len(set(joueur_teams.values())) > 1: return False
+            if len(set(team_ids)) > 1: return False
         elif contrainte.type == "separer":
-            for team in teams:
-                joueurs_in_team = [j for j in contrainte.joueurs if j in team]
-                if len(joueurs_in_team) > 1: return False
+            if len(set(team_ids)) < len(team_ids): return False
     return True
 
-### MODIFIÉ: La fonction de scoring utilise les nouveaux scores ###
-def generate_balanced_teams(joueurs_presents: List[JoueurPresent], nombre_equipes: int, 
-                           contraintes: List[ContrainteAffinite], joueurs_map: Dict[str, PlayerInDB]) -> tuple:
-    notes_map = {jp.joueur_id: jp.note_temporaire for jp in joueurs_presents}
-    joueur_ids = list(notes_map.keys())
-    n_joueurs = len(joueur_ids)
-    
-    if n_joueurs < nombre_equipes:
-        raise ValueError("Pas assez de joueurs pour former le nombre d'équipes demandé")
-    
-    best_teams = None
+### MODIFIÉ: Moteur vectorisé (NumPy) ###
+# Budget de recherche configurable : nombre total de partitions candidates
+# évaluées et taille des lots scorés en une seule opération matricielle.
+GENERATION_MAX_ATTEMPTS = int(os.environ.get('GENERATION_MAX_ATTEMPTS', '20000'))
+GENERATION_BATCH_SIZE = int(os.environ.get('GENERATION_BATCH_SIZE', '1000'))
+# Nombre maximal de nœuds explorés pour prouver (ou réfuter) la faisabilité des contraintes
+GENERATION_FEASIBILITY_NODES = int(os.environ.get('GENERATION_FEASIBILITY_NODES', '20000'))
+
+# Pondération du déséquilibre : Général (x3), Attaque / Milieu / Défense (x2)
+SCORE_WEIGHTS = np.array([3.0, 2.0, 2.0, 2.0])
+
+def build_player_matrix(joueur_ids: List[str], joueurs_map: Dict[str, PlayerRecord], notes_map: Dict[str, float]) -> np.ndarray:
+    # Une ligne par joueur : note du match, attaque, milieu, défense
+    matrix = np.zeros((len(joueur_ids), 4))
+    for i, jid in enumerate(joueur_ids):
+        player = joueurs_map.get(jid)
+        if player:
+            matrix[i] = (
+                notes_map.get(jid, player.note_generale),
+                player.score_attaque,
+                player.score_milieu,
+                player.score_defense,
+            )
+    return matrix
+
+def compute_team_sizes(n_joueurs: int, nombre_equipes: int) -> np.ndarray:
+    base_size, extra = divmod(n_joueurs, nombre_equipes)
+    return np.array([base_size + (1 if i < extra else 0) for i in range(nombre_equipes)])
+
+def score_assignments(matrix: np.ndarray, assignments: np.ndarray, nombre_equipes: int) -> tuple:
+    # assignments : (lots, joueurs) -> index d'équipe de chaque joueur
+    one_hot = (assignments[:, :, None] == np.arange(nombre_equipes)).astype(float)
+    sums = np.einsum('bnt,nk->btk', one_hot, matrix)
+    means = sums / one_hot.sum(axis=1)[:, :, None]
+    scores = means.var(axis=1) @ SCORE_WEIGHTS
+    return scores, means
+
+def compile_constraints(contraintes: List[ContrainteAffinite], joueur_ids: List[str], joueurs_map: Dict[str, PlayerRecord]) -> tuple:
+    # Les groupes "lier" fusionnent en unités (union-find), les "separer" deviennent
+    # un graphe de conflits entre unités. Les joueurs absents de l'événement sont ignorés.
+    index_of = {jid: i for i, jid in enumerate(joueur_ids)}
+    parent = list(range(len(joueur_ids)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    separer_groups = []
+    for contrainte in contraintes:
+        idx = [index_of[j] for j in dict.fromkeys(contrainte.joueurs) if j in index_of]
+        if len(idx) < 2: continue
+        if contrainte.type == "lier":
+            for i in idx[1:]: parent[find(i)] = find(idx[0])
+        elif contrainte.type == "separer":
+            separer_groups.append(idx)
+
+    roots = {}
+    unit_of = [roots.setdefault(find(i), len(roots)) for i in range(len(joueur_ids))]
+    conflicts = [set() for _ in roots]
+
+    def nom(i: int) -> str:
+        player = joueurs_map.get(joueur_ids[i])
+        return player.nom if player else joueur_ids[i]
+
+    for idx in separer_groups:
+        seen = {}
+        for i in idx:
+            if unit_of[i] in seen:
+                raise ValueError(f"Contraintes contradictoires : {nom(seen[unit_of[i]])} et {nom(i)} doivent être à la fois liés et séparés.")
+            seen[unit_of[i]] = i
+        for u in seen: conflicts[u].update(v for v in seen if v != u)
+    return np.array(unit_of, dtype=int), conflicts
+
+def imbalance_warning(notes_moyennes: List[float]) -> Optional[str]:
+    # Vérifier si déséquilibre majeur (basé sur le Général)
+    ecart = max(notes_moyennes) - min(notes_moyennes)
+    if ecart > 1.5:
+        return f"⚠️ Les contraintes forcent un déséquilibre : écart de {ecart:.2f} points."
+    return None
+
+class TeamProblem:
+    # Données figées d'une génération : matrice, tailles d'équipes et contraintes compilées
+    def __init__(self, joueurs_presents: List[JoueurPresent], nombre_equipes: int,
+                 contraintes: List[ContrainteAffinite], joueurs_map: Dict[str, PlayerRecord]):
+        notes_map = {jp.joueur_id: jp.note_temporaire for jp in joueurs_presents}
+        self.joueur_ids = list(notes_map.keys())
+        self.index_of = {jid: i for i, jid in enumerate(self.joueur_ids)}
+        self.n_joueurs = len(self.joueur_ids)
+        if self.n_joueurs < nombre_equipes:
+            raise ValueError("Pas assez de joueurs pour former le nombre d'équipes demandé")
+        self.nombre_equipes = nombre_equipes
+        self.matrix = build_player_matrix(self.joueur_ids, joueurs_map, notes_map)
+        self.sizes = compute_team_sizes(self.n_joueurs, nombre_equipes)
+
+        self.unit_of, self.conflicts = compile_constraints(contraintes, self.joueur_ids, joueurs_map)
+        self.n_units = len(self.conflicts)
+        self.unit_sizes = np.bincount(self.unit_of, minlength=self.n_units)
+        self.unit_matrix = np.zeros((self.n_units, 4))
+        np.add.at(self.unit_matrix, self.unit_of, self.matrix)
+        self.conflict_arrays = [np.array(sorted(c), dtype=int) for c in self.conflicts]
+        if self.unit_sizes.max() > self.sizes.max():
+            raise ValueError(f"Un groupe de joueurs liés ({self.unit_sizes.max()}) dépasse la taille d'une équipe ({self.sizes.max()}).")
+
+        # Les unités contraintes sont placées d'abord (les plus grosses et les plus
+        # conflictuelles en tête), les joueurs libres comblent les places restantes.
+        constrained = [u for u in range(self.n_units) if self.unit_sizes[u] > 1 or self.conflicts[u]]
+        self.constrained_units = sorted(constrained, key=lambda u: (-self.unit_sizes[u], -len(self.conflicts[u])))
+        self.free_units = np.array(sorted(set(range(self.n_units)) - set(constrained)), dtype=int)
+        self.has_constraints = bool(constrained)
+
+        self.seed_assignment = None
+        if self.has_constraints:
+            status, unit_team = find_feasible_assignment(self, GENERATION_FEASIBILITY_NODES)
+            if status == "impossible":
+                raise ValueError("Aucune répartition ne respecte toutes les contraintes (liens, séparations et tailles d'équipes). Essayez moins de contraintes.")
+            if unit_team is not None:
+                self.seed_assignment = unit_team[self.unit_of]
+
+    def random_assignments(self, rng: np.random.Generator, batch: int) -> np.ndarray:
+        # Chaque ligne est une permutation aléatoire découpée en équipes
+        slot_teams = np.repeat(np.arange(self.nombre_equipes), self.sizes)
+        perms = rng.random((batch, self.n_joueurs)).argsort(axis=1)
+        assignments = np.empty_like(perms)
+        np.put_along_axis(assignments, perms, np.broadcast_to(slot_teams, perms.shape), axis=1)
+        return assignments
+
+    def sample_assignments(self, rng: np.random.Generator, batch: int) -> np.ndarray:
+        # Tirage de partitions qui respectent les contraintes par construction
+        if not self.has_constraints:
+            return self.random_assignments(rng, batch)
+        rows = np.arange(batch)
+        remaining = np.tile(self.sizes, (batch, 1))
+        blocked = np.zeros((batch, self.nombre_equipes, self.n_units), dtype=bool)
+        unit_team = np.zeros((batch, self.n_units), dtype=int)
+        alive = np.ones(batch, dtype=bool)
+        for u in self.constrained_units:
+            allowed = (remaining >= self.unit_sizes[u]) & ~blocked[:, :, u]
+            alive &= allowed.any(axis=1)
+            # Équipe tirée uniformément parmi celles encore admissibles
+            pick = np.where(allowed, rng.random(allowed.shape), -1.0).argmax(axis=1)
+            unit_team[:, u] = pick
+            remaining[rows, pick] -= self.unit_sizes[u]
+            if len(self.conflict_arrays[u]):
+                blocked[rows[:, None], pick[:, None], self.conflict_arrays[u][None, :]] = True
+        n_free = len(self.free_units)
+        if n_free:
+            # Les joueurs libres occupent les places restantes dans un ordre aléatoire
+            slot_teams = (np.cumsum(remaining, axis=1)[:, None, :] <= np.arange(n_free)[None, :, None]).sum(axis=2)
+            perms = rng.random((batch, n_free)).argsort(axis=1)
+            unit_team[rows[:, None], self.free_units[perms]] = slot_teams
+        return unit_team[alive][:, self.unit_of]
+
+    def assignment_from_teams(self, teams: List[List[str]]) -> Optional[np.ndarray]:
+        # Une partition existante n'est reprise que si elle couvre exactement les joueurs
+        # présents, avec les bonnes tailles d'équipes et sans violer de contrainte
+        if len(teams) != self.nombre_equipes: return None
+        assignment = np.full(self.n_joueurs, -1)
+        for t, team in enumerate(sorted(teams, key=len, reverse=True)):
+            for jid in team:
+                i = self.index_of.get(jid)
+                if i is None or assignment[i] != -1: return None
+                assignment[i] = t
+        if (assignment < 0).any(): return None
+        if np.bincount(assignment, minlength=self.nombre_equipes).tolist() != self.sizes.tolist(): return None
+        unit_team = self.unit_teams(assignment)
+        if (unit_team[self.unit_of] != assignment).any(): return None
+        if any(unit_team[u] == unit_team[v] for u in range(self.n_units) for v in self.conflicts[u]): return None
+        return assignment
+
+    def unit_teams(self, assignment: np.ndarray) -> np.ndarray:
+        unit_team = np.empty(self.n_units, dtype=int)
+        unit_team[self.unit_of] = assignment
+        return unit_team
+
+    def to_teams(self, assignment: np.ndarray) -> List[List[str]]:
+        # Les plus grandes équipes restent en tête
+        teams = [[self.joueur_ids[i] for i in np.flatnonzero(assignment == t)] for t in range(self.nombre_equipes)]
+        return sorted(teams, key=len, reverse=True)
+
+def find_feasible_assignment(problem: TeamProblem, node_limit: int) -> tuple:
+    # Recherche en profondeur sur les unités contraintes ; renvoie ("ok", unité -> équipe),
+    # ("impossible", None) si l'espace est épuisé, ("inconnu", None) si le budget est dépassé.
+    units = problem.constrained_units
+    remaining = problem.sizes.tolist()
+    placed = [0] * len(remaining)
+    unit_team = [-1] * problem.n_units
+    nodes = 0
+
+    def place(k: int) -> Optional[bool]:
+        nonlocal nodes
+        if k == len(units): return True
+        nodes += 1
+        if nodes > node_limit: return None
+        u = units[k]
+        size = int(problem.unit_sizes[u])
+        empty_capacities = set()
+        for t in range(len(remaining)):
+            if remaining[t] < size: continue
+            if placed[t] == 0:
+                # Symétrie : deux équipes vides de même taille sont interchangeables
+                if remaining[t] in empty_capacities: continue
+                empty_capacities.add(remaining[t])
+            if any(unit_team[v] == t for v in problem.conflicts[u]): continue
+            remaining[t] -= size
+            placed[t] += 1
+            unit_team[u] = t
+            result = place(k + 1)
+            if result is not False: return result
+            remaining[t] += size
+            placed[t] -= 1
+            unit_team[u] = -1
+        return False
+
+    result = place(0)
+    if result is None: return "inconnu", None
+    if result is False: return "impossible", None
+    free = iter(problem.free_units.tolist())
+    for t, count in enumerate(remaining):
+        for _ in range(count): unit_team[next(free)] = t
+    return "ok", np.array(unit_team)
+
+class TopPartitions:
+    # Tas borné des K meilleures partitions distinctes ; deux partitions identiques
+    # à l'ordre des équipes près partagent la même clé canonique
+    def __init__(self, k: int, nombre_equipes: int):
+        self.k = k
+        self.nombre_equipes = nombre_equipes
+        self.heap = []
+        self.keys = set()
+
+    def threshold(self) -> float:
+        return -self.heap[0][0] if len(self.heap) >= self.k else float('inf')
+
+    def offer(self, score: float, assignment: np.ndarray):
+        if score >= self.threshold(): return
+        key = tuple(sorted(tuple(np.flatnonzero(assignment == t).tolist()) for t in range(self.nombre_equipes)))
+        if key in self.keys: return
+        heapq.heappush(self.heap, (-score, key, assignment.copy()))
+        self.keys.add(key)
+        if len(self.heap) > self.k:
+            _, removed, _ = heapq.heappop(self.heap)
+            self.keys.discard(removed)
+
+    def offer_batch(self, scores: np.ndarray, assignments: np.ndarray):
+        for i in np.argsort(scores):
+            if scores[i] >= self.threshold(): break
+            self.offer(float(scores[i]), assignments[i])
+
+    def assignments(self) -> List[np.ndarray]:
+        return [assignment for _, _, assignment in sorted(self.heap, reverse=True)]
+
+GENERATION_METHODS = get_args(MethodeGeneration)
+# Budget temps commun (secondes) ; plafond d'échanges de la recherche locale et longueur d'un palier de recuit
+GENERATION_TIME_BUDGET = float(os.environ.get('GENERATION_TIME_BUDGET', '1.0'))
+GENERATION_LOCAL_ITERATIONS = int(os.environ.get('GENERATION_LOCAL_ITERATIONS', '20000'))
+GENERATION_LOCAL_ROUND = int(os.environ.get('GENERATION_LOCAL_ROUND', '2000'))
+
+def random_search(problem: TeamProblem, rng: np.random.Generator, max_attempts: int, deadline: float,
+                  stats: Dict, start: Optional[np.ndarray] = None, top: Optional[TopPartitions] = None) -> Optional[np.ndarray]:
+    best_assignment = start if start is not None else problem.seed_assignment
+    best_score = float('inf')
+    if best_assignment is not None:
+        best_score = float(score_assignments(problem.matrix, best_assignment[None, :], problem.nombre_equipes)[0][0])
+        if top is not None: top.offer(best_score, best_assignment)
+    remaining = max_attempts
+    while remaining > 0 and time.monotonic() < deadline:
+        batch = min(remaining, GENERATION_BATCH_SIZE)
+        remaining -= batch
+        assignments = problem.sample_assignments(rng, batch)
+        stats["tentatives"] += len(assignments)
+        stats["rejets"] += batch - len(assignments)
+        if not len(assignments): continue
+        scores, _ = score_assignments(problem.matrix, assignments, problem.nombre_equipes)
+        if top is not None: top.offer_batch(scores, assignments)
+        best = int(scores.argmin())
+        if scores[best] < best_score:
+            best_score = float(scores[best])
+            best_assignment = assignments[best]
+            stats["meilleur_a"] = time.monotonic()
+    return best_assignment
+
+def local_search(problem: TeamProblem, rng: np.random.Generator, max_iterations: int, deadline: float,
+                 stats: Dict, start: Optional[np.ndarray] = None, top: Optional[TopPartitions] = None,
+                 pairs: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+    # pairs (unités x unités, déjà pondérée) : pénalité des coéquipiers répétés, ajoutée au score
+    # Point de départ : la partition fournie, sinon une partition valide tirée au hasard
+    if start is None:
+        start = problem.seed_assignment
+        candidates = problem.sample_assignments(rng, 64)
+        if len(candidates): start = candidates[0]
+    if start is None: return None
+
+    n_units, n_teams = problem.n_units, problem.nombre_equipes
+    if n_teams < 2 or n_units < 2: return start
+    vectors = problem.unit_matrix.tolist()
+    unit_sizes = problem.unit_sizes.tolist()
+    weights = SCORE_WEIGHTS.tolist()
+    conflicts = problem.conflicts
+    team_of = problem.unit_teams(start).tolist()
+    members = [[] for _ in range(n_teams)]
+    for u, t in enumerate(team_of): members[t].append(u)
+    counts = problem.sizes.tolist()
+
+    # Sommes courantes par équipe, et sommes des moyennes / des carrés par attribut
+    sums = [[0.0] * 4 for _ in range(n_teams)]
+    for u, t in enumerate(team_of):
+        for k in range(4): sums[t][k] += vectors[u][k]
+    means = [[sums[t][k] / counts[t] for k in range(4)] for t in range(n_teams)]
+    sum_m = [sum(means[t][k] for t in range(n_teams)) for k in range(4)]
+    sum_m2 = [sum(means[t][k] ** 2 for t in range(n_teams)) for k in range(4)]
+
+    def score_of(sm: List[float], sm2: List[float]) -> float:
+        return sum(weights[k] * (sm2[k] / n_teams - (sm[k] / n_teams) ** 2) for k in range(4))
+
+    # pair_team[w, t] : pénalité cumulée de l'unité w avec les unités de l'équipe t
+    pair_delta = 0.0
+    if pairs is not None:
+        pair_team = np.stack([pairs[:, members[t]].sum(axis=1) for t in range(n_teams)], axis=1)
+        pair_current = float(sum(pair_team[u, t] - pairs[u, u] for u, t in enumerate(team_of))) / 2
+
+    current = score_of(sum_m, sum_m2) + (pair_current if pairs is not None else 0.0)
+    best_score, best_team_of = current, list(team_of)
+    # Recuit par paliers : chaque palier refroidit de la température initiale à 1e-4 près ;
+    # on s'arrête au premier palier qui n'améliore pas le meilleur score (au plus max_iterations)
+    round_length = max(min(max_iterations, GENERATION_LOCAL_ROUND), 1)
+    round_best = best_score
+    temperature = max(current, 1e-6)
+    cooling = (1e-4) ** (1 / round_length)
+    rand = random.Random(int(rng.integers(2 ** 32)))
+
+    for iteration in range(max_iterations):
+        if iteration % 256 == 0 and time.monotonic() > deadline: break
+        if iteration and iteration % round_length == 0:
+            if best_score >= round_best: break
+            round_best, temperature = best_score, max(current, 1e-6)
+        temperature *= cooling
+        u = rand.randrange(n_units)
+        a = team_of[u]
+        b = rand.randrange(n_teams - 1)
+        if b >= a: b += 1
+        size = unit_sizes[u]
+
+        # Mouvement : déplacer u seul (les tailles de a et b s'échangent), ou
+        # l'échanger contre des unités de b totalisant le même nombre de joueurs
+        if counts[a] - size == counts[b]:
+            group = []
+        elif size == 1:
+            v = members[b][rand.randrange(len(members[b]))]
+            if unit_sizes[v] != 1: continue
+            group = [v]
+        else:
+            group, total = [], 0
+            for v in rand.sample(members[b], len(members[b])):
+                if total + unit_sizes[v] <= size:
+                    group.append(v)
+                    total += unit_sizes[v]
+                    if total == size: break
+            if total != size: continue
+        if any(team_of[c] == b and c not in group for c in conflicts[u]) or \
+                any(team_of[c] == a and c != u for v in group for c in conflicts[v]):
+            stats["rejets"] += 1
+            continue
+        stats["tentatives"] += 1
+
+        # Variation O(1) : seules les moyennes des équipes a et b bougent
+        moved = list(vectors[u])
+        moved_size = size
+        for v in group:
+            moved_size -= unit_sizes[v]
+            for k in range(4): moved[k] -= vectors[v][k]
+        count_a, count_b = counts[a] - moved_size, counts[b] + moved_size
+        new_a = [(sums[a][k] - moved[k]) / count_a for k in range(4)]
+        new_b = [(sums[b][k] + moved[k]) / count_b for k in range(4)]
+        new_sm = [sum_m[k] + new_a[k] - means[a][k] + new_b[k] - means[b][k] for k in range(4)]
+        new_sm2 = [sum_m2[k] + new_a[k] ** 2 - means[a][k] ** 2 + new_b[k] ** 2 - means[b][k] ** 2 for k in range(4)]
+        candidate = score_of(new_sm, new_sm2)
+        if pairs is not None:
+            # Paires gagnées moins paires perdues par u et par le groupe échangé
+            pair_delta = pair_team[u, b] - pair_team[u, a] + pairs[u, u]
+            for v in group:
+                pair_delta += pair_team[v, a] - pair_team[v, b] - 2 * pairs[u, v] + sum(pairs[v, w] for w in group)
+            candidate += pair_current + pair_delta
+        delta = candidate - current
+        if delta > 0 and rand.random() >= math.exp(-delta / temperature): continue
+
+        team_of[u] = b
+        members[a].remove(u)
+        members[b].append(u)
+        for v in group:
+            team_of[v] = a
+            members[b].remove(v)
+            members[a].append(v)
+        counts[a], counts[b] = count_a, count_b
+        for k in range(4):
+            sums[a][k] -= moved[k]
+            sums[b][k] += moved[k]
+        means[a], means[b] = new_a, new_b
+        sum_m, sum_m2, current = new_sm, new_sm2, candidate
+        if pairs is not None:
+            pair_current += pair_delta
+            pair_team[:, a] -= pairs[:, u]
+            pair_team[:, b] += pairs[:, u]
+            for v in group:
+                pair_team[:, b] -= pairs[:, v]
+                pair_team[:, a] += pairs[:, v]
+        if current < best_score - 1e-12:
+            best_score, best_team_of = current, list(team_of)
+            stats["meilleur_a"] = time.monotonic()
+        if top is not None and current < top.threshold():
+            top.offer(current, np.array(team_of)[problem.unit_of])
+
+    return np.array(best_team_of)[problem.unit_of]
+
+# Taille maximale estimée de l'espace des partitions pour la méthode exacte
+GENERATION_EXACT_MAX_PARTITIONS = int(os.environ.get('GENERATION_EXACT_MAX_PARTITIONS', '200000'))
+
+def estimate_partition_count(problem: TeamProblem) -> int:
+    # Partitions distinctes, aux permutations près des équipes de même taille
+    count = math.factorial(problem.n_joueurs)
+    for size in problem.sizes.tolist(): count //= math.factorial(size)
+    for multiplicity in np.unique(problem.sizes, return_counts=True)[1].tolist():
+        count //= math.factorial(multiplicity)
+    return count
+
+def enumerate_partitions(problem: TeamProblem, batch: int) -> Iterator[np.ndarray]:
+    n = problem.n_joueurs
+    if problem.nombre_equipes == 2 and not problem.has_constraints:
+        # Deux équipes sans contraintes : la première équipe suffit à décrire la partition.
+        # À tailles égales, le joueur 0 est fixé dans la première équipe (symétrie).
+        size = int(problem.sizes[0])
+        if size == problem.sizes[1]:
+            combos = ((0,) + rest for rest in combinations(range(1, n), size - 1))
+        else:
+            combos = combinations(range(n), size)
+        while True:
+            chunk = np.array(list(islice(combos, batch)), dtype=int).reshape(-1, size)
+            if not len(chunk): return
+            assignments = np.ones((len(chunk), n), dtype=int)
+            assignments[np.arange(len(chunk))[:, None], chunk] = 0
+            yield assignments
+        return
+
+    # Cas général : parcours en profondeur des unités (contraintes d'abord), une
+    # équipe vide n'est essayée qu'une fois par taille pour casser les symétries
+    units = problem.constrained_units + problem.free_units.tolist()
+    remaining = problem.sizes.tolist()
+    placed = [0] * len(remaining)
+    unit_team = [-1] * problem.n_units
+    buffer = np.empty((batch, problem.n_units), dtype=int)
+    filled = 0
+
+    def place(k: int) -> Iterator[np.ndarray]:
+        nonlocal filled
+        if k == len(units):
+            buffer[filled] = unit_team
+            filled += 1
+            if filled == batch:
+                filled = 0
+                yield buffer[:, problem.unit_of]
+            return
+        u = units[k]
+        size = int(problem.unit_sizes[u])
+        empty_capacities = set()
+        for t in range(len(remaining)):
+            if remaining[t] < size: continue
+            if placed[t] == 0:
+                if remaining[t] in empty_capacities: continue
+                empty_capacities.add(remaining[t])
+            if any(unit_team[v] == t for v in problem.conflicts[u]): continue
+            remaining[t] -= size
+            placed[t] += 1
+            unit_team[u] = t
+            yield from place(k + 1)
+            remaining[t] += size
+            placed[t] -= 1
+            unit_team[u] = -1
+
+    yield from place(0)
+    if filled: yield buffer[:filled, problem.unit_of]
+
+def exact_search(problem: TeamProblem, deadline: float, stats: Dict, top: Optional[TopPartitions] = None) -> tuple:
+    # Renvoie la meilleure partition trouvée et True si l'espace a été entièrement parcouru
+    best_assignment = None
     best_score = float('inf')
-    warning_message = None
-    max_attempts = 2000 # Augmenté pour une recherche plus approfondie
+    for assignments in enumerate_partitions(problem, GENERATION_BATCH_SIZE):
+        stats["tentatives"] += len(assignments)
+        scores, _ = score_assignments(problem.matrix, assignments, problem.nombre_equipes)
+        if top is not None: top.offer_batch(scores, assignments)
+        best = int(scores.argmin())
+        if scores[best] < best_score:
+            best_score = float(scores[best])
+            best_assignment = assignments[best]
+            stats["meilleur_a"] = time.monotonic()
+        if time.monotonic() > deadline: return best_assignment, False
+    return best_assignment, True
+
+def run_team_generation(joueurs_presents: List[JoueurPresent], nombre_equipes: int,
+                        contraintes: List[ContrainteAffinite], joueurs_map: Dict[str, PlayerRecord],
+                        max_attempts: Optional[int] = None, methode: str = "aleatoire",
+                        time_budget: Optional[float] = None,
+                        equipes_initiales: Optional[List[List[str]]] = None,
+                        top_k: int = 1, seed: Optional[int] = None) -> Dict:
+    if methode not in GENERATION_METHODS:
+        raise ValueError(f"Méthode de génération inconnue : {methode}")
+    # La matrice joueurs x attributs est construite une seule fois
+    problem = TeamProblem(joueurs_presents, nombre_equipes, contraintes, joueurs_map)
+    # Avec une graine, le résultat est reproductible tant que le budget temps n'interrompt pas la recherche
+    rng = np.random.default_rng(seed)
+    budget = time_budget or GENERATION_TIME_BUDGET
+    started = time.monotonic()
+    deadline = started + budget
+    optimal = False
+    stats = {"tentatives": 0, "rejets": 0}
+    # Reprise d'une partition précédente (génération par tranches successives)
+    start = problem.assignment_from_teams(equipes_initiales) if equipes_initiales else None
+    # Propositions alternatives : les K meilleures partitions distinctes rencontrées
+    top = TopPartitions(top_k, nombre_equipes) if top_k > 1 else None
     
-    for attempt in range(max_attempts):
-        shuffled = joueur_ids.copy()
-        random.shuffle(shuffled)
-        base_size = n_joueurs // nombre_equipes
-        extra = n_joueurs % nombre_equipes
-        teams = []
-        idx = 0
-        for i in range(nombre_equipes):
-            team_size = base_size + (1 if i < extra else 0)
-            teams.append(shuffled[idx:idx + team_size])
-            idx += team_size
-        
-        if not check_constraints(teams, contraintes): continue
-        
-        team_stats = [calculate_team_stats(team, joueurs_map, notes_map) for team in teams]
-        
-        # Calculer la variance (déséquilibre) pour chaque métrique
-        def calculate_variance(scores: List[float]) -> float:
-            if not scores: return 0
-            mean = sum(scores) / len(scores)
-            return sum((s - mean) ** 2 for s in scores) / len(scores)
-
-        score_generale = calculate_variance([s["note_moyenne"] for s in team_stats])
-        score_attaque = calculate_variance([s["avg_attaque"] for s in team_stats])
-        score_milieu = calculate_variance([s["avg_milieu"] for s in team_stats])
-        score_defense = calculate_variance([s["avg_defense"] for s in team_stats])
-
-        # Score total pondéré: Le Général est le plus important (x3)
-        # Les sous-scores sont importants aussi (x2)
-        total_score = (score_generale * 3) + (score_attaque * 2) + (score_milieu * 2) + (score_defense * 2)
-        
-        if total_score < best_score:
-            best_score = total_score
-            best_teams = teams
-            
-            # Vérifier si déséquilibre majeur (basé sur le Général)
-            notes_moyennes = [s["note_moyenne"] for s in team_stats]
-            max_note = max(notes_moyennes)
-            min_note = min(notes_moyennes)
-            if max_note - min_note > 1.5:
-                warning_message = f"⚠️ Les contraintes forcent un déséquilibre : écart de {max_note - min_note:.2f} points."
-            else:
-                warning_message = None # Réinitialiser le warning si on trouve un meilleur équilibre
+    if methode == "exacte":
+        best_assignment = None
+        if estimate_partition_count(problem) <= GENERATION_EXACT_MAX_PARTITIONS:
+            # La moitié du budget pour l'énumération, le reste pour un éventuel repli
+            best_assignment, optimal = exact_search(problem, time.monotonic() + budget / 2, stats, top)
+        if not optimal:
+            # Repli automatique sur la recherche locale (espace trop grand ou budget dépassé)
+            fallback = local_search(problem, rng, max_attempts or GENERATION_LOCAL_ITERATIONS, deadline, stats, start, top)
+            candidates = [c for c in (best_assignment, fallback) if c is not None]
+            if candidates:
+                scores, _ = score_assignments(problem.matrix, np.stack(candidates), problem.nombre_equipes)
+                best_assignment = candidates[int(scores.argmin())]
+    elif methode == "recherche_locale":
+        best_assignment = local_search(problem, rng, max_attempts or GENERATION_LOCAL_ITERATIONS, deadline, stats, start, top)
+    else:
+        best_assignment = random_search(problem, rng, max_attempts or GENERATION_MAX_ATTEMPTS, deadline, stats, start, top)
     
-    if best_teams is None:
+    if best_assignment is None:
         raise ValueError("Impossible de générer des équipes respectant toutes les contraintes. Essayez moins de contraintes.")
     
-    return best_teams, warning_message
+    # Scores recalculés exactement (la recherche locale les suit de façon incrémentale)
+    candidates = [best_assignment] + (top.assignments() if top is not None else [])
+    scores, means = score_assignments(problem.matrix, np.stack(candidates), problem.nombre_equipes)
+    alternatives = sorted((
+        {
+            "equipes": problem.to_teams(assignment),
+            "warning_message": imbalance_warning([round(float(m), 2) for m in means[i, :, 0]]),
+            "score": float(scores[i]),
+        }
+        for i, assignment in enumerate(candidates)
+    ), key=lambda alt: alt["score"])
+    # Deux étiquetages d'une même partition donnent les mêmes équipes : on dédoublonne
+    unique = {}
+    for alt in alternatives:
+        unique.setdefault(tuple(sorted(tuple(sorted(team)) for team in alt["equipes"])), alt)
+    alternatives = list(unique.values())[:top_k]
+    # Instant de la dernière amélioration (0 si le point de départ n'a jamais été battu)
+    temps_meilleur = stats.pop("meilleur_a", started) - started
+    return {
+        **alternatives[0],
+        "optimal": optimal,
+        "alternatives": alternatives,
+        "temps_meilleur": temps_meilleur,
+        **stats,
+    }
+
+def generate_balanced_teams(joueurs_presents: List[JoueurPresent], nombre_equipes: int, 
+                           contraintes: List[ContrainteAffinite], joueurs_map: Dict[str, PlayerRecord],
+                           max_attempts: Optional[int] = None, methode: str = "aleatoire",
+                           time_budget: Optional[float] = None) -> tuple:
+    result = run_team_generation(joueurs_presents, nombre_equipes, contraintes, joueurs_map,
+                                 max_attempts=max_attempts, methode=methode, time_budget=time_budget)
+    return result["equipes"], result["warning_message"]
+
+# ============= RÉÉQUILIBRAGE INCRÉMENTAL =============
+# Après un désistement ou une arrivée tardive : on repart des équipes déjà générées,
+# on ne place ou retire que les joueurs concernés, puis on ne fait que les échanges qui
+# améliorent nettement le score (gain relatif >= INCREMENTAL_MIN_GAIN), au plus
+# INCREMENTAL_MAX_SWAPS (0 : un quart des unités).
+INCREMENTAL_MIN_GAIN = float(os.environ.get('INCREMENTAL_MIN_GAIN', '0.05'))
+INCREMENTAL_MAX_SWAPS = int(os.environ.get('INCREMENTAL_MAX_SWAPS', '0'))
+
+def align_teams(previous: List[List[str]], teams: List[List[str]]) -> List[List[str]]:
+    # Ordre des équipes qui garde le plus de joueurs dans « leur » équipe précédente
+    if len(previous) != len(teams): return teams
+    overlap = [[len(set(p) & set(t)) for t in teams] for p in previous]
+    n = len(teams)
+    if n <= 7:
+        order = max(permutations(range(n)), key=lambda perm: sum(overlap[i][perm[i]] for i in range(n)))
+    else:
+        order, free = [], set(range(n))
+        for i in range(n):
+            j = max(free, key=lambda j: overlap[i][j])
+            order.append(j)
+            free.remove(j)
+    return [teams[j] for j in order]
+
+def count_moved(previous: List[List[str]], teams: List[List[str]]) -> int:
+    team_before = {jid: t for t, team in enumerate(previous) for jid in team}
+    return sum(1 for t, team in enumerate(teams) for jid in team if jid in team_before and team_before[jid] != t)
+
+def incremental_search(problem: TeamProblem, previous: List[List[str]], stats: Dict,
+                       max_swaps: Optional[int] = None) -> Optional[np.ndarray]:
+    # Renvoie une affectation dont les indices d'équipe suivent ceux de previous, ou None
+    n_teams, n_units = problem.nombre_equipes, problem.n_units
+    if len(previous) != n_teams: return None
+    team_before = {jid: t for t, team in enumerate(previous) for jid in team}
+    members = [[] for _ in range(n_units)]
+    for i, u in enumerate(problem.unit_of): members[u].append(i)
+    vectors, unit_sizes, conflicts = problem.unit_matrix, problem.unit_sizes, problem.conflicts
+
+    # 1. Une unité reste dans son équipe si tous ses membres déjà placés y étaient ensemble
+    unit_team = np.full(n_units, -1)
+    for u in range(n_units):
+        placed = {team_before[problem.joueur_ids[i]] for i in members[u] if problem.joueur_ids[i] in team_before}
+        if len(placed) == 1: unit_team[u] = placed.pop()
+    for u in range(n_units):
+        if unit_team[u] >= 0 and any(unit_team[v] == unit_team[u] for v in conflicts[u]): unit_team[u] = -1
+
+    # 2. Tailles cibles : les équipes les plus remplies reçoivent les plus grandes tailles
+    kept = np.bincount(unit_team[unit_team >= 0], weights=unit_sizes[unit_team >= 0], minlength=n_teams)
+    target = np.empty(n_teams, dtype=int)
+    target[np.argsort(-kept, kind="stable")] = problem.sizes
+    # Équipe trop pleine : on sort d'abord les joueurs les plus proches de la moyenne (les plus neutres)
+    center = problem.matrix.mean(axis=0)
+    neutrality = ((vectors / unit_sizes[:, None] - center) ** 2) @ SCORE_WEIGHTS
+    for t in range(n_teams):
+        while kept[t] > target[t]:
+            candidates = [u for u in np.flatnonzero(unit_team == t)]
+            fitting = [u for u in candidates if unit_sizes[u] <= kept[t] - target[t]] or candidates
+            u = min(fitting, key=lambda u: (neutrality[u], u))
+            unit_team[u] = -1
+            kept[t] -= unit_sizes[u]
+
+    # 3. Placement glouton des unités libres (les plus contraintes d'abord)
+    sums = np.zeros((n_teams, 4))
+    counts = np.zeros(n_teams)
+    for u in np.flatnonzero(unit_team >= 0):
+        sums[unit_team[u]] += vectors[u]
+        counts[unit_team[u]] += unit_sizes[u]
+    pending = sorted(np.flatnonzero(unit_team < 0), key=lambda u: (-unit_sizes[u], -len(conflicts[u])))
+    for u in pending:
+        best_t, best_score = -1, float('inf')
+        for t in range(n_teams):
+            if counts[t] + unit_sizes[u] > target[t] or any(unit_team[v] == t for v in conflicts[u]):
+                stats["rejets"] += 1
+                continue
+            stats["tentatives"] += 1
+            new_sums, new_counts = sums.copy(), counts.copy()
+            new_sums[t] += vectors[u]
+            new_counts[t] += unit_sizes[u]
+            filled = new_counts > 0
+            score = float((new_sums[filled] / new_counts[filled, None]).var(axis=0) @ SCORE_WEIGHTS)
+            if score < best_score: best_t, best_score = t, score
+        if best_t < 0: return None
+        unit_team[u] = best_t
+        sums[best_t] += vectors[u]
+        counts[best_t] += unit_sizes[u]
+
+    # 4. Réparation : meilleur échange d'unités de même taille, tant qu'il rapporte assez
+    means = sums / counts[:, None]
+    sum_m, sum_m2 = means.sum(axis=0), (means ** 2).sum(axis=0)
+    current = float((sum_m2 / n_teams - (sum_m / n_teams) ** 2) @ SCORE_WEIGHTS)
+    limit = max_swaps or INCREMENTAL_MAX_SWAPS or max(1, n_units // 4)
+    for _ in range(limit):
+        best = None
+        for a in range(n_teams):
+            for b in range(a + 1, n_teams):
+                units_a, units_b = np.flatnonzero(unit_team == a), np.flatnonzero(unit_team == b)
+                same_size = unit_sizes[units_a][:, None] == unit_sizes[units_b][None, :]
+                diff = vectors[units_a][:, None, :] - vectors[units_b][None, :, :]
+                new_a = (sums[a] - diff) / counts[a]
+                new_b = (sums[b] + diff) / counts[b]
+                new_sm = sum_m + new_a - means[a] + new_b - means[b]
+                new_sm2 = sum_m2 + new_a ** 2 - means[a] ** 2 + new_b ** 2 - means[b] ** 2
+                scores = np.where(same_size, (new_sm2 / n_teams - (new_sm / n_teams) ** 2) @ SCORE_WEIGHTS, np.inf)
+                stats["tentatives"] += int(same_size.sum())
+                threshold = best[0] if best else current * (1 - INCREMENTAL_MIN_GAIN)
+                for flat in np.argsort(scores, axis=None):
+                    i, j = np.unravel_index(flat, scores.shape)
+                    if scores[i, j] >= threshold: break
+                    u, v = units_a[i], units_b[j]
+                    if any(unit_team[c] == b and c != v for c in conflicts[u]) or \
+                            any(unit_team[c] == a and c != u for c in conflicts[v]):
+                        stats["rejets"] += 1
+                        continue
+                    best = (float(scores[i, j]), a, b, u, v)
+                    break
+        if best is None: break
+        current, a, b, u, v = best
+        unit_team[u], unit_team[v] = b, a
+        sums[a] += vectors[v] - vectors[u]
+        sums[b] += vectors[u] - vectors[v]
+        means = sums / counts[:, None]
+        sum_m, sum_m2 = means.sum(axis=0), (means ** 2).sum(axis=0)
+        stats["meilleur_a"] = time.monotonic()
+    return unit_team[problem.unit_of]
+
+def run_incremental_generation(joueurs_presents: List[JoueurPresent], nombre_equipes: int,
+                               contraintes: List[ContrainteAffinite], joueurs_map: Dict[str, PlayerRecord],
+                               equipes_precedentes: List[List[str]], time_budget: Optional[float] = None) -> Dict:
+    problem = TeamProblem(joueurs_presents, nombre_equipes, contraintes, joueurs_map)
+    started = time.monotonic()
+    stats = {"tentatives": 0, "rejets": 0}
+    assignment = incremental_search(problem, equipes_precedentes, stats)
+    if assignment is None:
+        # Réparation impossible (nombre d'équipes changé, contraintes trop serrées) : recherche complète
+        result = run_team_generation(joueurs_presents, nombre_equipes, contraintes, joueurs_map,
+                                     methode="recherche_locale", time_budget=time_budget)
+        equipes = align_teams(equipes_precedentes, result["equipes"])
+        return {**result, "equipes": equipes, "incremental": False,
+                "joueurs_deplaces": count_moved(equipes_precedentes, equipes)}
+    scores, means = score_assignments(problem.matrix, assignment[None, :], nombre_equipes)
+    equipes = [[problem.joueur_ids[i] for i in np.flatnonzero(assignment == t)] for t in range(nombre_equipes)]
+    proposition = {
+        "equipes": equipes,
+        "warning_message": imbalance_warning([round(float(m), 2) for m in means[0, :, 0]]),
+        "score": float(scores[0]),
+    }
+    return {
+        **proposition,
+        "optimal": False,
+        "alternatives": [proposition],
+        "temps_meilleur": stats.pop("meilleur_a", started) - started,
+        "incremental": True,
+        "joueurs_deplaces": count_moved(equipes_precedentes, equipes),
+        **stats,
+    }
+
+# ============= EXÉCUTION HORS BOUCLE ASYNCIO =============
+# La génération est CPU-bound : elle tourne dans un pool (processus par défaut,
+# threads si suffisant) avec un plafond de générations simultanées et un délai.
+GENERATION_EXECUTOR = os.environ.get('GENERATION_EXECUTOR', 'process')
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', str(min(4, os.cpu_count() or 1))))
+GENERATION_MAX_CONCURRENT = int(os.environ.get('GENERATION_MAX_CONCURRENT', str(GENERATION_WORKERS)))
+GENERATION_MAX_QUEUE = int(os.environ.get('GENERATION_MAX_QUEUE', '20'))
+GENERATION_REQUEST_TIMEOUT = float(os.environ.get('GENERATION_REQUEST_TIMEOUT', '15'))
+
+generation_executor = None
+generation_semaphore: Optional[asyncio.Semaphore] = None
+generation_stats = {"en_cours": 0, "en_attente": 0, "terminees": 0, "expirees": 0, "refusees": 0}
+
+def get_generation_executor():
+    global generation_executor
+    if generation_executor is None:
+        if GENERATION_EXECUTOR == "thread":
+            generation_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generation")
+        else:
+            generation_executor = ProcessPoolExecutor(max_workers=GENERATION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return generation_executor
+
+async def run_in_generation_pool(func, *args, timeout: Optional[float] = None, **kwargs):
+    # timeout : délai total (file d'attente comprise), GENERATION_REQUEST_TIMEOUT par défaut
+    global generation_semaphore, generation_executor
+    timeout = timeout or GENERATION_REQUEST_TIMEOUT
+    if generation_semaphore is None:
+        generation_semaphore = asyncio.Semaphore(GENERATION_MAX_CONCURRENT)
+    started = time.monotonic()
+    if not generation_semaphore.locked():
+        # Place libre : acquisition immédiate, la requête ne passe pas par la file d'attente
+        await generation_semaphore.acquire()
+    else:
+        if generation_stats["en_attente"] >= GENERATION_MAX_QUEUE:
+            generation_stats["refusees"] += 1
+            raise HTTPException(status_code=503, detail="Trop de générations en cours, réessayez dans un instant")
+        generation_stats["en_attente"] += 1
+        try:
+            await asyncio.wait_for(generation_semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            generation_stats["expirees"] += 1
+            raise HTTPException(status_code=504, detail="La génération a pris trop de temps")
+        finally:
+            generation_stats["en_attente"] -= 1
+
+    generation_stats["en_cours"] += 1
+    future = None
+    try:
+        future = asyncio.get_running_loop().run_in_executor(get_generation_executor(), functools.partial(func, *args, **kwargs))
+        remaining = max(timeout - (time.monotonic() - started), 0.1)
+        with profile_wait("generation"):
+            result = await asyncio.wait_for(asyncio.shield(future), remaining)
+        generation_stats["terminees"] += 1
+        return result
+    except asyncio.TimeoutError:
+        generation_stats["expirees"] += 1
+        raise HTTPException(status_code=504, detail="La génération a pris trop de temps")
+    except BrokenProcessPool:
+        generation_executor = None
+        raise HTTPException(status_code=503, detail="Le moteur de génération a redémarré, réessayez")
+    finally:
+        generation_stats["en_cours"] -= 1
+        # Un calcul abandonné occupe encore un worker : la place n'est libérée qu'à sa fin
+        if future is not None and not future.done():
+            future.add_done_callback(lambda _: generation_semaphore.release())
+        else:
+            generation_semaphore.release()
+
+@api_router.get("/admin/generation-queue")
+async def get_generation_queue(current_user: UserResponse = Depends(get_admin_user)):
+    return {
+        **generation_stats,
+        "max_concurrentes": GENERATION_MAX_CONCURRENT,
+        "max_file_attente": GENERATION_MAX_QUEUE,
+        "executeur": GENERATION_EXECUTOR,
+        "workers": GENERATION_WORKERS,
+    }
+
+# ============= CACHE DES GÉNÉRATIONS =============
+# Même roster (présents, notes, attributs), mêmes contraintes, même méthode et même graine :
+# le résultat précédent est renvoyé sans relancer la recherche (sauf reshuffle=true).
+# LRU + TTL en mémoire ; GENERATION_CACHE_MONGO=true le partage entre workers via Mongo.
+GENERATION_CACHE_SIZE = int(os.environ.get('GENERATION_CACHE_SIZE', '256'))
+GENERATION_CACHE_TTL = float(os.environ.get('GENERATION_CACHE_TTL', '3600'))
+GENERATION_CACHE_MONGO = os.environ.get('GENERATION_CACHE_MONGO', 'false').lower() == 'true'
+# À incrémenter quand l'algorithme change : les anciennes entrées ne correspondent plus
+GENERATION_CACHE_VERSION = 1
+
+generation_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+def generation_fingerprint(event: Event, joueurs_map: Dict[str, PlayerRecord], seed: Optional[int]) -> str:
+    # Empreinte canonique : indépendante de l'ordre des présents et des contraintes
+    payload = {
+        "version": GENERATION_CACHE_VERSION,
+        "methode": event.methode_generation,
+        "nombre_equipes": event.nombre_equipes,
+        "seed": seed,
+        "presents": sorted((jp.joueur_id, jp.note_temporaire) for jp in event.joueurs_presents),
+        "contraintes": sorted((c.type, sorted(c.joueurs)) for c in event.contraintes_affinite),
+        "joueurs": sorted((p.id, p.note_generale, p.score_attaque, p.score_milieu, p.score_defense) for p in joueurs_map.values()),
+    }
+    return hashlib.sha256(orjson.dumps(payload)).hexdigest()
+
+async def get_cached_generation(key: str) -> Optional[Dict]:
+    entry = generation_cache.get(key)
+    if entry and entry[1] > time.monotonic():
+        generation_cache.move_to_end(key)
+        return entry[0]
+    if entry: del generation_cache[key]
+    if GENERATION_CACHE_MONGO:
+        try:
+            doc = await db.generation_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        except PyMongoError as e:
+            logger.warning("Cache des générations indisponible : %s", e)
+            return None
+        if doc:
+            remaining = (as_datetime(doc["expires_at"]) - datetime.now(timezone.utc)).total_seconds()
+            remember_generation(key, doc["result"], remaining)
+            return doc["result"]
+    return None
+
+def remember_generation(key: str, result: Dict, ttl: float):
+    if GENERATION_CACHE_SIZE <= 0: return
+    generation_cache[key] = (result, time.monotonic() + ttl)
+    generation_cache.move_to_end(key)
+    while len(generation_cache) > GENERATION_CACHE_SIZE:
+        generation_cache.popitem(last=False)
+
+async def store_generation(key: str, result: Dict):
+    cached = {k: result[k] for k in ("equipes", "warning_message", "score", "optimal")}
+    remember_generation(key, cached, GENERATION_CACHE_TTL)
+    if GENERATION_CACHE_MONGO:
+        try:
+            await db.generation_cache.replace_one(
+                {"_id": key},
+                {"result": cached, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=GENERATION_CACHE_TTL)},
+                upsert=True
+            )
+        except PyMongoError as e:
+            logger.warning("Cache des générations indisponible : %s", e)
 
 @api_router.post("/events/{event_id}/generate", response_model=GenerateTeamsResponse)
-async def generate_teams(event_id: str, current_user: UserResponse = Depends(get_current_user)):
+async def generate_teams(event_id: str, incremental: bool = False, reshuffle: bool = False, seed: Optional[int] = None,
+                         current_user: UserResponse = Depends(get_current_user)):
     event_doc = await db.events.find_one({"id": event_id}, {"_id": 0})
     if not event_doc: raise HTTPException(status_code=404, detail="Événement non trouvé")
     event = Event(**event_doc)
@@ -530,75 +2096,882 @@ async def generate_teams(event_id: str, current_user: UserResponse = Depends(get
     joueurs_map = await get_player_details(joueur_ids)
     
     try:
-        teams, warning = generate_balanced_teams(
+        if incremental and event.equipes_generees:
+            # Repart des équipes existantes : seuls les joueurs arrivés, partis ou à rééquilibrer bougent
+            result = await run_in_generation_pool(
+                run_incremental_generation,
+                event.joueurs_presents,
+                event.nombre_equipes,
+                event.contraintes_affinite,
+                joueurs_map,
+                event.equipes_generees
+            )
+            record_generation_metrics(result, "incremental")
+            from_cache = False
+        else:
+            cache_key = generation_fingerprint(event, joueurs_map, seed)
+            result = None if reshuffle else await get_cached_generation(cache_key)
+            from_cache = result is not None
+            generation_cache_lookups.inc(resultat="hit" if from_cache else ("reshuffle" if reshuffle else "miss"))
+            if result is None:
+                result = await run_in_generation_pool(
+                    run_team_generation,
+                    event.joueurs_presents,
+                    event.nombre_equipes,
+                    event.contraintes_affinite,
+                    joueurs_map,
+                    methode=event.methode_generation,
+                    seed=seed
+                )
+                record_generation_metrics(result, event.methode_generation)
+                await store_generation(cache_key, result)
+        teams, warning = result["equipes"], result["warning_message"]
+        if from_cache and event.equipes_generees == teams and event_doc.get("share_snapshot"):
+            # Rien n'a changé depuis la dernière génération : aucune écriture
+            snapshot, version = event_doc["share_snapshot"], event.version
+        else:
+            snapshot, version = await save_generated_teams(event, teams, warning, joueurs_map)
+        response_teams = [TeamStats(**team) for team in snapshot["equipes"]]
+        return GenerateTeamsResponse(equipes=response_teams, warning_message=warning, optimal=result["optimal"],
+                                     joueurs_deplaces=result.get("joueurs_deplaces"), depuis_cache=from_cache, version=version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Nombre maximal de propositions renvoyées par une seule recherche
+GENERATION_MAX_ALTERNATIVES = int(os.environ.get('GENERATION_MAX_ALTERNATIVES', '10'))
+
+@api_router.post("/events/{event_id}/generate/alternatives", response_model=GenerateAlternativesResponse)
+async def generate_team_alternatives(event_id: str, k: int = Query(5, ge=1, le=GENERATION_MAX_ALTERNATIVES),
+                                     current_user: UserResponse = Depends(get_current_user)):
+    event_doc = await db.events.find_one({"id": event_id}, {"_id": 0})
+    if not event_doc: raise HTTPException(status_code=404, detail="Événement non trouvé")
+    event = Event(**event_doc)
+    if not event.joueurs_presents:
+        raise HTTPException(status_code=400, detail="Aucun joueur présent")
+    
+    joueurs_map = await get_player_details([jp.joueur_id for jp in event.joueurs_presents])
+    try:
+        result = await run_in_generation_pool(
+            run_team_generation,
             event.joueurs_presents,
             event.nombre_equipes,
             event.contraintes_affinite,
-            joueurs_map
+            joueurs_map,
+            methode=event.methode_generation,
+            top_k=k
         )
-        await db.events.update_one(
-            {"id": event_id},
-            {"$set": {"equipes_generees": teams, "warning_message": warning}}
+        record_generation_metrics(result, event.methode_generation)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # La meilleure proposition devient la répartition de l'événement, comme pour /generate
+    _, version = await save_generated_teams(event, result["equipes"], result["warning_message"], joueurs_map)
+    notes_map = {jp.joueur_id: jp.note_temporaire for jp in event.joueurs_presents}
+    propositions = [
+        PropositionEquipes(
+            equipes=[TeamStats(**team) for team in build_teams_payload(alt["equipes"], joueurs_map, notes_map)],
+            score=round(alt["score"], 4),
+            warning_message=alt["warning_message"]
         )
-        notes_map = {jp.joueur_id: jp.note_temporaire for jp in event.joueurs_presents}
-        response_teams = []
-        for team in teams:
-            stats = calculate_team_stats(team, joueurs_map, notes_map)
-            joueurs_data = []
-            for jid in team:
-                player = joueurs_map.get(jid)
-                if player:
-                    joueurs_data.append({
-                        "id": jid,
-                        "nom": player.nom,
-                        "note": notes_map.get(jid, player.note_generale),
-                        "postes": player.postes
-                    })
-            response_teams.append(TeamStats(
-                note_moyenne=stats["note_moyenne"],
-                postes=stats["postes"],
-                joueurs=joueurs_data
-            ))
-        return GenerateTeamsResponse(equipes=response_teams, warning_message=warning)
+        for alt in result["alternatives"]
+    ]
+    return GenerateAlternativesResponse(propositions=propositions, optimal=result["optimal"], version=version)
+
+# ============= TOURNOIS (PLUSIEURS TOURS) =============
+# Plusieurs tours d'un même événement, ou plusieurs événements d'une même soirée :
+# chaque tour minimise l'équilibre habituel plus une pénalité pour chaque paire de
+# joueurs déjà coéquipiers lors des tours précédents (matrice compacte de compteurs).
+# Les tours d'une même chaîne sont séquentiels (chacun dépend des précédents) ; les
+# événements sans joueur commun forment des chaînes indépendantes, générées en parallèle.
+GENERATION_MAX_TOURS = int(os.environ.get('GENERATION_MAX_TOURS', '10'))
+GENERATION_MAX_TOUR_EVENTS = int(os.environ.get('GENERATION_MAX_TOUR_EVENTS', '20'))
+# Coût d'une paire répétée, rapporté au nombre de joueurs (même échelle que le score d'équilibre)
+ROTATION_WEIGHT = float(os.environ.get('ROTATION_WEIGHT', '0.2'))
+
+def run_rotation_generation(etapes: List[Dict], joueurs_map: Dict[str, PlayerRecord],
+                            poids: float, seed: Optional[int] = None) -> List[List[Dict]]:
+    # etapes : [{"joueurs_presents", "nombre_equipes", "contraintes", "tours"}], dans l'ordre de jeu.
+    # La pénalité n'est prise en compte que par la recherche locale, utilisée pour tous les tours.
+    rng = np.random.default_rng(seed)
+    index = {}
+    for etape in etapes:
+        for jp in etape["joueurs_presents"]: index.setdefault(jp.joueur_id, len(index))
+    pair_counts = np.zeros((len(index), len(index)), dtype=np.uint16)
+    results = []
+    for etape in etapes:
+        problem = TeamProblem(etape["joueurs_presents"], etape["nombre_equipes"], etape["contraintes"], joueurs_map)
+        players = np.array([index[jid] for jid in problem.joueur_ids])
+        membership = np.zeros((problem.n_units, problem.n_joueurs))
+        membership[problem.unit_of, np.arange(problem.n_joueurs)] = 1.0
+        tours = []
+        for _ in range(etape["tours"]):
+            counts = pair_counts[np.ix_(players, players)].astype(float)
+            unit_pairs = membership @ counts @ membership.T * (poids / problem.n_joueurs)
+            stats = {"tentatives": 0, "rejets": 0}
+            assignment = local_search(problem, rng, GENERATION_LOCAL_ITERATIONS, time.monotonic() + GENERATION_TIME_BUDGET,
+                                      stats, pairs=unit_pairs)
+            if assignment is None:
+                raise ValueError("Impossible de générer des équipes respectant toutes les contraintes. Essayez moins de contraintes.")
+            together = assignment[:, None] == assignment[None, :]
+            np.fill_diagonal(together, False)
+            scores, means = score_assignments(problem.matrix, assignment[None, :], problem.nombre_equipes)
+            tours.append({
+                "equipes": problem.to_teams(assignment),
+                "warning_message": imbalance_warning([round(float(m), 2) for m in means[0, :, 0]]),
+                "score": float(scores[0]),
+                "paires_repetees": int(((counts > 0) & together).sum() // 2),
+            })
+            pair_counts[np.ix_(players, players)] += together.astype(np.uint16)
+        results.append(tours)
+    return results
+
+def tour_chains(events: List[Event]) -> List[List[int]]:
+    # Regroupe les événements qui partagent au moins un joueur (ordre d'origine conservé)
+    parent = list(range(len(events)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    seen = {}
+    for i, event in enumerate(events):
+        for jp in event.joueurs_presents:
+            if jp.joueur_id in seen: parent[find(i)] = find(seen[jp.joueur_id])
+            else: seen[jp.joueur_id] = i
+    chains = {}
+    for i in range(len(events)): chains.setdefault(find(i), []).append(i)
+    return list(chains.values())
+
+@api_router.post("/events/generate-tours", response_model=GenerationToursResponse)
+async def generate_tours(request: GenerationToursRequest, current_user: UserResponse = Depends(get_current_user)):
+    if request.tours > GENERATION_MAX_TOURS:
+        raise HTTPException(status_code=400, detail=f"Le nombre de tours est limité à {GENERATION_MAX_TOURS}")
+    event_ids = list(dict.fromkeys(request.event_ids))
+    if len(event_ids) > GENERATION_MAX_TOUR_EVENTS:
+        raise HTTPException(status_code=400, detail=f"Le nombre d'événements est limité à {GENERATION_MAX_TOUR_EVENTS}")
+    docs = {doc["id"]: doc async for doc in db.events.find({"id": {"$in": event_ids}}, EVENT_PROJECTION)}
+    missing = [eid for eid in event_ids if eid not in docs]
+    if missing: raise HTTPException(status_code=404, detail=f"Événement non trouvé : {missing[0]}")
+    events = [Event(**docs[eid]) for eid in event_ids]
+    if any(not event.joueurs_presents for event in events):
+        raise HTTPException(status_code=400, detail="Aucun joueur présent")
+
+    joueurs_map = await get_player_details(list({jp.joueur_id for event in events for jp in event.joueurs_presents}))
+    poids = ROTATION_WEIGHT if request.poids_rotation is None else request.poids_rotation
+    chains = tour_chains(events)
+    # Chaque tour a droit au budget d'une génération : le délai d'une chaîne croît avec
+    # son nombre de tours (événements × tours), plus la marge habituelle pour la file d'attente
+    try:
+        chain_results = await asyncio.gather(*(
+            run_in_generation_pool(
+                run_rotation_generation,
+                [{"joueurs_presents": events[i].joueurs_presents, "nombre_equipes": events[i].nombre_equipes,
+                  "contraintes": events[i].contraintes_affinite, "tours": request.tours} for i in chain],
+                {jp.joueur_id: joueurs_map[jp.joueur_id] for i in chain for jp in events[i].joueurs_presents
+                 if jp.joueur_id in joueurs_map},
+                poids,
+                None if request.seed is None else request.seed + c,
+                timeout=len(chain) * request.tours * GENERATION_TIME_BUDGET + GENERATION_REQUEST_TIMEOUT
+            )
+            for c, chain in enumerate(chains)
+        ))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    tours_of = {chain[k]: tours for chain, result in zip(chains, chain_results) for k, tours in enumerate(result)}
 
-# ============= SHARE LINK (MODIFIÉ pour PlayerInDB) =============
-@api_router.get("/share/{share_token}")
-async def get_shared_event(share_token: str):
+    # Tous les tours de tous les événements en une seule écriture groupée
+    operations, evenements = [], []
+    for i, event in enumerate(events):
+        tours = tours_of[i]
+        premier = tours[0]
+        snapshot = build_share_snapshot(event, premier["equipes"], premier["warning_message"], joueurs_map)
+        operations.append(UpdateOne({"id": event.id}, {
+            "$set": {
+                "equipes_generees": premier["equipes"],
+                "warning_message": premier["warning_message"],
+                "share_snapshot": snapshot,
+                "tours_generes": [{"equipes": t["equipes"], "warning_message": t["warning_message"]} for t in tours],
+            },
+            "$inc": {"version": 1},
+        }))
+        notes_map = {jp.joueur_id: jp.note_temporaire for jp in event.joueurs_presents}
+        evenements.append(EvenementTours(event_id=event.id, tours=[
+            TourEquipes(
+                equipes=[TeamStats(**team) for team in build_teams_payload(t["equipes"], joueurs_map, notes_map)],
+                score=round(t["score"], 4),
+                paires_repetees=t["paires_repetees"],
+                warning_message=t["warning_message"]
+            )
+            for t in tours
+        ]))
+    await db.events.bulk_write(operations, ordered=False)
+    for event in events: invalidate_share_cache(event.share_token)
+    return GenerationToursResponse(
+        evenements=evenements,
+        paires_repetees=sum(t.paires_repetees for e in evenements for t in e.tours)
+    )
+
+# ============= GÉNÉRATION ASYNCHRONE (JOBS) =============
+# Une génération longue est découpée en tranches exécutées dans le pool : chaque
+# tranche repart de la meilleure partition connue et publie sa progression.
+# Les jobs vivent en mémoire du worker qui les a créés.
+GENERATION_JOB_SLICE = float(os.environ.get('GENERATION_JOB_SLICE', '0.5'))
+GENERATION_JOB_MAX_BUDGET = float(os.environ.get('GENERATION_JOB_MAX_BUDGET', '120'))
+GENERATION_JOB_TTL = float(os.environ.get('GENERATION_JOB_TTL', '900'))
+
+class GenerationJobCreate(BaseModel):
+    budget_secondes: float = Field(default=10.0, gt=0)
+    score_cible: Optional[float] = Field(default=None, ge=0)
+
+class GenerationJob:
+    def __init__(self, event_id: str, budget: float, score_cible: Optional[float]):
+        self.id = str(uuid.uuid4())
+        self.event_id = event_id
+        self.budget = budget
+        self.score_cible = score_cible
+        self.statut = "en_cours"
+        self.equipes: Optional[List[Dict]] = None
+        self.warning_message: Optional[str] = None
+        self.score: Optional[float] = None
+        self.optimal = False
+        self.tentatives = 0
+        self.erreur: Optional[str] = None
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.stop_requested = False
+        self.version = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def snapshot(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "event_id": self.event_id,
+            "statut": self.statut,
+            "equipes": self.equipes,
+            "warning_message": self.warning_message,
+            "score": self.score,
+            "optimal": self.optimal,
+            "tentatives": self.tentatives,
+            "ecoule": round((self.finished_at or time.monotonic()) - self.started_at, 2),
+            "erreur": self.erreur,
+        }
+
+    def publish(self):
+        # Réveille les flux en attente ; les suivants attendront le nouvel événement
+        self.version += 1
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+generation_jobs: Dict[str, GenerationJob] = {}
+
+def purge_generation_jobs():
+    now = time.monotonic()
+    for job_id in [j.id for j in generation_jobs.values() if j.finished_at and now - j.finished_at > GENERATION_JOB_TTL]:
+        del generation_jobs[job_id]
+
+def get_generation_job(job_id: str) -> GenerationJob:
+    job = generation_jobs.get(job_id)
+    if not job: raise HTTPException(status_code=404, detail="Génération non trouvée")
+    return job
+
+async def run_generation_job(job: GenerationJob, event: Event, joueurs_map: Dict[str, PlayerRecord]):
+    notes_map = {jp.joueur_id: jp.note_temporaire for jp in event.joueurs_presents}
+    deadline = time.monotonic() + job.budget
+    best = None
+    # La méthode exacte énumère en un seul passage (la relancer à chaque tranche repartirait du
+    # début) ; si l'espace n'est pas épuisé, les tranches suivantes affinent en recherche locale.
+    methode = event.methode_generation
+    try:
+        while not job.stop_requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            slice_budget = remaining if methode == "exacte" else min(GENERATION_JOB_SLICE, remaining)
+            result = await run_in_generation_pool(
+                run_team_generation,
+                event.joueurs_presents,
+                event.nombre_equipes,
+                event.contraintes_affinite,
+                joueurs_map,
+                methode=methode,
+                time_budget=slice_budget,
+                equipes_initiales=best["equipes"] if best else None,
+                timeout=slice_budget + GENERATION_REQUEST_TIMEOUT
+            )
+            record_generation_metrics(result, methode)
+            if methode == "exacte": methode = "recherche_locale"
+            job.tentatives += result["tentatives"]
+            if best is None or result["score"] < best["score"]:
+                best = result
+                job.equipes = build_teams_payload(best["equipes"], joueurs_map, notes_map)
+                job.warning_message = best["warning_message"]
+                job.score = best["score"]
+                job.optimal = best["optimal"]
+            job.publish()
+            if best["optimal"] or (job.score_cible is not None and best["score"] <= job.score_cible): break
+        if best is not None:
+            # Présents, notes ou contraintes modifiés entre-temps : le résultat est périmé (409)
+            await save_generated_teams(event, best["equipes"], best["warning_message"], joueurs_map, event.version)
+        job.statut = "arretee" if job.stop_requested else "terminee"
+    except HTTPException as e:
+        job.statut, job.erreur = "erreur", e.detail
+    except ValueError as e:
+        job.statut, job.erreur = "erreur", str(e)
+    except Exception as e:
+        logger.exception("Échec de la génération %s", job.id)
+        job.statut, job.erreur = "erreur", "Erreur interne pendant la génération"
+    finally:
+        job.finished_at = time.monotonic()
+        job.publish()
+
+@api_router.post("/events/{event_id}/generation-jobs", status_code=202)
+async def create_generation_job(event_id: str, options: GenerationJobCreate = Body(default_factory=GenerationJobCreate),
+                                current_user: UserResponse = Depends(get_current_user)):
+    event_doc = await db.events.find_one({"id": event_id}, {"_id": 0})
+    if not event_doc: raise HTTPException(status_code=404, detail="Événement non trouvé")
+    event = Event(**event_doc)
+    if not event.joueurs_presents:
+        raise HTTPException(status_code=400, detail="Aucun joueur présent")
+    joueurs_map = await get_player_details([jp.joueur_id for jp in event.joueurs_presents])
+
+    purge_generation_jobs()
+    job = GenerationJob(event_id, min(options.budget_secondes, GENERATION_JOB_MAX_BUDGET), options.score_cible)
+    generation_jobs[job.id] = job
+    job.task = asyncio.create_task(run_generation_job(job, event, joueurs_map))
+    return job.snapshot()
+
+@api_router.get("/generation-jobs/{job_id}")
+async def get_generation_job_status(job_id: str, current_user: UserResponse = Depends(get_current_user)):
+    return get_generation_job(job_id).snapshot()
+
+@api_router.get("/generation-jobs/{job_id}/stream")
+async def stream_generation_job(job_id: str, current_user: UserResponse = Depends(get_current_user)):
+    job = get_generation_job(job_id)
+
+    async def events():
+        # Server-Sent Events : un message par amélioration, le dernier porte le statut final
+        last_version = -1
+        while True:
+            if job.version != last_version:
+                last_version = job.version
+                name = "progression" if job.statut == "en_cours" else "fin"
+                yield f"event: {name}\ndata: {json.dumps(job.snapshot())}\n\n"
+                if job.statut != "en_cours": return
+            changed = job.changed
+            try:
+                await asyncio.wait_for(changed.wait(), 15)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api_router.post("/generation-jobs/{job_id}/stop")
+async def stop_generation_job(job_id: str, current_user: UserResponse = Depends(get_current_user)):
+    job = get_generation_job(job_id)
+    # La tranche en cours se termine, puis le meilleur résultat est enregistré
+    if job.statut == "en_cours": job.stop_requested = True
+    return job.snapshot()
+
+# ============= SHARE LINK (instantané + cache HTTP) =============
+# L'instantané stocké sur l'événement est servi depuis un LRU en mémoire avec
+# ETag / If-None-Match. L'invalidation est locale au worker : le TTL borne le
+# décalage possible entre plusieurs workers.
+SHARE_CACHE_SIZE = int(os.environ.get('SHARE_CACHE_SIZE', '512'))
+SHARE_CACHE_TTL = float(os.environ.get('SHARE_CACHE_TTL', '60'))
+SHARE_MAX_AGE = int(os.environ.get('SHARE_MAX_AGE', '30'))
+
+share_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+def invalidate_share_cache(share_token: Optional[str] = None):
+    if share_token is None:
+        share_cache.clear()
+    else:
+        share_cache.pop(share_token, None)
+
+async def invalidate_player_share_snapshots(*player_ids: str):
+    # Nom, postes ou notes de joueurs modifiés : les instantanés qui les contiennent sont périmés.
+    # Seuls les événements concernés sont retirés du cache (index joueurs_presents.joueur_id).
+    events = await db.events.find({"joueurs_presents.joueur_id": {"$in": list(player_ids)}},
+                                  {"_id": 0, "id": 1, "share_token": 1}).to_list(None)
+    if not events: return
+    await db.events.update_many({"id": {"$in": [e["id"] for e in events]}, "share_snapshot": {"$exists": True}},
+                                {"$unset": {"share_snapshot": ""}})
+    for event in events: share_cache.pop(event.get("share_token"), None)
+
+async def load_share_snapshot(share_token: str) -> Dict:
     event_doc = await db.events.find_one({"share_token": share_token}, {"_id": 0})
     if not event_doc: raise HTTPException(status_code=404, detail="Événement non trouvé")
+    if event_doc.get("share_snapshot") is not None:
+        return event_doc["share_snapshot"]
     event = Event(**event_doc)
     if not event.equipes_generees:
         raise HTTPException(status_code=400, detail="Les équipes n'ont pas encore été générées")
     
-    all_joueur_ids = [jp.joueur_id for jp in event.joueurs_presents]
-    joueurs_map = await get_player_details(all_joueur_ids)
-    notes_map = {jp.joueur_id: jp.note_temporaire for jp in event.joueurs_presents}
+    # Événement antérieur aux instantanés ou modifié depuis : reconstruction puis stockage,
+    # seulement si le document n'a pas changé entre-temps (même version)
+    joueurs_map = await get_player_details([jp.joueur_id for jp in event.joueurs_presents])
+    snapshot = build_share_snapshot(event, event.equipes_generees, event.warning_message, joueurs_map)
+    await db.events.update_one(
+        {"id": event.id, "share_snapshot": {"$exists": False}, "version": version_filter(event.version)},
+        {"$set": {"share_snapshot": snapshot}}
+    )
+    return snapshot
+
+@api_router.get("/share/{share_token}")
+async def get_shared_event(share_token: str, if_none_match: Optional[str] = Header(None)):
+    cached = share_cache.get(share_token)
+    if cached and cached[2] > time.monotonic():
+        share_cache.move_to_end(share_token)
+        etag, body = cached[0], cached[1]
+    else:
+        snapshot = await load_share_snapshot(share_token)
+        body = orjson.dumps(snapshot)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        share_cache[share_token] = (etag, body, time.monotonic() + SHARE_CACHE_TTL)
+        share_cache.move_to_end(share_token)
+        while len(share_cache) > SHARE_CACHE_SIZE:
+            share_cache.popitem(last=False)
     
-    response_teams = []
-    for team in event.equipes_generees:
-        stats = calculate_team_stats(team, joueurs_map, notes_map)
-        joueurs_data = []
-        for jid in team:
-            player = joueurs_map.get(jid)
-            if player:
-                joueurs_data.append({
-                    "id": jid,
-                    "nom": player.nom,
-                    "note": notes_map.get(jid, player.note_generale),
-                    "postes": player.postes
-                })
-        response_teams.append({
-            "note_moyenne": stats["note_moyenne"],
-            "postes": stats["postes"],
-            "joueurs": joueurs_data
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={SHARE_MAX_AGE}"}
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ============= INDEX MONGO =============
+# Index créés au démarrage (create_indexes est idempotent) pour toutes les
+# recherches et tris des routes. ENSURE_INDEXES=false désactive l'étape.
+ENSURE_INDEXES = os.environ.get('ENSURE_INDEXES', 'true').lower() == 'true'
+INDEX_DIAGNOSTICS_ON_STARTUP = os.environ.get('INDEX_DIAGNOSTICS_ON_STARTUP', 'false').lower() == 'true'
+
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "players": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("nom", ASCENDING)], name="nom"),
+    ],
+    "events": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("share_token", ASCENDING)], name="share_token_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id_desc"),
+        IndexModel([("joueurs_presents.joueur_id", ASCENDING)], name="joueurs_presents_joueur_id"),
+    ],
+    "guest_codes": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "guest_logs": [
+        IndexModel([("logged_in_at", DESCENDING)], name="logged_in_at_desc",
+                   **({"expireAfterSeconds": GUEST_LOG_RETENTION_DAYS * 86400} if GUEST_LOG_RETENTION_DAYS > 0 else {})),
+    ],
+    # Entrées du cache des générations supprimées par Mongo à expiration
+    **({"generation_cache": [IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0)]}
+       if GENERATION_CACHE_MONGO else {}),
+}
+
+# Requêtes des routes (forme seulement, les valeurs sont factices) passées à explain
+ROUTE_QUERIES = [
+    ("get_current_user / auth", "users", {"id": "diagnostic"}, None),
+    ("login", "users", {"email": "diagnostic@example.com"}, None),
+    ("guest_login / guest-code", "guest_codes", {"id": "singleton"}, None),
+    ("guest-logs", "guest_logs", {}, [("logged_in_at", -1)]),
+    ("update_player", "players", {"id": "diagnostic"}, None),
+    ("get_player_details", "players", {"id": {"$in": ["diagnostic"]}}, None),
+    ("get_players (page)", "players", {"created_at": {"$gt": "diagnostic"}}, [("created_at", 1), ("id", 1)]),
+    ("get_events", "events", {}, [("created_at", -1), ("id", -1)]),
+    ("get_event / update / generate", "events", {"id": "diagnostic"}, None),
+    ("share", "events", {"share_token": "diagnostic"}, None),
+    ("update_player / import (instantanés)", "events", {"joueurs_presents.joueur_id": {"$in": ["diagnostic"]}}, None),
+]
+
+async def update_changed_indexes(collection: str, indexes: List[IndexModel]) -> bool:
+    # Index existant dont les options ont changé (même nom) : la durée TTL est modifiée sur place
+    # par collMod (MongoDB >= 5.1) ; pour l'unicité, l'index est supprimé puis recréé, et l'ancien
+    # est rétabli si des doublons empêchent la création.
+    existing = await db[collection].index_information()
+    changed = False
+    for index in indexes:
+        spec = index.document
+        current = existing.get(spec["name"])
+        if current is None: continue
+        if spec.get("unique", False) != current.get("unique", False):
+            await db[collection].drop_index(spec["name"])
+            try:
+                await db[collection].create_indexes([index])
+            except PyMongoError:
+                await db[collection].create_index(current["key"], name=spec["name"])
+                raise
+            changed = True
+        elif "expireAfterSeconds" in spec and spec["expireAfterSeconds"] != current.get("expireAfterSeconds"):
+            await db.command("collMod", collection, index={"name": spec["name"], "expireAfterSeconds": spec["expireAfterSeconds"]})
+            changed = True
+    if changed: await db[collection].create_indexes(indexes)
+    return changed
+
+async def ensure_indexes():
+    for collection, indexes in INDEXES.items():
+        try:
+            try:
+                await db[collection].create_indexes(indexes)
+            except OperationFailure as e:
+                # 85 : IndexOptionsConflict (même index, options différentes)
+                if e.code != 85 or not await update_changed_indexes(collection, indexes): raise
+        except PyMongoError as e:
+            # Un index unique peut échouer sur des doublons existants : on signale sans bloquer
+            logger.error("Création des index de %s impossible : %s", collection, e)
+
+def plan_stages(plan: Dict) -> List[str]:
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan: stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+async def explain_route_queries() -> List[Dict]:
+    report = []
+    for route, collection, filtre, tri in ROUTE_QUERIES:
+        find = {"find": collection, "filter": filtre}
+        if tri: find["sort"] = dict(tri)
+        explained = await db.command({"explain": find, "verbosity": "queryPlanner"})
+        stages = plan_stages(explained["queryPlanner"]["winningPlan"])
+        report.append({
+            "route": route,
+            "collection": collection,
+            "filtre": filtre,
+            "tri": dict(tri) if tri else None,
+            "etapes": stages,
+            "scan_collection": "COLLSCAN" in stages,
         })
-    return {
-        "nom_evenement": event.nom_evenement,
-        "equipes": response_teams,
-        "warning_message": event.warning_message
-    }
+    return report
+
+@api_router.get("/admin/index-diagnostics")
+async def get_index_diagnostics(current_user: UserResponse = Depends(get_admin_user)):
+    report = await explain_route_queries()
+    return {"scans": sum(r["scan_collection"] for r in report), "requetes": report}
+
+# ============= PROFILAGE À LA DEMANDE =============
+# Un admin ajoute l'en-tête X-Profile: 1 (ou ?profile=1) : la requête est échantillonnée
+# (pile du thread de la boucle toutes les PROFILE_INTERVAL secondes quand sa tâche s'exécute,
+# nature de l'attente sinon). Le profil est rangé dans un tampon circulaire, son identifiant
+# renvoyé dans X-Profile-Id, et téléchargeable en piles repliées (flamegraph.pl, speedscope).
+# PROFILE_SAMPLE_RATE > 0 profile en plus une fraction aléatoire de toutes les requêtes.
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.002'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', '50'))
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, raison: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method, self.path, self.raison = method, path, raison
+        self.debut = datetime.now(timezone.utc)
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.duree = None
+        self.statut = None
+        self.lock = threading.Lock()
+        self.samples = Counter()
+        self.en_cours: Dict[str, List[str]] = {}
+        self.attente_secondes: Dict[str, float] = {}
+        self.commandes: Dict[str, List[float]] = {}
+
+    def begin_wait(self, kind: str, label: str = ""):
+        with self.lock: self.en_cours.setdefault(kind, []).append(label)
+
+    def end_wait(self, kind: str, seconds: float, label: str = ""):
+        with self.lock:
+            waiting = self.en_cours.get(kind, [])
+            if label in waiting: waiting.remove(label)
+            self.attente_secondes[kind] = self.attente_secondes.get(kind, 0.0) + seconds
+            if label:
+                entry = self.commandes.setdefault(label, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+
+    def sample(self, frames: Dict):
+        # CPU si la tâche de la requête est celle qui s'exécute sur la boucle, attente sinon
+        if asyncio.current_task(self.loop) is self.task:
+            stack = "cpu;" + collapse_stack(frames.get(self.thread_id))
+        else:
+            with self.lock:
+                kind, labels = next(((k, v) for k, v in self.en_cours.items() if v), ("autre", []))
+            stack = f"attente;{kind}" + (f";{labels[-1]}" if labels and labels[-1] else "")
+        with self.lock: self.samples[stack] += 1
+
+    def collapsed(self) -> str:
+        with self.lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+    def summary(self) -> Dict:
+        with self.lock:
+            cpu = sum(c for stack, c in self.samples.items() if stack.startswith("cpu;"))
+            return {
+                "id": self.id, "methode": self.method, "chemin": self.path, "raison": self.raison,
+                "statut": self.statut, "debut": self.debut.isoformat(),
+                "duree_ms": round(self.duree * 1000, 2) if self.duree is not None else None,
+                "echantillons": sum(self.samples.values()),
+                "intervalle_ms": PROFILE_INTERVAL * 1000,
+                # CPU estimé par échantillonnage ; attentes mesurées exactement (cumul, chevauchements compris)
+                "cpu_ms_estime": round(cpu * PROFILE_INTERVAL * 1000, 2),
+                "attente_ms": {k: round(v * 1000, 2) for k, v in self.attente_secondes.items()},
+                "commandes_mongo": sorted(
+                    ({"commande": k, "appels": n, "ms": round(t * 1000, 2)} for k, (n, t) in self.commandes.items()),
+                    key=lambda c: -c["ms"]
+                ),
+            }
+
+def collapse_stack(frame) -> str:
+    # Pile repliée racine -> feuille, sans les couches de la boucle asyncio
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "_run" and code.co_filename.endswith(os.path.join("asyncio", "events.py")): break
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names)) or "?"
+
+@contextlib.contextmanager
+def profile_wait(kind: str):
+    # Attente hors de la boucle (pool de génération, bcrypt) pour la requête profilée
+    profile = active_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.begin_wait(kind)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.end_wait(kind, time.perf_counter() - started)
+
+class ProfileSampler:
+    # Un seul thread d'échantillonnage, actif uniquement tant qu'une requête est profilée
+    def __init__(self):
+        self.active = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, profile: RequestProfile):
+        with self.lock:
+            self.active.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+                self.thread.start()
+
+    def remove(self, profile: RequestProfile):
+        with self.lock: self.active.discard(profile)
+
+    def run(self):
+        while True:
+            with self.lock:
+                profiles = list(self.active)
+                if not profiles:
+                    self.thread = None
+                    return
+            frames = sys._current_frames()
+            for profile in profiles: profile.sample(frames)
+            del frames
+            time.sleep(PROFILE_INTERVAL)
+
+profile_sampler = ProfileSampler()
+profiles_buffer: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+
+async def profiling_reason(request: Request) -> Optional[str]:
+    if request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1":
+        # Vérification par get_admin_user ; pour un non-admin la demande est simplement ignorée
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                await get_admin_user(await get_current_user(HTTPAuthorizationCredentials(scheme=scheme, credentials=token)))
+                return "admin"
+            except HTTPException:
+                pass
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "echantillon"
+    return None
+
+class ProfilingMiddleware:
+    # Middleware ASGI pur : la route s'exécute dans la même tâche que lui, celle qu'on échantillonne
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        raison = await profiling_reason(Request(scope))
+        if raison is None:
+            return await self.app(scope, receive, send)
+        profile = RequestProfile(scope["method"], scope["path"], raison)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.statut = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        token = active_profile.set(profile)
+        profile_sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile_sampler.remove(profile)
+            active_profile.reset(token)
+            profile.duree = time.perf_counter() - profile.started
+            profiles_buffer.append(profile)
+
+app.add_middleware(ProfilingMiddleware)
+
+@api_router.get("/admin/profiles")
+async def list_profiles(current_user: UserResponse = Depends(get_admin_user)):
+    return [profile.summary() for profile in reversed(profiles_buffer)]
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    output: str = Query("json", alias="format", pattern="^(json|collapsed)$"),
+    current_user: UserResponse = Depends(get_admin_user)
+):
+    profile = next((p for p in profiles_buffer if p.id == profile_id), None)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profil non trouvé (expiré du tampon ?)")
+    if output == "collapsed":
+        return Response(content=profile.collapsed(), media_type="text/plain; charset=utf-8",
+                        headers={"Content-Disposition": f'attachment; filename="profil-{profile_id}.folded"'})
+    return {**profile.summary(), "piles": dict(profile.samples.most_common())}
+
+# ============= ENDPOINT /metrics =============
+# Sans METRICS_TOKEN, /metrics est ouvert (réseau interne du scraper) ; sinon jeton Bearer requis.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def route_template(scope) -> str:
+    # Gabarit de route (/api/events/{event_id}) et non le chemin réel : cardinalité bornée.
+    # Résolu dès l'entrée, comme le routeur (correspondance complète, sinon partielle) :
+    # la jauge des requêtes en cours est étiquetée avant que la route ne s'exécute
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL: return route.path
+        if match == Match.PARTIAL and partial is None: partial = route.path
+    return partial or "inconnue"
+
+class HttpMetricsMiddleware:
+    # Middleware ASGI pur, comme ProfilingMiddleware : ni tâche ni flux intermédiaires par requête
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        labels = {"methode": scope["method"], "route": route_template(scope)}
+        started = time.perf_counter()
+        answered = False
+
+        async def send_with_metrics(message):
+            nonlocal answered
+            if message["type"] == "http.response.start":
+                # Durée jusqu'aux en-têtes de réponse, comme avant
+                answered = True
+                http_request_seconds.observe(time.perf_counter() - started, **labels, statut=str(message["status"]))
+            await send(message)
+
+        http_in_flight.inc(1, **labels)
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            http_in_flight.inc(-1, **labels)
+            if not answered:
+                http_request_seconds.observe(time.perf_counter() - started, **labels, statut="500")
+
+app.add_middleware(HttpMetricsMiddleware)
+
+@app.get("/metrics")
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Jeton de métriques invalide")
+    # Files de génération : instantané au moment du scrape
+    for key in ("en_cours", "en_attente"):
+        generation_queue.set(generation_stats[key], etat=key)
+    for key in ("terminees", "expirees", "refusees"):
+        generation_outcomes.set(generation_stats[key], issue=key)
+    lines = [line for metric in METRICS for line in metric.render()]
+    return Response(content="\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ============= MIGRATION DES DATES =============
+# Les dates étaient stockées en chaînes ISO : conversion en dates BSON natives, par lots,
+# au démarrage (idempotent : seules les valeurs encore en chaîne sont réécrites).
+MIGRATE_DATETIMES = os.environ.get('MIGRATE_DATETIMES', 'true').lower() == 'true'
+DATETIME_FIELDS = {
+    "users": ["created_at"],
+    "players": ["created_at"],
+    "events": ["created_at"],
+    "guest_codes": ["expires_at"],
+    "guest_logs": ["logged_in_at"],
+}
+MIGRATION_BATCH_SIZE = 500
+
+async def migrate_datetimes() -> Dict[str, int]:
+    converted = {}
+    for collection, fields in DATETIME_FIELDS.items():
+        for field in fields:
+            key, operations = f"{collection}.{field}", []
+            converted[key] = 0
+            async for doc in db[collection].find({field: {"$type": "string"}}, {"_id": 1, field: 1}):
+                try:
+                    value = as_datetime(doc[field])
+                except ValueError:
+                    logger.warning("Date illisible %s=%r (%s), ignorée", key, doc[field], doc["_id"])
+                    continue
+                # Filtre sur l'ancienne valeur : une écriture concurrente n'est jamais écrasée
+                operations.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: value}}))
+                if len(operations) >= MIGRATION_BATCH_SIZE:
+                    converted[key] += (await db[collection].bulk_write(operations, ordered=False)).modified_count
+                    operations = []
+            if operations:
+                converted[key] += (await db[collection].bulk_write(operations, ordered=False)).modified_count
+    return converted
+
+# Sous-scores (attaque, milieu, défense) des joueurs créés avant leur stockage
+BACKFILL_PLAYER_SCORES = os.environ.get('BACKFILL_PLAYER_SCORES', 'true').lower() == 'true'
+
+async def backfill_player_scores() -> int:
+    updated, operations = 0, []
+    async for doc in db.players.find({"score_attaque": {"$exists": False}}, {"_id": 1, "tir": 1, "technique": 1, "passe": 1,
+                                                                          "vitesse": 1, "defense": 1, "physique": 1}):
+        operations.append(UpdateOne({"_id": doc["_id"], "score_attaque": {"$exists": False}}, {"$set": calculate_sub_scores(doc)}))
+        if len(operations) >= MIGRATION_BATCH_SIZE:
+            updated += (await db.players.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await db.players.bulk_write(operations, ordered=False)).modified_count
+    return updated
+
+@app.on_event("startup")
+async def bootstrap_database():
+    if ENSURE_INDEXES:
+        await ensure_indexes()
+    if MIGRATE_DATETIMES:
+        try:
+            converted = await migrate_datetimes()
+            if any(converted.values()): logger.info("Dates converties en BSON : %s", converted)
+        except PyMongoError as e:
+            logger.error("Migration des dates impossible : %s", e)
+    if BACKFILL_PLAYER_SCORES:
+        try:
+            updated = await backfill_player_scores()
+            if updated: logger.info("Sous-scores calculés pour %d joueurs", updated)
+        except PyMongoError as e:
+            logger.error("Calcul des sous-scores impossible : %s", e)
+    if INDEX_DIAGNOSTICS_ON_STARTUP:
+        try:
+            for entry in await explain_route_queries():
+                if entry["scan_collection"]:
+                    logger.warning("Scan complet de %s pour %s (%s)", entry["collection"], entry["route"], entry["filtre"])
+        except PyMongoError as e:
+            logger.error("Diagnostic des index impossible : %s", e)
 
 # ============= ROOT ROUTES =============
 @api_router.get("/")
@@ -614,6 +2987,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -621,4 +2995,8 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await guest_log_writer.close()
+    if client is not None: client.close()
+    if generation_executor is not None:
+        generation_executor.shutdown(wait=False, cancel_futures=True)
+    password_executor.shutdown(wait=False)
@@ -1,6 +1,9 @@
-import React, { useEffect, useState, useMemo } from 'react';
+import React, { useEffect, useState, useMemo, useRef, useCallback } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
-import { getEvent, getPlayers, updateEvent, generateTeams } from '../services/api';
+import {
+  getEvent, getPlayerSummaries, generateTeams,
+  setPresentPlayer, removePresentPlayer, addEventConstraint, removeEventConstraint
+} from '../services/api';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
 import { Label } from '../components/ui/label';
@@ -23,7 +26,7 @@ import {
 import { toast } from 'sonner';
 import {
   ArrowLeft, UserPlus, UserMinus, Star, Shuffle, AlertTriangle,
-  Link, Link2Off, Trash2, ClipboardCopy, GripVertical, SortAsc // Ajout de SortAsc
+  Link, Link2Off, Trash2, ClipboardCopy, GripVertical, SortAsc, RefreshCw // Ajout de SortAsc
 } from 'lucide-react';
 import { Badge } from '../components/ui/badge';
 
@@ -55,6 +58,9 @@ const calculateTeamAvg = (team) => {
   return (totalNote / team.joueurs.length).toFixed(1); // Arrondi à 1 décimale
 };
 
+// Délai sans frappe avant d'enregistrer une note (ms)
+const NOTE_SAVE_DELAY = 500;
+
 export default function EventManagePage() {
   const { id: eventId } = useParams();
   const navigate = useNavigate();
@@ -67,6 +73,12 @@ export default function EventManagePage() {
   const [warningMessage, setWarningMessage] = useState(null);
   const [loading, setLoading] = useState(true);
 
+  // Saisie des notes : une écriture par joueur après une pause de frappe.
+  // Toutes les écritures passent par une seule file, jamais deux en parallèle
+  const eventVersion = useRef(0);
+  const noteTimers = useRef(new Map());
+  const writeQueue = useRef(Promise.resolve());
+
   // État pour le Drag and Drop
   const [activePlayer, setActivePlayer] = useState(null);
   const sensors = useSensors(useSensor(PointerSensor));
@@ -74,31 +86,38 @@ export default function EventManagePage() {
   // ### NOUVEL ÉTAT POUR LE TRI DES ÉQUIPES ###
   const [teamSortCriteria, setTeamSortCriteria] = useState('note-desc'); // Par défaut: Note (Décroissante)
 
-  // 1. Charger toutes les données (inchangé)
+  // 1. Charger toutes les données
+  const applyEvent = useCallback((eventData, playersData) => {
+    setEvent(eventData);
+    eventVersion.current = eventData.version;
+
+    const initialMap = new Map();
+    eventData.joueurs_presents.forEach(p => {
+      initialMap.set(p.joueur_id, p.note_temporaire);
+    });
+    setPresentPlayersMap(initialMap);
+
+    setConstraints(eventData.contraintes_affinite.map((c, i) => ({...c, id: i})));
+
+    if (eventData.equipes_generees && eventData.equipes_generees.length > 0) {
+      rebuildTeamData(eventData.equipes_generees, playersData, initialMap);
+      setWarningMessage(eventData.warning_message);
+    } else {
+      setGeneratedTeams([]);
+    }
+  }, []);
+
   useEffect(() => {
     const loadData = async () => {
       try {
         setLoading(true);
         const [eventRes, playersRes] = await Promise.all([
           getEvent(eventId),
-          getPlayers()
+          getPlayerSummaries()
         ]);
         
-        setEvent(eventRes.data);
         setAllPlayers(playersRes.data);
-        
-        const initialMap = new Map();
-        eventRes.data.joueurs_presents.forEach(p => {
-          initialMap.set(p.joueur_id, p.note_temporaire);
-        });
-        setPresentPlayersMap(initialMap);
-        
-        setConstraints(eventRes.data.contraintes_affinite.map((c, i) => ({...c, id: i})));
-        
-        if (eventRes.data.equipes_generees && eventRes.data.equipes_generees.length > 0) {
-          rebuildTeamData(eventRes.data.equipes_generees, playersRes.data, initialMap);
-          setWarningMessage(eventRes.data.warning_message);
-        }
+        applyEvent(eventRes.data, playersRes.data);
         
       } catch (error) {
         toast.error('Erreur lors du chargement du match.');
@@ -108,7 +127,37 @@ export default function EventManagePage() {
       }
     };
     loadData();
-  }, [eventId, navigate]);
+  }, [eventId, navigate, applyEvent]);
+
+  // Les notes en attente sont abandonnées en quittant la page
+  useEffect(() => {
+    const timers = noteTimers.current;
+    return () => timers.forEach(({ timer }) => clearTimeout(timer));
+  }, []);
+
+  // Conflit de version : l'événement a changé ailleurs, on recharge l'état du serveur.
+  // Les notes encore en attente sont reportées sur l'état rechargé puis envoyées
+  const reloadEvent = async () => {
+    const pending = new Map();
+    noteTimers.current.forEach(({ timer, note }, playerId) => {
+      clearTimeout(timer);
+      pending.set(playerId, note);
+    });
+    noteTimers.current.clear();
+    try {
+      const { data } = await getEvent(eventId);
+      const joueursPresents = data.joueurs_presents.map(p =>
+        pending.has(p.joueur_id) ? { ...p, note_temporaire: pending.get(p.joueur_id) } : p
+      );
+      applyEvent({ ...data, joueurs_presents: joueursPresents }, allPlayers);
+      data.joueurs_presents.forEach(p => {
+        if (pending.has(p.joueur_id)) saveNote(p.joueur_id, pending.get(p.joueur_id));
+      });
+      toast.warning("Le match a été modifié ailleurs, les données ont été rechargées.");
+    } catch (error) {
+      toast.error('Erreur lors du chargement du match.');
+    }
+  };
   
   // (fonction rebuildTeamData modifiée pour ajouter l'ID stable)
   const rebuildTeamData = (teamIdsList, allPlayersData, notesMap) => {
@@ -136,12 +185,44 @@ export default function EventManagePage() {
     return { presentPlayers: present, availablePlayers: available };
   }, [allPlayers, presentPlayersMap]);
 
-  // 3. Actions sur les joueurs (inchangées)
+  // Chaque action est enregistrée aussitôt par une modification atomique côté serveur.
+  // makeRequest(version) part après l'écriture précédente, avec la version que celle-ci a renvoyée ;
+  // un conflit (409) recharge l'événement avant de passer à la suite de la file
+  const saveChange = (makeRequest, errorMessage = 'Erreur lors de la sauvegarde.') => {
+    const write = writeQueue.current.then(() => makeRequest(eventVersion.current)
+      .then(response => {
+        eventVersion.current = response.data.version;
+        return response;
+      })
+      .catch(error => {
+        if (error.response?.status === 409) return reloadEvent();
+        toast.error(error.response?.data?.detail || errorMessage);
+      }));
+    writeQueue.current = write;
+    return write;
+  };
+
+  const saveNote = (playerId, note) =>
+    saveChange(version => setPresentPlayer(eventId, playerId, note, version));
+  const cancelNoteWrite = (playerId) => {
+    clearTimeout(noteTimers.current.get(playerId)?.timer);
+    noteTimers.current.delete(playerId);
+  };
+  // Avant de générer : les notes encore en attente partent tout de suite, avant la génération dans la file
+  const flushNoteWrites = () => {
+    noteTimers.current.forEach(({ note }, playerId) => {
+      cancelNoteWrite(playerId);
+      saveNote(playerId, note);
+    });
+  };
+
+  // 3. Actions sur les joueurs
   const addPlayer = (player) => {
     const newMap = new Map(presentPlayersMap);
     newMap.set(player.id, player.note_generale);
     setPresentPlayersMap(newMap);
     setGeneratedTeams([]);
+    saveChange(() => setPresentPlayer(eventId, player.id, player.note_generale));
   };
   const removePlayer = (playerId) => {
     const newMap = new Map(presentPlayersMap);
@@ -149,20 +230,29 @@ export default function EventManagePage() {
     setPresentPlayersMap(newMap);
     setConstraints(prev => prev.filter(c => !c.joueurs.includes(playerId)));
     setGeneratedTeams([]);
+    cancelNoteWrite(playerId);
+    saveChange(() => removePresentPlayer(eventId, playerId));
   };
   const updatePlayerNote = (playerId, note) => {
     const newMap = new Map(presentPlayersMap);
     const parsedNote = parseFloat(note) || 0;
     if (parsedNote >= 1 && parsedNote <= 10) {
       newMap.set(playerId, parsedNote);
+      cancelNoteWrite(playerId);
+      const timer = setTimeout(() => {
+        noteTimers.current.delete(playerId);
+        saveNote(playerId, parsedNote);
+      }, NOTE_SAVE_DELAY);
+      noteTimers.current.set(playerId, { timer, note: parsedNote });
     } else {
       newMap.set(playerId, 0);
+      cancelNoteWrite(playerId);
     }
     setPresentPlayersMap(newMap);
     setGeneratedTeams([]);
   };
 
-  // 4. Actions sur les contraintes (inchangées)
+  // 4. Actions sur les contraintes
   const addConstraint = (type, player1Id, player2Id) => {
     if (!player1Id || !player2Id || player1Id === player2Id) {
       toast.error("Veuillez sélectionner deux joueurs différents.");
@@ -171,33 +261,25 @@ export default function EventManagePage() {
     const newConstraint = { id: Date.now(), type: type, joueurs: [player1Id, player2Id] };
     setConstraints(prev => [...prev, newConstraint]);
     setGeneratedTeams([]);
+    saveChange(() => addEventConstraint(eventId, { type, joueurs: newConstraint.joueurs }));
   };
   const removeConstraint = (id) => {
+    const constraint = constraints.find(c => c.id === id);
     setConstraints(prev => prev.filter(c => c.id !== id));
     setGeneratedTeams([]);
+    if (constraint) saveChange(() => removeEventConstraint(eventId, { type: constraint.type, joueurs: constraint.joueurs }));
   };
 
-  // 5. Sauvegarde et Génération (inchangée)
-  const handleSaveAndGenerate = async () => {
+  // 5. Génération (présents et contraintes sont déjà enregistrés à chaque action).
+  // Sans changement de la composition, le serveur renvoie le tirage en cache :
+  // { reshuffle: true } force une nouvelle recherche
+  const handleSaveAndGenerate = async (options = {}) => {
     setLoading(true);
     try {
-      const joueurs_presents_data = Array.from(presentPlayersMap.entries()).map(([id, note]) => ({
-        joueur_id: id,
-        note_temporaire: note,
-      }));
-      const contraintes_affinite_data = constraints.map(c => ({
-        type: c.type,
-        joueurs: c.joueurs
-      }));
-      
-      await updateEvent(eventId, {
-        joueurs_presents: joueurs_presents_data,
-        contraintes_affinite: contraintes_affinite_data,
-        equipes_generees: [] 
-      });
-      toast.success('Liste des présents et contraintes sauvegardées ! Lancement...');
-      
-      const response = await generateTeams(eventId);
+      // La génération passe par la file d'écriture : elle renvoie la nouvelle version de l'événement
+      flushNoteWrites();
+      const response = await saveChange(() => generateTeams(eventId, options), 'Erreur lors de la génération.');
+      if (!response) return;
       
       const teamsWithIds = response.data.equipes.map((team, index) => ({
         ...team,
@@ -302,7 +384,7 @@ export default function EventManagePage() {
       onDragCancel={handleDragCancel}
     >
       <div className="min-h-screen bg-gray-50">
-        {/* Header (inchangé) */}
+        {/* Header */}
         <header className="bg-white shadow-sm border-b sticky top-0 z-10">
           <div className="max-w-7xl mx-auto px-4 py-4 flex flex-col md:flex-row justify-between items-center gap-4">
             <div className="flex items-center gap-3">
@@ -317,7 +399,13 @@ export default function EventManagePage() {
               </div>
             </div>
             <div className="flex items-center gap-3 w-full md:w-auto">
-              <Button size="lg" onClick={handleSaveAndGenerate} disabled={loading || presentPlayers.length === 0} className="w-full md:w-auto">
+              {generatedTeams.length > 0 && (
+                <Button size="lg" variant="outline" onClick={() => handleSaveAndGenerate({ reshuffle: true })} disabled={loading} className="w-full md:w-auto">
+                  <RefreshCw className="w-5 h-5 mr-2" />
+                  Nouveau tirage
+                </Button>
+              )}
+              <Button size="lg" onClick={() => handleSaveAndGenerate()} disabled={loading || presentPlayers.length === 0} className="w-full md:w-auto">
                 <Shuffle className="w-5 h-5 mr-2" />
                 {loading ? "Génération..." : "Sauvegarder et Générer"}
               </Button>
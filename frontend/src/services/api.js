@@ -40,22 +40,56 @@ export const getGuestLogs = () => {
 };
 
 // ===================================
-// PLAYERS (Inchangé)
+// LISTES PAGINÉES
 // ===================================
-export const getPlayers = () => axios.get(`${API}/players`);
+// Les listes sont servies par pages : on suit le curseur X-Next-Cursor jusqu'à la dernière
+const getAllPages = async (path, params = {}) => {
+  const data = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(`${API}/${path}`, { params: { ...params, cursor: cursor || undefined } });
+    data.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return { data };
+};
+
+// ===================================
+// PLAYERS
+// ===================================
+export const getPlayers = () => getAllPages('players');
+// Liste allégée pour les sélecteurs : projection sur les champs utiles
+export const getPlayerSummaries = (fields = 'id,nom,note_generale,postes', limit = 500) =>
+  getAllPages('players', { fields, limit });
 export const createPlayer = (data) => axios.post(`${API}/players`, data);
 export const updatePlayer = (id, data) => axios.put(`${API}/players/${id}`, data);
 export const deletePlayer = (id) => axios.delete(`${API}/players/${id}`);
 
 // ===================================
-// EVENTS (Inchangé)
+// EVENTS
 // ===================================
-export const getEvents = () => axios.get(`${API}/events`);
+export const getEvents = () => getAllPages('events');
 export const getEvent = (id) => axios.get(`${API}/events/${id}`);
 export const createEvent = (data) => axios.post(`${API}/events`, data);
 export const updateEvent = (id, data) => axios.put(`${API}/events/${id}`, data);
+// Modifications atomiques (une écriture par action, sans renvoyer les listes complètes)
+// version : refusée avec 409 si l'événement a été modifié entre-temps
+export const setPresentPlayer = (id, joueurId, note, version) =>
+  axios.put(`${API}/events/${id}/joueurs-presents/${joueurId}`, { note_temporaire: note }, { params: { version } });
+export const removePresentPlayer = (id, joueurId) => axios.delete(`${API}/events/${id}/joueurs-presents/${joueurId}`);
+export const addEventConstraint = (id, contrainte) => axios.post(`${API}/events/${id}/contraintes`, contrainte);
+export const removeEventConstraint = (id, contrainte) => axios.delete(`${API}/events/${id}/contraintes`, { data: contrainte });
 export const deleteEvent = (id) => axios.delete(`${API}/events/${id}`);
-export const generateTeams = (id) => axios.post(`${API}/events/${id}/generate`);
+// incremental : repart des équipes déjà générées et ne déplace que le nécessaire ;
+// reshuffle : ignore le cache et relance une recherche ; seed : tirage reproductible
+export const generateTeams = (id, { incremental = false, reshuffle = false, seed } = {}) =>
+  axios.post(`${API}/events/${id}/generate`, null, {
+    params: { ...(incremental && { incremental: true }), ...(reshuffle && { reshuffle: true }), ...(seed !== undefined && { seed }) }
+  });
+export const generateTeamAlternatives = (id, k = 5) => axios.post(`${API}/events/${id}/generate/alternatives`, null, { params: { k } });
+// Plusieurs tours (ou plusieurs événements) en limitant les coéquipiers répétés
+export const generateTours = (eventIds, tours = 1, options = {}) =>
+  axios.post(`${API}/events/generate-tours`, { event_ids: eventIds, tours, ...options });
 
 // ===================================
 // SHARE (Inchangé)
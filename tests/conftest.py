@@ -0,0 +1,81 @@
+import os
+import sys
+import random
+
+import pytest
+
+# Réglages lus à l'import de server : générations courtes et pool de threads (pas de spawn)
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "tests")
+os.environ.setdefault("GENERATION_EXECUTOR", "thread")
+os.environ.setdefault("GENERATION_TIME_BUDGET", "0.3")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from benchmarks.mongomock_patch import patch_mongomock
+
+
+patch_mongomock()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    # Base vierge par test, index compris (unicité du nom des joueurs)
+    database = AsyncMongoMockClient()["tests"]
+    server.use_database(database)
+    server.generation_jobs.clear()
+    await server.ensure_indexes()
+    yield database
+    await server.guest_log_writer.flush()
+
+
+@pytest.fixture
+async def api(db):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def admin(api):
+    # Le premier compte inscrit est administrateur
+    response = await api.post("/api/auth/register", json={"email": "admin@example.fr", "password": "motdepasse"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def create_players(api, admin):
+    async def create(n, seed=0, prefix="joueur"):
+        rng = random.Random(seed)
+        ids = []
+        for i in range(n):
+            attrs = {attr: round(rng.uniform(2, 9), 1) for attr in ("vitesse", "technique", "tir", "passe", "defense", "physique")}
+            response = await api.post("/api/players", json={"nom": f"{prefix}{i}", "postes": ["Milieu"], **attrs}, headers=admin)
+            assert response.status_code == 200, response.text
+            ids.append(response.json()["id"])
+        return ids
+    return create
+
+
+@pytest.fixture
+def create_event(api, admin):
+    async def create(joueur_ids, nombre_equipes=2, **fields):
+        payload = {
+            "nom_evenement": "Match du jeudi",
+            "nombre_equipes": nombre_equipes,
+            "joueurs_presents": [{"joueur_id": jid, "note_temporaire": 4 + i % 5} for i, jid in enumerate(joueur_ids)],
+            **fields,
+        }
+        response = await api.post("/api/events", json=payload, headers=admin)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return create
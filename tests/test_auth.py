@@ -0,0 +1,37 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_principal_is_served_from_the_cache_until_invalidated(api, admin, db):
+    assert (await api.get("/api/auth/me", headers=admin)).status_code == 200
+    # Compte supprimé directement en base : le cache répond encore jusqu'à l'invalidation
+    await db.users.delete_many({})
+    assert (await api.get("/api/auth/me", headers=admin)).json()["email"] == "admin@example.fr"
+    server.invalidate_principal()
+    assert (await api.get("/api/auth/me", headers=admin)).status_code == 401
+
+
+async def test_cached_principal_expires_after_its_ttl(api, admin, db, monkeypatch):
+    monkeypatch.setattr(server, "PRINCIPAL_CACHE_TTL", 0)
+    assert (await api.get("/api/auth/me", headers=admin)).status_code == 200
+    await db.users.delete_many({})
+    assert (await api.get("/api/auth/me", headers=admin)).status_code == 401
+
+
+async def test_cache_is_bounded_and_remembers_guests_as_absent(api, monkeypatch):
+    monkeypatch.setattr(server, "PRINCIPAL_CACHE_SIZE", 2)
+    for name in ("Alice", "Bruno", "Chloé"):
+        token = server.create_access_token({"sub": f"guest_{name}", "role": "co-organisateur", "name": name})
+        response = await api.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+        assert response.json() == {"id": f"guest_{name}", "email": name, "role": "co-organisateur"}
+    assert list(server.principal_cache) == ["guest_Bruno", "guest_Chloé"]
+    assert all(entry[1] is None for entry in server.principal_cache.values())
+
+
+async def test_unknown_subject_is_not_cached(api):
+    token = server.create_access_token({"sub": "inconnu", "role": "admin", "name": "x"})
+    assert (await api.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})).status_code == 401
+    assert "inconnu" not in server.principal_cache
@@ -0,0 +1,86 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_generation_cache_hit_reshuffle_and_invalidation(api, admin, create_players, create_event):
+    ids = await create_players(8)
+    event = await create_event(ids, methode_generation="recherche_locale")
+    url = f"/api/events/{event['id']}/generate"
+    first = (await api.post(url, headers=admin)).json()
+    assert first["depuis_cache"] is False
+    second = (await api.post(url, headers=admin)).json()
+    assert second["depuis_cache"] is True
+    assert second["equipes"] == first["equipes"]
+
+    assert (await api.post(url, params={"reshuffle": True}, headers=admin)).json()["depuis_cache"] is False
+    # Une note modifiée change l'empreinte de la génération
+    await api.put(f"/api/events/{event['id']}/joueurs-presents/{ids[0]}", json={"note_temporaire": 10}, headers=admin)
+    assert (await api.post(url, headers=admin)).json()["depuis_cache"] is False
+
+
+async def test_cached_generation_does_not_rewrite_the_event(api, admin, create_players, create_event):
+    ids = await create_players(6)
+    event = await create_event(ids)
+    url = f"/api/events/{event['id']}/generate"
+    await api.post(url, headers=admin)
+    version = (await api.get(f"/api/events/{event['id']}", headers=admin)).json()["version"]
+    await api.post(url, headers=admin)
+    assert (await api.get(f"/api/events/{event['id']}", headers=admin)).json()["version"] == version
+
+
+async def test_seeded_generations_are_cached_separately(api, admin, create_players, create_event):
+    ids = await create_players(8)
+    event = await create_event(ids)
+    url = f"/api/events/{event['id']}/generate"
+    assert (await api.post(url, params={"seed": 1}, headers=admin)).json()["depuis_cache"] is False
+    assert (await api.post(url, params={"seed": 2}, headers=admin)).json()["depuis_cache"] is False
+    assert (await api.post(url, params={"seed": 1}, headers=admin)).json()["depuis_cache"] is True
+
+
+async def shared(api, event):
+    return await api.get(f"/api/share/{event['share_token']}")
+
+
+async def test_share_etag_and_not_modified(api, admin, create_players, create_event):
+    ids = await create_players(6)
+    event = await create_event(ids)
+    assert (await shared(api, event)).status_code == 400
+    await api.post(f"/api/events/{event['id']}/generate", headers=admin)
+    response = await shared(api, event)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = await api.get(f"/api/share/{event['share_token']}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+
+async def test_share_cache_is_invalidated_by_event_writes(api, admin, create_players, create_event):
+    ids = await create_players(7)
+    event = await create_event(ids[:6])
+    await api.post(f"/api/events/{event['id']}/generate", headers=admin)
+    etag = (await shared(api, event)).headers["etag"]
+    await api.put(f"/api/events/{event['id']}/joueurs-presents/{ids[6]}", json={"note_temporaire": 5}, headers=admin)
+    await api.post(f"/api/events/{event['id']}/generate", headers=admin)
+    response = await shared(api, event)
+    assert response.headers["etag"] != etag
+    assert ids[6] in {j["id"] for team in response.json()["equipes"] for j in team["joueurs"]}
+
+
+async def test_player_update_evicts_only_events_containing_the_player(api, admin, create_players, create_event):
+    ids = await create_players(8)
+    concerned, other = await create_event(ids[:4]), await create_event(ids[4:])
+    for event in (concerned, other):
+        await api.post(f"/api/events/{event['id']}/generate", headers=admin)
+        await shared(api, event)
+    etag = (await shared(api, concerned)).headers["etag"]
+
+    response = await api.put(f"/api/players/{ids[0]}", json={"nom": "Nouveau nom"}, headers=admin)
+    assert response.status_code == 200
+    assert concerned["share_token"] not in server.share_cache
+    assert other["share_token"] in server.share_cache
+    response = await shared(api, concerned)
+    assert response.headers["etag"] != etag
+    assert "Nouveau nom" in response.text
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_present_player_patch_increments_version(api, admin, create_players, create_event):
+    ids = await create_players(3)
+    event = await create_event(ids[:2])
+    response = await api.put(f"/api/events/{event['id']}/joueurs-presents/{ids[0]}", json={"note_temporaire": 9}, headers=admin)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["version"] == event["version"] + 1
+    assert {jp["joueur_id"]: jp["note_temporaire"] for jp in body["joueurs_presents"]}[ids[0]] == 9
+
+    response = await api.put(f"/api/events/{event['id']}/joueurs-presents/{ids[2]}", json={"note_temporaire": 6}, headers=admin)
+    assert [jp["joueur_id"] for jp in response.json()["joueurs_presents"]] == ids
+
+
+async def test_stale_version_is_rejected_with_409(api, admin, create_players, create_event):
+    ids = await create_players(3)
+    event = await create_event(ids[:2])
+    url = f"/api/events/{event['id']}/joueurs-presents/{ids[0]}"
+    response = await api.put(url, params={"version": event["version"]}, json={"note_temporaire": 7}, headers=admin)
+    assert response.status_code == 200
+    response = await api.put(url, params={"version": event["version"]}, json={"note_temporaire": 8}, headers=admin)
+    assert response.status_code == 409
+    response = await api.put(f"/api/events/{event['id']}", json={"nombre_equipes": 3, "version": event["version"]}, headers=admin)
+    assert response.status_code == 409
+    assert (await api.get(f"/api/events/{event['id']}", headers=admin)).json()["nombre_equipes"] == 2
+
+
+async def test_concurrent_present_players_are_all_kept(api, admin, create_players, create_event):
+    ids = await create_players(8)
+    event = await create_event([])
+    await asyncio.gather(*(
+        api.put(f"/api/events/{event['id']}/joueurs-presents/{jid}", json={"note_temporaire": 5}, headers=admin) for jid in ids
+    ))
+    body = (await api.get(f"/api/events/{event['id']}", headers=admin)).json()
+    assert sorted(jp["joueur_id"] for jp in body["joueurs_presents"]) == sorted(ids)
+    assert body["version"] == len(ids)
+
+
+async def test_removing_a_player_drops_its_constraints(api, admin, create_players, create_event):
+    ids = await create_players(4)
+    event = await create_event(ids)
+    url = f"/api/events/{event['id']}/contraintes"
+    await api.post(url, json={"type": "lier", "joueurs": [ids[0], ids[1]]}, headers=admin)
+    await api.post(url, json={"type": "separer", "joueurs": [ids[2], ids[3]]}, headers=admin)
+    response = await api.delete(f"/api/events/{event['id']}/joueurs-presents/{ids[0]}", headers=admin)
+    assert response.status_code == 200
+    assert [c["type"] for c in response.json()["contraintes_affinite"]] == ["separer"]
+    response = await api.delete(f"/api/events/{event['id']}/joueurs-presents/{ids[0]}", headers=admin)
+    assert response.status_code == 404
+
+
+async def test_constraints_ignore_player_order(api, admin, create_players, create_event, db):
+    ids = await create_players(4)
+    event = await create_event(ids)
+    url = f"/api/events/{event['id']}/contraintes"
+    await api.post(url, json={"type": "lier", "joueurs": [ids[1], ids[0]]}, headers=admin)
+    response = await api.post(url, json={"type": "lier", "joueurs": [ids[0], ids[1]]}, headers=admin)
+    assert len(response.json()["contraintes_affinite"]) == 1
+
+    # Contrainte enregistrée avant la forme triée
+    await db.events.update_one({"id": event["id"]}, {"$push": {"contraintes_affinite": {"type": "separer", "joueurs": [ids[3], ids[2]]}}})
+    response = await api.request("DELETE", url, json={"type": "separer", "joueurs": [ids[2], ids[3]]}, headers=admin)
+    assert response.status_code == 200
+    response = await api.request("DELETE", url, json={"type": "lier", "joueurs": [ids[1], ids[0]]}, headers=admin)
+    assert response.json()["contraintes_affinite"] == []
+    response = await api.request("DELETE", url, json={"type": "lier", "joueurs": [ids[1], ids[0]]}, headers=admin)
+    assert response.status_code == 404
+
+
+def test_constraint_players_are_order_independent():
+    assert server.ContrainteAffinite(type="lier", joueurs=["b", "a", "b"]) == server.ContrainteAffinite(type="lier", joueurs=["a", "b"])
+
+
+async def test_invalid_constraints_are_rejected(api, admin, create_players, create_event):
+    ids = await create_players(2)
+    event = await create_event(ids)
+    url = f"/api/events/{event['id']}/contraintes"
+    assert (await api.post(url, json={"type": "eviter", "joueurs": ids}, headers=admin)).status_code == 400
+    assert (await api.post(url, json={"type": "lier", "joueurs": [ids[0], ids[0]]}, headers=admin)).status_code == 400
+
+
+async def test_generation_returns_the_version_it_wrote(api, admin, create_players, create_event):
+    ids = await create_players(6)
+    event = await create_event(ids)
+    url = f"/api/events/{event['id']}/generate"
+    generated = (await api.post(url, headers=admin)).json()
+    assert generated["version"] == event["version"] + 1
+    # Tirage en cache sans écriture : la version reste celle de l'événement
+    assert (await api.post(url, headers=admin)).json()["version"] == generated["version"]
+    # La note suivante, envoyée avec cette version, est acceptée
+    response = await api.put(f"/api/events/{event['id']}/joueurs-presents/{ids[0]}", params={"version": generated["version"]},
+                             json={"note_temporaire": 9}, headers=admin)
+    assert response.status_code == 200
+
+
+async def test_concurrent_generations_both_save(api, admin, create_players, create_event):
+    event = await create_event(await create_players(8))
+    url = f"/api/events/{event['id']}/generate"
+    responses = await asyncio.gather(*(api.post(url, params={"reshuffle": True}, headers=admin) for _ in range(2)))
+    assert [r.status_code for r in responses] == [200, 200]
+    assert sorted(r.json()["version"] for r in responses) == [event["version"] + 1, event["version"] + 2]
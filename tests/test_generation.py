@@ -0,0 +1,303 @@
+import asyncio
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+import server
+from server import (ContrainteAffinite, JoueurPresent, PlayerRecord, TeamProblem, calculate_general, calculate_sub_scores,
+                    check_constraints, generate_balanced_teams, run_incremental_generation, run_rotation_generation,
+                    run_team_generation, score_assignments)
+
+ATTRS = ("vitesse", "technique", "tir", "passe", "defense", "physique", "reflexes_gk", "plongeon_gk", "jeu_au_pied_gk")
+
+
+def roster(n, seed=0):
+    rng = random.Random(seed)
+    joueurs_map, presents = {}, []
+    for i in range(n):
+        attrs = {attr: round(rng.uniform(2, 9), 1) for attr in ATTRS}
+        doc = {"id": f"j{i}", "nom": f"joueur{i}", "postes": ["Gardien"] if i % 7 == 0 else ["Attaquant"], **attrs}
+        player = PlayerRecord.from_doc({**doc, "note_generale": calculate_general(doc), **calculate_sub_scores(doc)})
+        joueurs_map[player.id] = player
+        presents.append(JoueurPresent(joueur_id=player.id, note_temporaire=player.note_generale))
+    return presents, joueurs_map
+
+
+def brute_force_scores(presents, joueurs_map, contraintes=()):
+    # Toutes les partitions en deux équipes de même taille (chacune énumérée une seule fois)
+    problem = TeamProblem(presents, 2, list(contraintes), joueurs_map)
+    ids = problem.joueur_ids
+    scores = {}
+    for first in itertools.combinations(range(len(ids)), len(ids) // 2):
+        if 0 not in first: continue
+        assignment = np.ones(len(ids), dtype=int)
+        assignment[list(first)] = 0
+        teams = [[ids[i] for i in first], [ids[i] for i in range(len(ids)) if i not in first]]
+        if not check_constraints(teams, list(contraintes)): continue
+        score, _ = score_assignments(problem.matrix, assignment[None, :], 2)
+        scores[partition(teams)] = float(score[0])
+    return scores
+
+
+def partition(teams):
+    return frozenset(map(frozenset, teams))
+
+
+def test_batch_scores_match_per_team_variance():
+    presents, joueurs_map = roster(11, seed=1)
+    problem = TeamProblem(presents, 3, [], joueurs_map)
+    rng = np.random.default_rng(0)
+    assignments = np.stack([rng.permutation(np.arange(11) % 3) for _ in range(20)])
+    scores, _ = score_assignments(problem.matrix, assignments, 3)
+    for assignment, score in zip(assignments, scores):
+        means = np.array([problem.matrix[assignment == t].mean(axis=0) for t in range(3)])
+        assert score == pytest.approx(float(means.var(axis=0) @ np.array([3.0, 2.0, 2.0, 2.0])))
+
+
+def test_generated_teams_are_balanced_partitions():
+    presents, joueurs_map = roster(11, seed=2)
+    equipes, _ = generate_balanced_teams(presents, 3, [], joueurs_map, max_attempts=2000)
+    assert sorted(len(team) for team in equipes) == [3, 4, 4]
+    assert sorted(jid for team in equipes for jid in team) == sorted(joueurs_map)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_local_search_is_close_to_the_optimum(seed):
+    presents, joueurs_map = roster(12, seed=seed)
+    optimum = min(brute_force_scores(presents, joueurs_map).values())
+    result = run_team_generation(presents, 2, [], joueurs_map, methode="recherche_locale", time_budget=30, seed=seed)
+    assert result["score"] <= optimum * 1.5 + 1e-9
+
+
+def test_local_search_stops_once_a_round_brings_nothing():
+    presents, joueurs_map = roster(14, seed=1)
+    result = run_team_generation(presents, 2, [], joueurs_map, methode="recherche_locale", time_budget=30, seed=1)
+    assert result["tentatives"] + result["rejets"] < server.GENERATION_LOCAL_ITERATIONS
+
+
+@pytest.mark.parametrize("methode", ["aleatoire", "recherche_locale"])
+def test_seed_makes_generation_reproducible(methode):
+    # Budget en itérations, pas en temps : la recherche n'est pas interrompue
+    presents, joueurs_map = roster(16, seed=7)
+    runs = [run_team_generation(presents, 4, [], joueurs_map, methode=methode, max_attempts=500, time_budget=30, seed=42)
+            for _ in range(2)]
+    assert runs[0]["equipes"] == runs[1]["equipes"]
+    assert runs[0]["score"] == runs[1]["score"]
+
+
+def test_unknown_method_is_rejected():
+    presents, joueurs_map = roster(4)
+    with pytest.raises(ValueError):
+        run_team_generation(presents, 2, [], joueurs_map, methode="glouton")
+
+
+@pytest.mark.anyio
+async def test_unknown_method_is_rejected_on_event_writes(api, admin, create_players, create_event):
+    ids = await create_players(2)
+    response = await api.post("/api/events", json={"nom_evenement": "x", "methode_generation": "glouton"}, headers=admin)
+    assert response.status_code == 422
+    event = await create_event(ids)
+    response = await api.put(f"/api/events/{event['id']}", json={"methode_generation": "glouton"}, headers=admin)
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("methode", ["aleatoire", "recherche_locale", "exacte"])
+def test_constraints_are_enforced(methode):
+    presents, joueurs_map = roster(12, seed=5)
+    contraintes = [
+        ContrainteAffinite(type="lier", joueurs=["j0", "j1"]),
+        ContrainteAffinite(type="lier", joueurs=["j1", "j2"]),
+        ContrainteAffinite(type="separer", joueurs=["j0", "j3"]),
+        ContrainteAffinite(type="separer", joueurs=["j4", "j5"]),
+    ]
+    for seed in range(3):
+        result = run_team_generation(presents, 3, contraintes, joueurs_map, methode=methode, seed=seed)
+        assert check_constraints(result["equipes"], contraintes)
+        assert sorted(len(team) for team in result["equipes"]) == [4, 4, 4]
+
+
+def test_contradictory_constraints_are_rejected():
+    presents, joueurs_map = roster(6)
+    contraintes = [ContrainteAffinite(type="lier", joueurs=["j0", "j1"]), ContrainteAffinite(type="separer", joueurs=["j1", "j0"])]
+    with pytest.raises(ValueError, match="contradictoires"):
+        run_team_generation(presents, 2, contraintes, joueurs_map)
+
+
+def test_infeasible_constraints_are_rejected():
+    # Quatre joueurs à séparer deux à deux pour seulement trois équipes
+    presents, joueurs_map = roster(9)
+    contraintes = [ContrainteAffinite(type="separer", joueurs=["j0", "j1", "j2", "j3"])]
+    with pytest.raises(ValueError):
+        run_team_generation(presents, 3, contraintes, joueurs_map)
+
+
+def test_exact_matches_brute_force():
+    presents, joueurs_map = roster(10, seed=3)
+    expected = brute_force_scores(presents, joueurs_map)
+    result = run_team_generation(presents, 2, [], joueurs_map, methode="exacte", time_budget=10)
+    assert result["optimal"]
+    assert result["score"] == pytest.approx(min(expected.values()))
+    assert expected[partition(result["equipes"])] == pytest.approx(result["score"])
+
+
+def test_exact_top_k_are_the_k_best_distinct_partitions():
+    presents, joueurs_map = roster(10, seed=4)
+    expected = sorted(brute_force_scores(presents, joueurs_map).values())[:5]
+    result = run_team_generation(presents, 2, [], joueurs_map, methode="exacte", time_budget=10, top_k=5)
+    alternatives = result["alternatives"]
+    assert len({partition(alt["equipes"]) for alt in alternatives}) == 5
+    assert [alt["score"] for alt in alternatives] == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("methode", ["aleatoire", "recherche_locale"])
+def test_alternatives_are_distinct_and_respect_constraints(methode):
+    presents, joueurs_map = roster(12, seed=5)
+    contraintes = [ContrainteAffinite(type="lier", joueurs=["j0", "j1"]), ContrainteAffinite(type="separer", joueurs=["j0", "j3"])]
+    result = run_team_generation(presents, 3, contraintes, joueurs_map, methode=methode, seed=1, top_k=3)
+    alternatives = result["alternatives"]
+    assert len({partition(alt["equipes"]) for alt in alternatives}) == len(alternatives) == 3
+    assert [alt["score"] for alt in alternatives] == sorted(alt["score"] for alt in alternatives)
+    assert all(check_constraints(alt["equipes"], contraintes) for alt in alternatives)
+
+
+@pytest.mark.anyio
+async def test_alternatives_endpoint_validates_k(api, admin, create_players, create_event):
+    event = await create_event(await create_players(8))
+    for k in (0, server.GENERATION_MAX_ALTERNATIVES + 1):
+        response = await api.post(f"/api/events/{event['id']}/generate/alternatives", params={"k": k}, headers=admin)
+        assert response.status_code == 422
+    response = await api.post(f"/api/events/{event['id']}/generate/alternatives", params={"k": 3}, headers=admin)
+    assert response.status_code == 200
+    assert len(response.json()["propositions"]) == 3
+
+
+def test_exact_with_constraints_matches_brute_force():
+    presents, joueurs_map = roster(8, seed=6)
+    contraintes = [ContrainteAffinite(type="lier", joueurs=["j2", "j5"]), ContrainteAffinite(type="separer", joueurs=["j0", "j1"])]
+    expected = brute_force_scores(presents, joueurs_map, contraintes)
+    result = run_team_generation(presents, 2, contraintes, joueurs_map, methode="exacte", time_budget=10)
+    assert result["score"] == pytest.approx(min(expected.values()))
+
+
+def test_exact_falls_back_when_the_space_is_too_large():
+    presents, joueurs_map = roster(30, seed=2)
+    result = run_team_generation(presents, 5, [], joueurs_map, methode="exacte", time_budget=0.2)
+    assert not result["optimal"]
+    assert sorted(len(team) for team in result["equipes"]) == [6] * 5
+
+
+@pytest.mark.anyio
+async def test_exact_job_enumerates_once(api, admin, create_players, create_event, monkeypatch):
+    # Les tranches suivantes d'un job "exacte" repartent de la meilleure partition en recherche locale
+    methodes = []
+    original = server.run_team_generation
+    def record(*args, **kwargs):
+        methodes.append(kwargs["methode"])
+        return original(*args, **kwargs)
+    monkeypatch.setattr(server, "run_team_generation", record)
+    monkeypatch.setattr(server, "GENERATION_JOB_SLICE", 0.1)
+    ids = await create_players(18)
+    event = await create_event(ids, nombre_equipes=3, methode_generation="exacte")
+    response = await api.post(f"/api/events/{event['id']}/generation-jobs", json={"budget_secondes": 0.6}, headers=admin)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    while (job := (await api.get(f"/api/generation-jobs/{job_id}", headers=admin)).json())["statut"] == "en_cours":
+        await asyncio.sleep(0.05)
+    assert job["statut"] == "terminee"
+    assert methodes[0] == "exacte" and methodes.count("exacte") == 1
+
+
+def median_random_score(presents, joueurs_map, nombre_equipes):
+    problem = TeamProblem(presents, nombre_equipes, [], joueurs_map)
+    rng = np.random.default_rng(0)
+    assignments = np.stack([rng.permutation(np.arange(len(presents)) % nombre_equipes) for _ in range(2000)])
+    return float(np.median(score_assignments(problem.matrix, assignments, nombre_equipes)[0]))
+
+
+def moved(previous, teams):
+    team_before = {jid: t for t, team in enumerate(previous) for jid in team}
+    return sum(team_before.get(jid, t) != t for t, team in enumerate(teams) for jid in team)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("change", ["desistement", "arrivee"])
+def test_incremental_repair_gives_balanced_partitions(seed, change):
+    presents, joueurs_map = roster(13, seed=seed)
+    previous = run_team_generation(presents[:12], 3, [], joueurs_map, methode="recherche_locale", seed=seed)["equipes"]
+    presents = [p for p in presents[:12] if p.joueur_id != "j5"] if change == "desistement" else presents
+    result = run_incremental_generation(presents, 3, [], joueurs_map, previous)
+    assert result["incremental"]
+    assert sorted(j for team in result["equipes"] for j in team) == sorted(p.joueur_id for p in presents)
+    assert max(map(len, result["equipes"])) - min(map(len, result["equipes"])) <= 1
+    assert result["joueurs_deplaces"] == moved(previous, result["equipes"])
+    assert result["score"] <= 0.25 * median_random_score(presents, joueurs_map, 3)
+
+
+def test_incremental_repair_keeps_constraints():
+    presents, joueurs_map = roster(13, seed=4)
+    contraintes = [ContrainteAffinite(type="lier", joueurs=["j0", "j1", "j2"]), ContrainteAffinite(type="separer", joueurs=["j3", "j4"])]
+    previous = run_team_generation(presents[:12], 3, contraintes, joueurs_map, methode="recherche_locale", seed=0)["equipes"]
+    # j1 part, j12 arrive : le groupe lié et la séparation doivent tenir après réparation
+    presents = [p for p in presents if p.joueur_id != "j1"]
+    result = run_incremental_generation(presents, 3, contraintes, joueurs_map, previous)
+    assert result["incremental"]
+    assert check_constraints(result["equipes"], contraintes)
+    assert result["joueurs_deplaces"] == moved(previous, result["equipes"])
+
+
+def test_unchanged_roster_moves_nobody():
+    presents, joueurs_map = roster(12, seed=2)
+    previous = run_team_generation(presents, 3, [], joueurs_map, methode="recherche_locale", seed=2)["equipes"]
+    result = run_incremental_generation(presents, 3, [], joueurs_map, previous)
+    assert result["joueurs_deplaces"] == 0 and result["equipes"] == previous
+
+
+def test_incremental_falls_back_to_a_full_generation():
+    presents, joueurs_map = roster(12, seed=3)
+    previous = run_team_generation(presents, 3, [], joueurs_map, methode="recherche_locale", seed=3)["equipes"]
+    # Nombre d'équipes changé : pas de réparation possible
+    result = run_incremental_generation(presents, 2, [], joueurs_map, previous, time_budget=0.2)
+    assert not result["incremental"]
+    assert sorted(len(team) for team in result["equipes"]) == [6, 6]
+    assert result["joueurs_deplaces"] == moved(previous, result["equipes"])
+
+
+@pytest.mark.anyio
+async def test_incremental_generation_endpoint(api, admin, create_players, create_event):
+    ids = await create_players(11)
+    event = await create_event(ids[:10])
+    url = f"/api/events/{event['id']}/generate"
+    previous = (await api.post(url, headers=admin)).json()["equipes"]
+    await api.put(f"/api/events/{event['id']}/joueurs-presents/{ids[10]}", json={"note_temporaire": 6}, headers=admin)
+    response = (await api.post(url, params={"incremental": True}, headers=admin)).json()
+    teams = [[j["id"] for j in team["joueurs"]] for team in response["equipes"]]
+    assert sorted(j for team in teams for j in team) == sorted(ids)
+    assert response["joueurs_deplaces"] == moved([[j["id"] for j in team["joueurs"]] for team in previous], teams)
+
+
+def test_rotation_penalty_reduces_repeated_pairs():
+    presents, joueurs_map = roster(20, seed=8)
+    etapes = [{"joueurs_presents": presents, "nombre_equipes": 4, "contraintes": [], "tours": 4}]
+    sans = run_rotation_generation(etapes, joueurs_map, 0.0, seed=1)[0]
+    avec = run_rotation_generation(etapes, joueurs_map, 5.0, seed=1)[0]
+    assert sum(t["paires_repetees"] for t in avec) < sum(t["paires_repetees"] for t in sans)
+    assert all(sorted(len(team) for team in t["equipes"]) == [5, 5, 5, 5] for t in avec)
+
+
+@pytest.mark.anyio
+async def test_tour_deadline_scales_with_rounds(api, admin, create_players, create_event, monkeypatch):
+    timeouts = []
+    original = server.run_in_generation_pool
+    async def record(func, *args, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        return await original(func, *args, timeout=timeout, **kwargs)
+    monkeypatch.setattr(server, "run_in_generation_pool", record)
+    ids = await create_players(12)
+    first, second = await create_event(ids[:8]), await create_event(ids[4:])
+    response = await api.post("/api/events/generate-tours", json={"event_ids": [first["id"], second["id"]], "tours": 3}, headers=admin)
+    assert response.status_code == 200
+    assert [len(e["tours"]) for e in response.json()["evenements"]] == [3, 3]
+    # Une seule chaîne (joueurs communs) : 2 événements x 3 tours
+    assert timeouts == [pytest.approx(6 * server.GENERATION_TIME_BUDGET + server.GENERATION_REQUEST_TIMEOUT)]
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def start_job(api, admin, event, **options):
+    response = await api.post(f"/api/events/{event['id']}/generation-jobs", json=options, headers=admin)
+    assert response.status_code == 202
+    return response.json()["job_id"]
+
+
+async def wait_job(api, admin, job_id):
+    while (job := (await api.get(f"/api/generation-jobs/{job_id}", headers=admin)).json())["statut"] == "en_cours":
+        await asyncio.sleep(0.05)
+    return job
+
+
+def parse_sse(text):
+    messages = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if lines: messages.append((lines["event"], json.loads(lines["data"])))
+    return messages
+
+
+async def test_stream_reports_progress_then_the_final_state(api, admin, create_players, create_event, monkeypatch):
+    monkeypatch.setattr(server, "GENERATION_JOB_SLICE", 0.1)
+    event = await create_event(await create_players(12), nombre_equipes=3, methode_generation="recherche_locale")
+    job_id = await start_job(api, admin, event, budget_secondes=0.4)
+    response = await api.get(f"/api/generation-jobs/{job_id}/stream", headers=admin)
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    messages = parse_sse(response.text)
+    assert [name for name, _ in messages[:-1]] == ["progression"] * (len(messages) - 1)
+    name, final = messages[-1]
+    assert name == "fin" and final["statut"] == "terminee"
+    # Les scores publiés ne font que s'améliorer
+    scores = [data["score"] for _, data in messages if data["score"] is not None]
+    assert scores == sorted(scores, reverse=True)
+
+    saved = (await api.get(f"/api/events/{event['id']}", headers=admin)).json()
+    assert saved["version"] == event["version"] + 1
+    assert len(saved["equipes_generees"]) == 3
+
+
+async def test_stop_saves_the_best_result_so_far(api, admin, create_players, create_event, monkeypatch):
+    monkeypatch.setattr(server, "GENERATION_JOB_SLICE", 0.05)
+    event = await create_event(await create_players(10), methode_generation="recherche_locale")
+    job_id = await start_job(api, admin, event, budget_secondes=30)
+    await asyncio.sleep(0.1)
+    await api.post(f"/api/generation-jobs/{job_id}/stop", headers=admin)
+    job = await wait_job(api, admin, job_id)
+    assert job["statut"] == "arretee" and job["ecoule"] < 5
+    saved = (await api.get(f"/api/events/{event['id']}", headers=admin)).json()
+    assert sorted(j for team in saved["equipes_generees"] for j in team) == sorted(p["joueur_id"] for p in event["joueurs_presents"])
+
+
+async def test_result_is_not_saved_over_a_modified_event(api, admin, create_players, create_event, monkeypatch):
+    monkeypatch.setattr(server, "GENERATION_JOB_SLICE", 0.05)
+    ids = await create_players(10)
+    event = await create_event(ids[:8], methode_generation="recherche_locale")
+    job_id = await start_job(api, admin, event, budget_secondes=0.3)
+    # Un joueur arrive pendant la génération : les équipes calculées sans lui sont périmées
+    response = await api.put(f"/api/events/{event['id']}/joueurs-presents/{ids[8]}", json={"note_temporaire": 5}, headers=admin)
+    assert response.status_code == 200
+    job = await wait_job(api, admin, job_id)
+    assert job["statut"] == "erreur" and "modifié" in job["erreur"]
+    saved = (await api.get(f"/api/events/{event['id']}", headers=admin)).json()
+    assert not saved["equipes_generees"] and saved["version"] == response.json()["version"]
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Sémaphore et compteurs propres au test ; les calculs bloqués sont libérés à la fin
+    monkeypatch.setattr(server, "generation_semaphore", None)
+    monkeypatch.setattr(server, "generation_stats", dict.fromkeys(server.generation_stats, 0))
+    release = threading.Event()
+    yield release
+    release.set()
+
+
+async def test_generation_runs_off_the_event_loop(pool):
+    loop_thread = threading.get_ident()
+    assert await server.run_in_generation_pool(threading.get_ident) != loop_thread
+    assert server.generation_stats["terminees"] == 1
+
+
+async def test_full_queue_is_refused_with_503(pool, monkeypatch):
+    monkeypatch.setattr(server, "GENERATION_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(server, "GENERATION_MAX_QUEUE", 1)
+    running = asyncio.create_task(server.run_in_generation_pool(pool.wait, 5))
+    waiting = asyncio.create_task(server.run_in_generation_pool(pool.wait, 5))
+    while server.generation_stats["en_attente"] < 1:
+        await asyncio.sleep(0.01)
+    assert server.generation_stats["en_cours"] == 1
+
+    with pytest.raises(HTTPException) as refused:
+        await server.run_in_generation_pool(pool.wait, 5)
+    assert refused.value.status_code == 503
+    assert server.generation_stats["refusees"] == 1
+
+    pool.set()
+    assert await asyncio.gather(running, waiting) == [True, True]
+    assert server.generation_stats["terminees"] == 2
+
+
+async def test_slow_generation_times_out_with_504(pool):
+    with pytest.raises(HTTPException) as expired:
+        await server.run_in_generation_pool(pool.wait, 5, timeout=0.1)
+    assert expired.value.status_code == 504
+    assert server.generation_stats["expirees"] == 1
+    # La place n'est rendue qu'une fois le calcul abandonné terminé
+    assert server.generation_semaphore.locked() == (server.GENERATION_MAX_CONCURRENT == 1)
+    pool.set()
+    await asyncio.sleep(0.05)
+    assert not server.generation_semaphore.locked()
+
+
+async def test_queue_state_is_exposed_to_admins(api, admin, pool):
+    await server.run_in_generation_pool(pool.set)
+    body = (await api.get("/api/admin/generation-queue", headers=admin)).json()
+    assert (body["terminees"], body["en_cours"], body["executeur"]) == (1, 0, "thread")
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def writer(monkeypatch):
+    # Journal propre au test, vidé par lots de 3 ou après 50 ms
+    monkeypatch.setattr(server, "GUEST_LOG_BATCH_SIZE", 3)
+    monkeypatch.setattr(server, "GUEST_LOG_FLUSH_INTERVAL", 0.05)
+    log_writer = server.GuestLogWriter()
+    monkeypatch.setattr(server, "guest_log_writer", log_writer)
+    yield log_writer
+    await log_writer.close()
+
+
+async def guest_login(api, code, name="Alice"):
+    return await api.post("/api/auth/guest-login", json={"name": name, "code": code})
+
+
+async def test_guest_code_is_cached_and_reloaded_on_mismatch(api, admin, db, writer):
+    code = (await api.get("/api/admin/guest-code", headers=admin)).json()["code"]
+    # Régénération par un autre worker : le code en cache reste accepté jusqu'au TTL...
+    await db.guest_codes.update_one({"id": "singleton"}, {"$set": {"code": "AUTRE1"}})
+    assert (await guest_login(api, code)).status_code == 200
+    # ... et un code inconnu du cache provoque une relecture avant d'être refusé
+    assert (await guest_login(api, "AUTRE1")).status_code == 200
+    assert (await guest_login(api, code)).status_code == 401
+    assert (await guest_login(api, "FAUX00")).status_code == 401
+
+
+async def test_expired_cache_entry_is_reread(api, admin, db, writer, monkeypatch):
+    monkeypatch.setattr(server, "GUEST_CODE_CACHE_TTL", 0)
+    code = (await api.get("/api/admin/guest-code", headers=admin)).json()["code"]
+    await db.guest_codes.update_one({"id": "singleton"}, {"$set": {"expires_at": datetime(2020, 1, 1, tzinfo=timezone.utc)}})
+    response = await guest_login(api, code)
+    assert response.status_code == 401 and "expiré" in response.json()["detail"]
+
+
+async def test_guest_logs_are_written_in_batches(db, writer):
+    entries = [{"id": str(i), "name": f"invité{i}", "code_used": "ABC123", "logged_in_at": datetime.now(timezone.utc)}
+               for i in range(4)]
+    for entry in entries[:3]: writer.add(entry)
+    # Lot complet : un seul insert_many, sans attendre le délai
+    await asyncio.gather(*[task for task in writer.tasks if task is not writer.timer])
+    assert await db.guest_logs.count_documents({}) == 3
+
+    writer.add(entries[3])
+    assert await db.guest_logs.count_documents({}) == 3
+    await asyncio.sleep(0.1)
+    assert await db.guest_logs.count_documents({}) == 4 and not writer.pending
+
+
+async def test_pending_logins_are_listed_before_they_are_written(api, admin, db, writer):
+    code = (await api.get("/api/admin/guest-code", headers=admin)).json()["code"]
+    await guest_login(api, code, "Alice")
+    await guest_login(api, code, "Bruno")
+    assert await db.guest_logs.count_documents({}) == 0
+    logs = (await api.get("/api/admin/guest-logs", headers=admin)).json()
+    assert [log["name"] for log in logs] == ["Bruno", "Alice"]
+    await writer.close()
+    assert await db.guest_logs.count_documents({}) == 2
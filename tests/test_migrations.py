@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_string_dates_are_converted_once(db):
+    await db.players.insert_many([
+        {"id": "a", "nom": "Alice", "created_at": "2024-03-01T10:00:00+00:00"},
+        {"id": "b", "nom": "Bob", "created_at": "2024-03-02T10:00:00"},
+        {"id": "c", "nom": "Chloé", "created_at": "pas une date"},
+    ])
+    await db.guest_codes.insert_one({"id": "g", "code": "123456", "expires_at": "2024-03-05T00:00:00Z"})
+
+    converted = await server.migrate_datetimes()
+    assert (converted["players.created_at"], converted["guest_codes.expires_at"]) == (2, 1)
+    docs = {doc["id"]: doc["created_at"] async for doc in db.players.find()}
+    assert isinstance(docs["a"], datetime) and isinstance(docs["b"], datetime)
+    # Date illisible : laissée telle quelle
+    assert docs["c"] == "pas une date"
+    assert (await server.migrate_datetimes())["players.created_at"] == 0
+
+
+async def test_lists_fill_model_defaults_of_old_documents(api, admin, db):
+    await db.events.insert_one({"id": "ancien", "nom_evenement": "Ancien", "organisateur_id": "x",
+                                "created_at": datetime(2023, 1, 1), "joueurs_presents": []})
+    event = (await api.get("/api/events", headers=admin)).json()[0]
+    assert (event["methode_generation"], event["version"], event["tours_generes"], event["warning_message"]) == \
+        ("aleatoire", 0, [], None)
+    event = (await api.get("/api/events", params={"fields": "id,version"}, headers=admin)).json()[0]
+    assert event == {"id": "ancien", "version": 0}
+
+
+async def test_lists_without_parameters_are_paged(api, admin, create_players, monkeypatch):
+    monkeypatch.setattr(server, "LIST_MAX_LIMIT", 3)
+    ids = await create_players(5)
+    response = await api.get("/api/players", headers=admin)
+    assert [p["id"] for p in response.json()] == ids[:3]
+    response = await api.get("/api/players", params={"cursor": response.headers["x-next-cursor"]}, headers=admin)
+    assert [p["id"] for p in response.json()] == ids[3:]
+    assert "x-next-cursor" not in response.headers
+
+
+async def test_startup_backfills_missing_sub_scores(db, monkeypatch):
+    monkeypatch.setattr(server, "INDEX_DIAGNOSTICS_ON_STARTUP", False)
+    legacy = {"id": "ancien", "nom": "Ancien", "postes": ["Milieu"], "created_at": "2023-01-01T00:00:00",
+              "vitesse": 8.0, "technique": 6.0, "tir": 7.0, "passe": 5.0, "defense": 3.0, "physique": 4.0, "note_generale": 6.0}
+    await db.players.insert_many([legacy, {**legacy, "id": "recent", "nom": "Récent", "score_attaque": 1.0}])
+
+    await server.bootstrap_database()
+    players = {doc["id"]: doc async for doc in db.players.find({}, {"_id": 0})}
+    expected = server.calculate_sub_scores(legacy)
+    assert {k: players["ancien"][k] for k in expected} == pytest.approx(expected)
+    assert isinstance(players["ancien"]["created_at"], datetime)
+    # Les joueurs déjà calculés ne sont pas réécrits
+    assert players["recent"]["score_attaque"] == 1.0
+    assert await server.backfill_player_scores() == 0
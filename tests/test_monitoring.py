@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_http_metrics_use_route_templates(api, admin, create_event):
+    event = await create_event([])
+    await api.get(f"/api/events/{event['id']}", headers=admin)
+    await api.get("/api/events/inexistant", headers=admin)
+    lines = (await api.get("/metrics")).text.splitlines()
+    route = 'methode="GET",route="/api/events/{event_id}"'
+    assert any(line.startswith(f'orga_http_request_duration_seconds_count{{{route},statut="200"}}') for line in lines)
+    assert any(line.startswith(f'orga_http_request_duration_seconds_count{{{route},statut="404"}}') for line in lines)
+    assert f"orga_http_requests_in_flight{{{route}}} 0" in lines
+    assert 'orga_http_requests_in_flight{methode="GET",route="/metrics"} 1' in lines
+    assert not any(event["id"] in line or "status=" in line for line in lines)
+
+
+async def test_login_rehash_task_is_tracked_until_done(api, admin, db, monkeypatch):
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 5)
+    response = await api.post("/api/auth/login", json={"email": "admin@example.fr", "password": "motdepasse"})
+    assert response.status_code == 200
+    assert len(server.rehash_tasks) == 1
+    await asyncio.gather(*server.rehash_tasks)
+    assert not server.rehash_tasks
+    user = await db.users.find_one({"email": "admin@example.fr"})
+    assert user["password_hash"].startswith("$2b$05$")
+
+
+async def test_unknown_email_skips_bcrypt(api, admin):
+    calls = server.auth_stats["bcrypt_appels"]
+    response = await api.post("/api/auth/login", json={"email": "personne@example.fr", "password": "x"})
+    assert response.status_code == 401
+    assert server.auth_stats["bcrypt_appels"] == calls
+
+
+def metric(text, sample):
+    return next((float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(sample + " ")), 0.0)
+
+
+async def test_generation_metrics_count_attempts_and_cache_lookups(api, admin, create_players, create_event):
+    event = await create_event(await create_players(6), methode_generation="recherche_locale")
+    before = (await api.get("/metrics")).text
+    for _ in range(2):
+        await api.post(f"/api/events/{event['id']}/generate", headers=admin)
+    after = (await api.get("/metrics")).text
+    delta = lambda sample: metric(after, sample) - metric(before, sample)
+    assert delta('orga_generation_attempts_total{methode="recherche_locale"}') > 0
+    assert delta('orga_generation_best_score_count{methode="recherche_locale"}') == 1
+    assert (delta('orga_generation_cache_total{resultat="miss"}'), delta('orga_generation_cache_total{resultat="hit"}')) == (1, 1)
@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def collect_pages(api, admin, path, limit, **params):
+    items, pages, cursor = [], 0, None
+    while True:
+        response = await api.get(path, params={"limit": limit, **params, **({"cursor": cursor} if cursor else {})}, headers=admin)
+        assert response.status_code == 200
+        items += response.json()
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None: return items, pages
+
+
+async def test_player_pages_cover_the_list_once(api, admin, create_players):
+    ids = await create_players(7)
+    items, pages = await collect_pages(api, admin, "/api/players", 3)
+    assert pages == 3
+    assert [p["id"] for p in items] == [p["id"] for p in (await api.get("/api/players", headers=admin)).json()]
+    assert sorted(p["id"] for p in items) == sorted(ids)
+
+
+async def test_event_pages_are_newest_first(api, admin, create_event):
+    events = [await create_event([], nom_evenement=f"match {i}") for i in range(5)]
+    items, pages = await collect_pages(api, admin, "/api/events", 2)
+    assert pages == 3
+    assert [e["id"] for e in items] == [e["id"] for e in reversed(events)]
+    assert all("share_snapshot" not in e for e in items)
+
+
+async def test_fields_projection_and_ndjson(api, admin, create_players):
+    await create_players(4)
+    items, _ = await collect_pages(api, admin, "/api/players", 10, fields="nom,note_generale")
+    assert all(set(p) == {"nom", "note_generale"} for p in items)
+    response = await api.get("/api/players", params={"format": "ndjson", "fields": "nom"}, headers=admin)
+    assert [json.loads(line) for line in response.text.splitlines()] == [{"nom": p["nom"]} for p in items]
+    assert (await api.get("/api/players", params={"fields": "inconnu"}, headers=admin)).status_code == 400
+
+
+async def test_invalid_cursor_is_rejected(api, admin):
+    response = await api.get("/api/players", params={"limit": 2, "cursor": "pas-un-curseur"}, headers=admin)
+    assert response.status_code == 400
+
+
+async def import_csv(api, admin, content):
+    return await api.post("/api/players/import", params={"format": "csv"}, content=content.encode(), headers=admin)
+
+
+async def players_by_name(api, admin):
+    return {p["nom"]: p for p in (await api.get("/api/players", headers=admin)).json()}
+
+
+async def test_csv_import_creates_and_reports_errors(api, admin):
+    response = await import_csv(api, admin, "nom,postes,vitesse,tir\nAlice,Attaquant|Milieu,8,7\nBob,,11,5\nChloé,Défenseur,6,\n")
+    body = response.json()
+    assert (body["lignes"], body["crees"], body["erreurs"]) == (3, 2, 1)
+    assert body["details_erreurs"][0]["ligne"] == 3
+    players = await players_by_name(api, admin)
+    assert players["Alice"]["postes"] == ["Attaquant", "Milieu"]
+    assert players["Chloé"]["tir"] == 5.0
+
+
+async def test_csv_reimport_keeps_unsupplied_attributes(api, admin):
+    await import_csv(api, admin, "nom,postes,vitesse,tir,defense\nAlice,Milieu,9,8,2\n")
+    before = (await players_by_name(api, admin))["Alice"]
+    response = await import_csv(api, admin, "nom,postes,tir\nAlice,Milieu,3\n")
+    assert response.json()["mis_a_jour"] == 1
+    after = (await players_by_name(api, admin))["Alice"]
+    assert (after["vitesse"], after["defense"], after["tir"]) == (9.0, 2.0, 3.0)
+    assert after["id"] == before["id"]
+    assert after["note_generale"] < before["note_generale"]
+
+
+async def test_csv_multiline_cells_and_unterminated_quote(api, admin):
+    response = await import_csv(api, admin, 'nom,postes,vitesse\n"Jean\nDupont",Milieu,7\n"Léa, dite ""la fusée""",Attaquant,9\n')
+    assert (response.json()["crees"], response.json()["erreurs"]) == (2, 0)
+    assert {"Jean\nDupont", 'Léa, dite "la fusée"'} <= set(await players_by_name(api, admin))
+
+    response = await import_csv(api, admin, 'nom,postes,vitesse\nMarc,Milieu,5\n"Paul,Milieu,6\n')
+    body = response.json()
+    assert (body["crees"], body["erreurs"]) == (1, 1)
+    assert body["details_erreurs"][0] == {"ligne": 3, "erreurs": ["guillemet non fermé en fin de fichier"]}
+
+
+async def test_ndjson_import_keeps_the_last_row_of_a_name(api, admin):
+    lines = [{"nom": "Alice", "postes": ["Milieu"], "vitesse": 8}, {"nom": "Alice", "postes": ["Milieu"], "vitesse": 6},
+             "pas du json", {"nom": "Bob", "postes": ["Gardien"]}]
+    content = "\n".join(json.dumps(line) if isinstance(line, dict) else line for line in lines)
+    response = await api.post("/api/players/import", params={"format": "ndjson"}, content=content.encode(), headers=admin)
+    body = response.json()
+    # Dernière occurrence d'un nom gagnante dans un même lot
+    assert (body["crees"], body["erreurs"]) == (2, 1)
+    assert (await players_by_name(api, admin))["Alice"]["vitesse"] == 6.0
+
+
+async def test_homonyms_are_allowed_and_imports_match_on_id(api, admin):
+    first = (await api.post("/api/players", json={"nom": "Alice", "postes": ["Milieu"]}, headers=admin)).json()
+    response = await api.post("/api/players", json={"nom": "Alice", "postes": ["Gardien"]}, headers=admin)
+    assert response.status_code == 200
+    second = response.json()
+    bob = (await api.post("/api/players", json={"nom": "Bob", "postes": ["Milieu"]}, headers=admin)).json()
+    assert (await api.put(f"/api/players/{bob['id']}", json={"nom": "Alice"}, headers=admin)).status_code == 200
+
+    # Sans id, un nom porté par plusieurs joueurs est rapporté ligne par ligne
+    response = await import_csv(api, admin, "nom,postes,vitesse\nAlice,Milieu,9\nZoé,Milieu,4\n")
+    body = response.json()
+    assert (body["crees"], body["mis_a_jour"], body["erreurs"]) == (1, 0, 1)
+    assert body["details_erreurs"][0]["ligne"] == 2 and "ambigu" in body["details_erreurs"][0]["erreurs"][0]
+
+    response = await import_csv(api, admin, f"id,nom,postes,vitesse\n{second['id']},Alice,Gardien,9\n,Zoé,Milieu,7\n")
+    assert (response.json()["crees"], response.json()["mis_a_jour"]) == (0, 2)
+    players = {p["id"]: p for p in (await api.get("/api/players", headers=admin)).json()}
+    assert (players[second["id"]]["vitesse"], players[first["id"]]["vitesse"]) == (9.0, 5.0)
+    assert [p["vitesse"] for p in players.values() if p["nom"] == "Zoé"] == [7.0]
+
+
+async def test_csv_export_round_trip(api, admin):
+    await import_csv(api, admin, 'nom,postes,vitesse\n"Jean\nDupont",Milieu|Attaquant,7\n')
+    exported = (await api.get("/api/players/export", headers=admin)).text
+    jean = (await players_by_name(api, admin))["Jean\nDupont"]
+    await api.delete(f"/api/players/{jean['id']}", headers=admin)
+    response = await import_csv(api, admin, exported)
+    assert (response.json()["crees"], response.json()["erreurs"]) == (1, 0)
+    assert (await players_by_name(api, admin))["Jean\nDupont"]["postes"] == ["Milieu", "Attaquant"]
@@ -0,0 +1,42 @@
+from collections import deque
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def profiled(api, headers, path="/api/players"):
+    return await api.get(path, headers={**headers, "X-Profile": "1"})
+
+
+async def test_admin_request_is_profiled_and_downloadable(api, admin, create_players, create_event):
+    event = await create_event(await create_players(8))
+    response = await api.post(f"/api/events/{event['id']}/generate", headers={**admin, "X-Profile": "1"})
+    profile_id = response.headers["x-profile-id"]
+
+    summary = (await api.get(f"/api/admin/profiles/{profile_id}", headers=admin)).json()
+    assert (summary["methode"], summary["chemin"], summary["raison"], summary["statut"]) == \
+        ("POST", f"/api/events/{event['id']}/generate", "admin", 200)
+    assert summary["duree_ms"] > 0 and "generation" in summary["attente_ms"]
+    assert sum(summary["piles"].values()) == summary["echantillons"]
+
+    response = await api.get(f"/api/admin/profiles/{profile_id}", params={"format": "collapsed"}, headers=admin)
+    assert response.headers["content-type"].startswith("text/plain")
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in response.text.splitlines())
+
+
+async def test_profile_header_is_ignored_for_non_admins(api):
+    token = server.create_access_token({"sub": "guest_alice", "role": "co-organisateur", "name": "Alice"})
+    response = await profiled(api, {"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200 and "x-profile-id" not in response.headers
+    assert "x-profile-id" not in (await api.get("/api/players", params={"profile": 1})).headers
+
+
+async def test_ring_buffer_keeps_the_latest_profiles(api, admin, monkeypatch):
+    monkeypatch.setattr(server, "profiles_buffer", deque(maxlen=2))
+    ids = [(await profiled(api, admin)).headers["x-profile-id"] for _ in range(3)]
+    listed = (await api.get("/api/admin/profiles", headers=admin)).json()
+    assert [p["id"] for p in listed] == ids[:0:-1]
+    assert (await api.get(f"/api/admin/profiles/{ids[0]}", headers=admin)).status_code == 404